@@ -12,734 +12,392 @@
 # fields, which have been populated with values and scores pertaining to the spatial relationships between the parcels and each of the 5 factors.
 # Two more fields contian the values for the parcel's summed Conservation Priority Score and it's Conservation Priority Ranking.
 
+# The geoprocessing can be run with arcpy (the default), or without ArcGIS using the open backend (Shapely, GeoPandas and pyogrio, see open_backend.py):
+#   python Conservation_Priority_Ranking.py --backend open
+# With the open backend the workspace is a GeoPackage instead of a Geodatabase, or a folder ending in .parquet or .arrow to write the parcels and intermediate data
+# as GeoParquet or Arrow files, with one row group per township (see parquet_io.py). parquet_io.py also converts ParcelsFinal from a Geodatabase.
+
 
 # ##### Notes on the script and its limitations, as a result of the short project timeline #####
 
 # When a very large area of interest is used, there is the possibility that an ArcGIS Topoengine error will occur. Although the definite cause of this has not been verified, it may be a result of
 # ArcGIS running out of memory in it's temporary workspace for geoproccessing. For reference, this error occured when testing the script for the entire Stettler county (approx 4350 km^2).
+# For large areas, use --tile-parcels N to geoprocess the parcels in tiles of whole townships with at most N parcels each (eg. 2000), so the clips, erases and tabulations
+# depend on N instead. The intact patches within 50 km are built once for the whole area of interest, a 20 km square of footprint at a time (see tiling.py).
 
-# It is important that the Area of interest polygon is in a projected coordinate system with linear units (meters). An automated method for assessing the current coordinate system and
-# projecting it accordingly has not yet been developed.
-
-# Decile statistical classification was used for scoring Lotic, Wetlands, and Quartiles were used to classify the priority ranking. A method for automatedly classifying by natural breaks, or otherwise,
-# has not yet been developed.
-
-# A method for including additional, optional conservation factors (eg. mammal habitat) has not yet been developed.
-
-# The ability to adjust distances for proximity scoring has not yet been developed.
-
-# The ability to exclude specific human footprint types has not yet been developed.
-
-# Because of topological errors in the orginal human footprint government data there are tiny gaps in that erroneously connect distinct polygons. This is addressed by buffering the human footprint polygons
-# before creating the inverse (intactness). Unfortunatley, this causes the script to crash, which is likely also due to the memory limit in the ArcGIS temporary workspace.
-# As a result, the buffer is not included in this version of the script and some of the intact patches are larger than would be considered realistic.
+# Use --workers N to run the factor geoprocessing chains in N processes at once (see scheduler.py). Each process writes to its own scratch workspace next to the
+# main workspace, and the time each chain took is printed at the end.
 
+# Use --cache FOLDER to keep the selected parcels and the geoprocessing results of each factor between runs (see cache.py). Rerunning an area of interest whose
+# inputs have not changed (eg. to try a different classification) then skips the geoprocessing. --cache-size limits the size of the cache in GB (default 5).
 
+# Use --incremental FOLDER to keep a snapshot of the metrics and of the input layers there (see incremental.py). When the same area of interest is run
+# again after some of the layers were refreshed, only the metrics that depend on them are computed again, and only for the parcels near the features
+# that changed (the largest patch is always computed again for every parcel when the human footprint changed).
 
+# Use --patch-index FILE.gpkg to look up intact patches in a province-wide index built once per human footprint release with patch_index.py, instead of
+# buffering, clipping, erasing and exploding the footprint around the area of interest on every run. Patches then have their true area, even where they extend
+# further than 50 km from the area of interest. A run stops with an error when the index was built from another footprint than the one given.
 
-# START SCRIPT #
+# Use --parcel-index FILE.gpkg to select the parcels from a province-wide index of the quarter sections built once with parcel_index.py (projected, without the road rows,
+# with a packed R-tree of their boxes), so only the parcels near the area of interest are read and tested. With the index, --townships MER-RGE-TWP,... selects whole
+# townships by their keys instead of by an area of interest polygon (none is asked for), and the outline of their parcels is used as the area of interest.
 
-# first import arcpy
-import arcpy
+# Use --metrics-out FILE (.npz, .arrow, .feather or .parquet) to also save the per-parcel metrics and scores to a table. rescore.py scores that table (or
+# ParcelsFinal itself) again with different thresholds, weights or classifications, and runs sensitivity sweeps, without any geoprocessing.
 
-# This section of the script obtains user input for all required perameters of the Priority Ranking function
-# The existence and data type of each input is validated
+# Use --incidence FOLDER (open backend) to also save the parcel x feature matrix of every layer overlaid with the parcels there, one .npz per layer (see incidence.py),
+# so new per-parcel metrics can be computed from them later without any geoprocessing.
 
-#Parameters are set for valid data types supplied by user
-validDataTypes = ["FeatureDataset", "ShapeFile", "FeatureClass"]
+# Use --profile FILE.jsonl to time every stage of a run (each geoprocessing tool, factor and tile, scoring and the write back) with its CPU time, memory and row counts,
+# and --trace FILE.json for the same as a Chrome trace (see instrumentation.py). The slowest stages are printed at the end.
 
-# USER INPUT: Workspace
-workspace = raw_input("Enter path to the environment workspace for intermediate data and results (Geodatabase):")
+# The coordinate system of every input is checked before any geoprocessing (see projection.py). An input with no coordinate system stops the run, and an Area of interest polygon
+# in any coordinate system other than NAD 1983 10TM AEP Forest is projected into the workspace first. Use --projected-layers FOLDER to keep projected copies of the provincial layers
+# that are in another coordinate system (eg. the quarter sections), so they are projected once per version of the layer instead of on every run.
 
-while workspace[-3:] != "gdb" or arcpy.Exists(workspace) == False:
-    workspace = raw_input("Input is invalid or does not exist, please re-enter file path to workspace (Geodatabase):")
-print("workspace OK...")
+# By default, Decile statistical classification is used for scoring Lotic, Wetlands, and Quartiles are used to classify the priority ranking. Each of these can instead be
+# classified by natural breaks (Fisher-Jenks) or a different number of quantiles, when prompted for the classification methods.
 
+# Additional, optional conservation factors (eg. mammal habitat) can be added with --factors FILE.json, which declares the input layer, metric, classifier and weight
+# of each of them (see factors.py). Their layers are tabulated in the same overlay as the built in factors, and their weighted scores are added to PRIORITY_SCORE.
 
-# USER INPUT: Area of interest polygon
-areaOfInterest = raw_input("Enter file path for 'area of interest' polygon:")
+# Protected areas are only searched for within 4000 m of each parcel (the last proximity threshold), parcels with none that close are given a null distance and score 0.
+# Use --proximity-radius to search further. The proximity thresholds themselves can be changed with rescore.py --thresholds, as long as the search radius is not less
+# than the last threshold.
 
-while arcpy.Exists(areaOfInterest) == False:
-    areaOfInterest = raw_input("Input does not exist. Please re-enter file path to 'area of interest' polygon:")
-desc = arcpy.Describe(areaOfInterest)
+# The ability to exclude specific human footprint types has not yet been developed.
 
-dataType = desc.dataType
-while dataType not in validDataTypes:
-    areaOfInterest = raw_input("Input is not the correct data type. Please re-enter file path for the 'area of interest' polygon:")
-print("Area of interest OK...")
+# Because of topological errors in the orginal human footprint government data there are tiny gaps in that erroneously connect distinct polygons. This is addressed by buffering the human footprint polygons
+# before creating the inverse (intactness). Unfortunatley, this causes the script to crash, which is likely also due to the memory limit in the ArcGIS temporary workspace.
+# As a result, the buffer is not included in the vector version of the script by default and some of the intact patches are larger than would be considered realistic.
+# Use --footprint-gap METERS to close the gaps narrower than METERS in the vector version too: the footprint is repaired in chunks, so memory stays bounded however large
+# it is, and the repaired footprint is kept in --prepared-footprints FOLDER (by default next to the workspace), so only the first run after a new release repairs it (see footprint_prep.py).
+# A --patch-index used with it must be built from the repaired footprint.
+# Use --engine raster to compute intactness and patch size on a grid of --cell-size meters instead (25 by default, see raster.py), which is much faster than Erase
+# and is where the buffer can be applied again, with --footprint-buffer METERS. Areas are then accurate to about one cell along the edges of the footprint.
 
 
-# USER INPUT: Alberta Riparian(Lotic) polygon data
-albertaloticRiparian = raw_input("Enter filepath for the Alberta Riparian/Lotic data")
 
-while arcpy.Exists(albertaloticRiparian) == False:
-    albertaloticRiparian = raw_input("Input does not exist. Please re-enter file path for the Alberta Riparian/Lotic data:")
-desc = arcpy.Describe(albertaloticRiparian)
-dataType = desc.dataType
 
-while dataType not in validDataTypes:
-    albertaloticRiparian = raw_input("Input is not the correct data type.  Please re-enter file path for the Alberta Riparian/Lotic data:")
-print("Riparian input OK...")
+# START SCRIPT #
 
+import argparse
+import os
 
-# USER INPUT: Alberta Wetlands data
-albertaMergedWetlandInventory = raw_input("Enter filepath for the Alberta Wetlands data")
+from backends import BACKENDS, get_backend, get_backend_class
+from scoring import CLASSIFIED_FACTORS, classifier_for
 
-while arcpy.Exists(albertaMergedWetlandInventory) == False:
-    albertaMergedWetlandInventory = raw_input("Input does not exist. Please re-enter file path for the Alberta wetlands data:")
-desc = arcpy.Describe(albertaMergedWetlandInventory)
+# raw_input was renamed to input in python 3
+try:
+    raw_input
+except NameError:
+    raw_input = input
 
-dataType = desc.dataType
-while dataType not in validDataTypes:
-    albertaMergedWetlandInventory = raw_input("Input is not the correct data type. Please re-enter file path for the Alberta wetlands data:")
-print("Wetland input OK...")
 
+# This section of the script obtains user input for all required perameters of the Priority Ranking function
+# The existence and data type of each input is validated by the geoprocessing backend
+
+# USER INPUT: a dataset (feature class, shapefile or feature dataset). Asks again until the input exists and is the correct data type.
+def ask_for_dataset(backend, prompt, description):
+    dataset = raw_input(prompt)
+    while True:
+        if backend.exists(dataset) == False:
+            dataset = raw_input("Input does not exist. Please re-enter file path for " + description + ":")
+        elif backend.is_feature_data(dataset) == False:
+            dataset = raw_input("Input is not the correct data type. Please re-enter file path for " + description + ":")
+        else:
+            return dataset
 
-# USER INPUT: Alberta Quarter section boundaries data
-quarterSectionBoundaries = raw_input("Enter filepath for the Alberta Quarter Section data")
 
-while arcpy.Exists(quarterSectionBoundaries) == False:
-    quarterSectionBoundaries = raw_input("Input does not exist. Please re-enter file path for the Alberta Quarter Section data:")
-desc = arcpy.Describe(quarterSectionBoundaries)
-dataType = desc.dataType
+# USER INPUT: all of the inputs main() needs, returned in the order of its arguments
+# The area of interest is not asked for when ask_area_of_interest is False (it is then None)
+def ask_for_inputs(backend_name, ask_area_of_interest=True):
+    backend_class = get_backend_class(backend_name)
 
-while dataType not in validDataTypes:
-    quarterSectionBoundaries = raw_input("Input is not the correct data type.  Please re-enter file path for the Alberta Quarter Section data:")
-print("Alberta Quarter Section input OK...")
+    # USER INPUT: Workspace
+    workspace = raw_input("Enter path to the environment workspace for intermediate data and results (" + backend_class.workspace_description + "):")
 
+    while backend_class.is_workspace(workspace) == False:
+        workspace = raw_input("Input is invalid or does not exist, please re-enter file path to workspace (" + backend_class.workspace_description + "):")
+    print("workspace OK...")
+    backend = backend_class(workspace)
 
-# USER INPUT: Alberta Parks and Protected Areas data
-parksProtectedAreasAlberta = raw_input("Enter filepath for the Alberta Parks and Protected Areas data")
+    # USER INPUT: Area of interest polygon
+    areaOfInterest = None
+    if ask_area_of_interest:
+        areaOfInterest = ask_for_dataset(backend, "Enter file path for 'area of interest' polygon:", "the 'area of interest' polygon")
+        print("Area of interest OK...")
 
-while arcpy.Exists(parksProtectedAreasAlberta) == False:
-    parksProtectedAreasAlberta = raw_input("Input does not exist. Please re-enter file path for the Alberta Parks and Protected Areas data:")
-desc = arcpy.Describe(parksProtectedAreasAlberta)
-dataType = desc.dataType
+    # USER INPUT: Alberta Riparian(Lotic) polygon data
+    albertaloticRiparian = ask_for_dataset(backend, "Enter filepath for the Alberta Riparian/Lotic data", "the Alberta Riparian/Lotic data")
+    print("Riparian input OK...")
 
-while dataType not in validDataTypes:
-    parksProtectedAreasAlberta = raw_input("Input is not the correct data type.  Please re-enter file path for the Alberta Parks and Protected Areas data:")
-print("Parks and Protected Areas input OK...")
+    # USER INPUT: Alberta Wetlands data
+    albertaMergedWetlandInventory = ask_for_dataset(backend, "Enter filepath for the Alberta Wetlands data", "the Alberta wetlands data")
+    print("Wetland input OK...")
 
+    # USER INPUT: Alberta Quarter section boundaries data
+    quarterSectionBoundaries = ask_for_dataset(backend, "Enter filepath for the Alberta Quarter Section data", "the Alberta Quarter Section data")
+    print("Alberta Quarter Section input OK...")
 
-# USER INPUT: Alberta Human Footprint data
-humanFootprint = raw_input("Enter filepath for the Alberta Human Footprint data")
+    # USER INPUT: Alberta Parks and Protected Areas data
+    parksProtectedAreasAlberta = ask_for_dataset(backend, "Enter filepath for the Alberta Parks and Protected Areas data", "the Alberta Parks and Protected Areas data")
+    print("Parks and Protected Areas input OK...")
 
-while arcpy.Exists(humanFootprint) == False:
-    humanFootprint = raw_input("Input does not exist. Please re-enter file path for the Alberta Human Footprint data:")
-desc = arcpy.Describe(humanFootprint)
-dataType = desc.dataType
+    # USER INPUT: Alberta Human Footprint data
+    humanFootprint = ask_for_dataset(backend, "Enter filepath for the Alberta Human Footprint data", "the Alberta Human Footprint data")
+    print("Human Footprint input OK...")
 
-while dataType not in validDataTypes:
-    humanFootprint = raw_input("Input is not the correct data type.  Please re-enter file path for the Alberta Human Footprint data:")
-print("Human Footprint input OK...")
+    # USER INPUT (optional): classification method for the Lotic, Wetland and priority ranking scores
+    classifiers = {}
+    for factor in CLASSIFIED_FACTORS:
+        while True:
+            method = raw_input("Enter classification method for " + factor + " (deciles, quartiles, quantiles:N, jenks, jenks:N), or press Enter for the default:")
+            if method == "":
+                break
+            try:
+                classifiers[factor] = classifier_for(factor, method)
+                break
+            except ValueError as error:
+                print(error)
+    print("Classification methods OK...")
 
+    return workspace, areaOfInterest, albertaloticRiparian, albertaMergedWetlandInventory, quarterSectionBoundaries, parksProtectedAreasAlberta, humanFootprint, classifiers
 
 
 
 
-# Now our main function is defined. This is the only function, and as long as all the perameters are correctly provided, it should produce the desired result
+# Now our main function is defined. As long as all the perameters are correctly provided, it should produce the desired result
 # (along with intermediate data)
-def main(workspace, areaOfInterest, albertaloticRiparian, albertaMergedWetlandInventory, quarterSectionBoundaries, parksProtectedAreasAlberta, humanFootprint):
+# classifiers is an optional dictionary that replaces the default classifier of any factor (see scoring.py)
+# backend is the geoprocessing backend to use (see backends.py), arcpy by default
+# tile_parcels is the largest number of parcels geoprocessed at once (see tiling.py), by default all of them are processed together
+# workers is the number of processes the factor chains are run in (see scheduler.py), by default they are run one after the other in this process
+# cache is an optional cache.IntermediateCache, which keeps geoprocessing results between runs
+# metrics_out is an optional metrics table file the metrics and scores are also saved to (see metrics_table.py)
+# proximity_radius is the distance (meters) protected areas are searched for within, 4000 by default (see proximity.py)
+# engine is "vector" (the default) or "raster" for intactness and patch size, cell_size and footprint_buffer (meters) are the raster engine's settings (see raster.py)
+# instrumentation is an optional instrumentation.Instrumentation that records the time of every stage
+# incremental is an optional folder for a snapshot of the metrics, so later runs only compute the metrics whose inputs changed (see incremental.py)
+# patch_index is an optional province-wide index of intact patches the patch sizes are looked up in (see patch_index.py)
+# factors are the extra conservation factors to measure and score (see factors.py), the registered ones by default
+# projected_layers is an optional folder to keep projected copies of the provincial layers in (see projection.py)
+# incidence is an optional folder to save the incidence matrices of the overlays in (open backend only, see incidence.py)
+# parcel_index is an optional index of the quarter sections the parcels are selected from, townships optional (MER, RGE, TWP) townships to select
+# from it instead of by areaOfInterest, which is then None (see parcel_index.py)
+# footprint_gap (meters) closes the gaps of the human footprint narrower than that, the repaired footprint is kept in prepared_footprints (see footprint_prep.py)
+# Returns the metrics and scores of the parcels (a table_io.ColumnStore)
+def main(workspace, areaOfInterest, albertaloticRiparian, albertaMergedWetlandInventory, quarterSectionBoundaries, parksProtectedAreasAlberta, humanFootprint, classifiers=None, backend=None, tile_parcels=None, workers=None, cache=None, metrics_out=None, proximity_radius=None, engine="vector", cell_size=None, footprint_buffer=None, instrumentation=None, incremental=None, patch_index=None, factors=None, projected_layers=None, footprint_gap=None, prepared_footprints=None, incidence=None, parcel_index=None, townships=None):
 
     # Import necesarry modules
-    import numpy as np
-    import arcpy
-
-    # Overwrite output and checkout neccesary extensions
-    arcpy.env.overwriteOutput = True
-    arcpy.CheckOutExtension("spatial")
-
-    # assign workspace
-    arcpy.env.workspace = workspace
+    from factors import registered_factors
+    from pipeline import Inputs, compute_metrics, engine_parameters
+    from projection import ProjectedLayers, prepare_inputs
+    from scheduler import compute_metrics_parallel
+    from scoring import score_fields, score_parcels
+    from tiling import compute_metrics_tiled
+
+    if tile_parcels and workers:
+        raise ValueError("tile_parcels and workers can not be used together")
+    if townships and not parcel_index:
+        raise ValueError("townships are selected from a parcel index")
+    if incremental and (tile_parcels or workers):
+        raise ValueError("incremental can not be used with tile_parcels or workers")
+
+    if factors is None:
+        factors = registered_factors()
+    if backend is None:
+        backend = get_backend("arcpy", workspace)
+    if incidence:
+        if backend.name != "open" or workers:
+            raise ValueError("incidence matrices are only saved by the open backend, without workers")
+        if not os.path.isdir(incidence):
+            os.makedirs(incidence)
+        backend.incidence_folder = incidence
+    if instrumentation:
+        from instrumentation import InstrumentedBackend
+        backend = InstrumentedBackend(backend, instrumentation)
+
+    # Overwrite output, checkout neccesary extensions and assign workspace
+    backend.start()
+
+    # The coordinate system of every input is checked, and the inputs that are not in NAD 1983 10TM AEP Forest are projected (see projection.py)
+    inputs = Inputs(areaOfInterest, albertaloticRiparian, albertaMergedWetlandInventory, quarterSectionBoundaries, parksProtectedAreasAlberta, humanFootprint)
+    # the parcels are selected from the parcel index (already projected) instead of the quarter sections
+    if parcel_index:
+        from parcel_index import PARCEL_INDEX_LAYER, ParcelIndex, select_parcels
+        parcel_index = ParcelIndex(parcel_index)
+        parcel_index.check(backend, quarterSectionBoundaries)
+        inputs = inputs._replace(quarterSectionBoundaries=backend.dataset_path(parcel_index.path, PARCEL_INDEX_LAYER))
+    inputs = prepare_inputs(backend, inputs, ProjectedLayers(projected_layers) if projected_layers else None)
+
+    # The gaps of the human footprint are closed once per footprint release, and the repaired footprint is used instead (see footprint_prep.py)
+    if footprint_gap:
+        from footprint_prep import PreparedFootprints
+        if prepared_footprints is None:
+            prepared_footprints = os.path.join(os.path.dirname(os.path.abspath(workspace)), "prepared_footprints")
+        inputs = inputs._replace(humanFootprint=PreparedFootprints(prepared_footprints, gap=footprint_gap).prepared(backend, inputs.humanFootprint))
 
     # First we project our parcel data into the correct projection, create a layer file, then select only parcels we are interested in with Select by Attribute
     # and Select by Location (Intersecting tht Area of Interest polygon), then export this selection to a new feature class called "ParcelsFinal"
 
     # Local Variables
-    quarterSectionBoundaries_project = "quarterSectionBoundaries_project"
-    quarterSectionBoundaries_project_layer = "quarterSectionBoundaries_project_layer"
     ParcelsFinal = "ParcelsFinal"
 
-    # Process: Project
-    arcpy.Project_management(quarterSectionBoundaries, quarterSectionBoundaries_project, "PROJCS['NAD_1983_10TM_AEP_Forest',GEOGCS['GCS_North_American_1983',DATUM['D_North_American_1983',SPHEROID['GRS_1980',6378137.0,298.257222101]],PRIMEM['Greenwich',0.0],UNIT['Degree',0.0174532925199433]],PROJECTION['Transverse_Mercator'],PARAMETER['False_Easting',500000.0],PARAMETER['False_Northing',0.0],PARAMETER['Central_Meridian',-115.0],PARAMETER['Scale_Factor',0.9992],PARAMETER['Latitude_Of_Origin',0.0],UNIT['Meter',1.0]]", "", "GEOGCS['GCS_North_American_1983',DATUM['D_North_American_1983',SPHEROID['GRS_1980',6378137.0,298.257222101]],PRIMEM['Greenwich',0.0],UNIT['Degree',0.0174532925199433]]", "NO_PRESERVE_SHAPE", "", "NO_VERTICAL")
-
-    # Process: Make Feature Layer
-    arcpy.MakeFeatureLayer_management(quarterSectionBoundaries_project, quarterSectionBoundaries_project_layer, "", "", "OBJECTID OBJECTID VISIBLE NONE;Shape Shape VISIBLE NONE;MER MER VISIBLE NONE;RGE RGE VISIBLE NONE;TWP TWP VISIBLE NONE;SEC SEC VISIBLE NONE;QS QS VISIBLE NONE;RA RA VISIBLE NONE;PARCEL_ID PARCEL_ID VISIBLE NONE;Shape_length Shape_length VISIBLE NONE;Shape_area Shape_area VISIBLE NONE")
-
-    # selects all parcels intersecting the users area of interest
-    # Process: Select Layer By Location
-    arcpy.SelectLayerByLocation_management(quarterSectionBoundaries_project_layer, "INTERSECT", areaOfInterest, "", "NEW_SELECTION", "NOT_INVERT")
-
-    # Removes roads from parcel data to ensure that only quarter sections are selected
-    # Process: Select Layer By Attribute
-    arcpy.SelectLayerByAttribute_management(quarterSectionBoundaries_project_layer, "SUBSET_SELECTION", "RA NOT LIKE 'R'")
-
-    # Process: Copy Features
-    arcpy.CopyFeatures_management(quarterSectionBoundaries_project_layer, ParcelsFinal, "", "0", "0", "0")
-
-
-    # ############### ArcGis MODEL BUILDER SECTION: for initial Geoproccessing #################################################################################################################
-
-
-    # The following was exported from ArcMap's Model builder. It performs most of the neccessary geoprocessing needed to determine the spatial relationships
-    # between the parcels and the user provided data (Human footprint, Lotic(Riparian), Wetlands, Patch Size, and Proximity)
-
-    # local Variables:
-    footprint_EXTENT_CLIPPED = "Footprint_Extent_Clipped"
-    Footprint_Inverse = "Footprint_Inverse"
-    Intact_Area_Per_Parcel = "Intact_Area_Per_Parcel"
-    Wetland_Extent_Clipped = "Wetland_Extent_Clipped"
-    Wetland_Lines = "Wetland_Lines"
-    Wetland_Edge_Per_Parcel = "Wetland_Edge_Per_Parcel"
-    Lotic_Extent_Clipped = "Lotic_Extent_Clipped"
-    Lotic_No_Wetlands = "Lotic_No_Wetlands"
-    Lotic_Area_Per_Parcel = "Lotic_Area_Per_Parcel"
-    Area_Of_Interest_Buffered = "Area_Of_Interest_Buffered"
-    Footprint_Larger_Extent = "Footprint_Larger_Extent"
-    Footprint_INVERSE_Large = "Footprint_INVERSE_Large"
-    Footprint_INVERSE_Large_Explode = "Footprint_INVERSE_Large_Explode"
-
-    # Process: Clip
-    arcpy.Clip_analysis(humanFootprint, ParcelsFinal, footprint_EXTENT_CLIPPED, "")
-
-    # Process: Erase
-    arcpy.Erase_analysis(ParcelsFinal, footprint_EXTENT_CLIPPED, Footprint_Inverse, "")
-
-    #
-    # Process: Tabulate Intersection
-    arcpy.TabulateIntersection_analysis(ParcelsFinal, "OBJECTID", Footprint_Inverse, Intact_Area_Per_Parcel, "", "", "", "UNKNOWN")
-
-    # Process: Clip (3)
-    arcpy.Clip_analysis(albertaMergedWetlandInventory, ParcelsFinal, Wetland_Extent_Clipped, "")
-
-    # Process: Feature To Line
-    arcpy.FeatureToLine_management(Wetland_Extent_Clipped, Wetland_Lines, "", "ATTRIBUTES")
-    ##arcpy.FeatureToLine_management("'D:\\evanamiesgalonskiMOBILE\\1 Courses\\329\\Final Project\\DATA\\test results.gdb\\Wetland_Extent_Clipped'", Wetland_Lines, "", "ATTRIBUTES")
-
-    # Process: Tabulate Intersection (2)
-    arcpy.TabulateIntersection_analysis(ParcelsFinal, "OBJECTID", Wetland_Lines, Wetland_Edge_Per_Parcel, "", "", "", "UNKNOWN")
-
-    # Process: Clip (4)
-    arcpy.Clip_analysis(albertaloticRiparian, ParcelsFinal, Lotic_Extent_Clipped, "")
-
-    # Process: Erase (2)
-    arcpy.Erase_analysis(Lotic_Extent_Clipped, Wetland_Extent_Clipped, Lotic_No_Wetlands, "")
-
-    # Process: Tabulate Intersection (3)
-    arcpy.TabulateIntersection_analysis(ParcelsFinal, "OBJECTID", Lotic_No_Wetlands, Lotic_Area_Per_Parcel, "", "", "", "UNKNOWN")
-
-    # Process: Buffer
-    arcpy.Buffer_analysis(areaOfInterest, Area_Of_Interest_Buffered, "50 Kilometers", "FULL", "ROUND", "NONE", "", "PLANAR")
-
-    # Process: Clip (2)
-    arcpy.Clip_analysis(humanFootprint, Area_Of_Interest_Buffered, Footprint_Larger_Extent, "")
-
-    # Process: Erase (3)
-    arcpy.Erase_analysis(Area_Of_Interest_Buffered, Footprint_Larger_Extent, Footprint_INVERSE_Large, "")
-
-    # Process: Multipart To Singlepart
-    arcpy.MultipartToSinglepart_management(Footprint_INVERSE_Large, Footprint_INVERSE_Large_Explode)
-
-    # ###########################################################################################################################################################################
-
-
-    # This part of the script edits the nwely created tables that contain information about the instersection of Wetlands, Lotic, and Intactness data with the land parcels
-    # The Area and Percent coverage fields are renamed to be more decriptive and to ensure there are no confusing duplicate field names in our ParcelsFinal feature class.
-
-    # Alter Field names in intactness table
-    arcpy.AlterField_management(Intact_Area_Per_Parcel, "AREA", new_field_name = "Area_Intact", field_is_nullable = "NULLABLE")
-    arcpy.AlterField_management(Intact_Area_Per_Parcel, "PERCENTAGE", new_field_name = "Percent_Intact", field_is_nullable = "NULLABLE")
-
-    # Alter field names in lotic_table
-    arcpy.AlterField_management(Lotic_Area_Per_Parcel, "AREA", new_field_name = "Area_Lotic", field_is_nullable = "NULLABLE")
-    arcpy.AlterField_management(Lotic_Area_Per_Parcel, "PERCENTAGE", new_field_name = "Percent_Lotic", field_is_nullable = "NULLABLE")
-
-    # Alter Field name in wetlands_table
-    arcpy.AlterField_management(Wetland_Edge_Per_Parcel, "LENGTH", new_field_name = "Wetland_Edge", field_is_nullable = "NULLABLE")
-
-
-    # Now we will join the desired fields from the 3 tables (intactness, lotic, ad wetlands) to the Land Parcel feature class
-
-    # Process: Join Field
-    arcpy.JoinField_management(ParcelsFinal, "OBJECTID", Intact_Area_Per_Parcel, "OBJECTID_1", ["Area_Intact", "Percent_Intact"])
-
-    # Process: Join Field (2)
-    arcpy.JoinField_management(ParcelsFinal, "OBJECTID", Lotic_Area_Per_Parcel, "OBJECTID_1", ["Area_Lotic", "Percent_Lotic"])
-
-    # Process: Join Field (3)
-    arcpy.JoinField_management(ParcelsFinal, "OBJECTID", Wetland_Edge_Per_Parcel, "OBJECTID_1", "Wetland_Edge")
-
-
-    # Now we get rid of null values in our new fields and replace them with zeros
-
-    with arcpy.da.UpdateCursor(ParcelsFinal, ["Area_Intact"]) as cursor:
-        for row in cursor:
-            if row[0] == None:
-                row[0] = 0
-                cursor.updateRow(row)
-
-    with arcpy.da.UpdateCursor(ParcelsFinal, ["Percent_Intact"]) as cursor:
-        for row in cursor:
-            if row[0] == None:
-                row[0] = 0
-                cursor.updateRow(row)
-
-    with arcpy.da.UpdateCursor(ParcelsFinal, ["Area_Lotic"]) as cursor:
-        for row in cursor:
-            if row[0] == None:
-                row[0] = 0
-                cursor.updateRow(row)
-
-    with arcpy.da.UpdateCursor(ParcelsFinal, ["Percent_Lotic"]) as cursor:
-        for row in cursor:
-            if row[0] == None:
-                row[0] = 0
-                cursor.updateRow(row)
-
-    with arcpy.da.UpdateCursor(ParcelsFinal, ["Wetland_Edge"]) as cursor:
-        for row in cursor:
-            if row[0] == None:
-                row[0] = 0
-                cursor.updateRow(row)
-
-
-    # This section of the script calculates the largest intact patch that intersects each parcel
-
-    # Local Variables
-    Footprint_INVERSE_Large_Explode = "Footprint_INVERSE_Large_Explode"
-    Patch_Sizes_Per_Parcel = "Patch_Sizes_Per_Parcel"
-
-    # Process: Tabulate Intersection
-    arcpy.TabulateIntersection_analysis(ParcelsFinal, "OBJECTID", Footprint_INVERSE_Large_Explode, Patch_Sizes_Per_Parcel, "SHAPE_Area", "", "", "UNKNOWN")
-
-    # A table was created with Tabulate Intersection that contains the areas of all intact patches that intersect
-    # each parcel. We have several duplicates of each Parcel OBJECTID in this table, one for every patch that intersects a parcel.
-    # we need to determine which duplicate OBJECTID corresponds to the largest patch area.
-
-    # First we get a full list of the object IDs in our clipped ParcelsFinal Class
-    # even though there is only one value in each cell of the attribute table, the data type is a tuple, so we need to extract our value our of it, as with a list
-    parcel_IDs_extracted = []
-    parcel_IDs = arcpy.da.SearchCursor(ParcelsFinal, "OBJECTID")
-    for ID in parcel_IDs:
-        if isinstance(ID, tuple):
-            ID = ID[0]
-            parcel_IDs_extracted.append(ID)
-        else:
-            parcel_IDs_extracted.append(ID)
-
-
-    Patch_Sizes_Per_Parcel = "Patch_Sizes_Per_Parcel"
-
-##    # remove null values
-##    with arcpy.da.UpdateCursor(Patch_Sizes_Per_Parcel, ["SHAPE_Area"]) as cursor:
-##        for row in cursor:
-##            if row[0] == None:
-##                row[0] = 0
-##                cursor.updateRow(row)
-
-
-    # Now we get a full list of all of the Parcel Object ID that had at least one intersection with the "Intact" feature class (human footprint inverse)
-    # NOTE: not all of the parcels in our area of interest necessarily intersect with the "Intact" feature class
-    patch_IDs = arcpy.da.SearchCursor(Patch_Sizes_Per_Parcel, "OBJECTID_1")
-    patch_IDs_extracted = []
-    for ID in patch_IDs:
-        if isinstance(ID, tuple):
-            ID = ID[0]
-            patch_IDs_extracted.append(ID)
-        elif isinstance(ID, str):
-            patch_IDs_extracted.append(ID)
-
-
-
-    # initialize 2 new lists
-    orderedListofLists = []
-    newlist = []
-    # for each OBJECT ID we create a list of areas which are the intsects for a parcel, then append that list as an element in our list of lists (orderedListofLists)
-    # the newlist is re-initialized every intereation after it has dumped its values into the orderedlistoflists. The orderedlistoflists is not re-initialized, and continues to be appended to.
-    # Now the intersections for each parcel are nicely grouped together
-    for ID in parcel_IDs_extracted:
-        patch_IDs_and_Areas = arcpy.da.SearchCursor(Patch_Sizes_Per_Parcel, ["OBJECTID_1", "SHAPE_Area"])
-        if ID not in patch_IDs_extracted: # This step ensures that parcels that have not intersection receive a zero instead of being glossed over. This will maintain order of our field values.
-            orderedListofLists.append(0)
-        else:
-            newlist = []
-            for rows in patch_IDs_and_Areas:
-                if ID == rows[0]:
-                    x = rows[1]
-                    newlist.append(x)
-            orderedListofLists.append(newlist)
-
-    # initialize one more list
-    # Since the intersections(areas) are grouped by parcel, we extract the highest number in each list element (which is a list), and this give us the largest patch size for each parcel.
-    max_patch_size_per_parcel = []
-
-    for patchSizes in orderedListofLists:
-        if patchSizes == 0:
-            max_patch_size_per_parcel.append(0)
+    # Process: Project, Make Feature Layer, Select Layer By Location, Select Layer By Attribute (removes roads), Copy Features
+    if townships:
+        # the parcels of the townships are looked up by their keys, and their outline is the area of interest
+        parcel_index.copy_rows(backend, parcel_index.in_townships(townships), ParcelsFinal)
+        backend.buffer(ParcelsFinal, "Area_Of_Interest_Townships", 0, dissolve=True)
+        inputs = inputs._replace(areaOfInterest="Area_Of_Interest_Townships")
+    elif parcel_index:
+        select_parcels(backend, parcel_index, inputs.areaOfInterest, ParcelsFinal)
+    elif cache:
+        cache.select_parcels(backend, inputs.quarterSectionBoundaries, inputs.areaOfInterest, ParcelsFinal)
+    else:
+        backend.select_parcels(inputs.quarterSectionBoundaries, inputs.areaOfInterest, ParcelsFinal)
+
+
+    # ############### MODEL BUILDER SECTION: for initial Geoproccessing #################################################################################################################
+
+    # The geoprocessing that was exported from ArcMap's Model builder is in pipeline.py. It determines the spatial relationships between the parcels
+    # and the user provided data (Human footprint, Lotic(Riparian), Wetlands, Patch Size, and Proximity), and reads the resulting tables into
+    # per-parcel metrics (Area_Intact, Percent_Intact, Area_Lotic, Percent_Lotic, Wetland_Edge, Largest_Patch_Area and Dist_to_Protected).
+    # Every derived value is kept in memory in a column store, lined up with the parcel OBJECTIDs, and all of the new fields are written to
+    # ParcelsFinal together at the end (one schema change and one cursor pass).
+
+    # With tile_parcels, the parcels are processed in tiles of whole townships with at most that many parcels each (see tiling.py).
+    # With workers, the independent factor chains are run in parallel processes (see scheduler.py)
+    # With incremental, only the metrics whose inputs changed since the last run are computed (see incremental.py)
+    parameters = engine_parameters(engine, cell_size, footprint_buffer)
+    if proximity_radius:
+        parameters["proximity"] = {"search_radius": proximity_radius}
+    if patch_index:
+        parameters["largest_patch"]["patch_index"] = patch_index
+    with backend.stage("compute_metrics"):
+        if tile_parcels:
+            columns = compute_metrics_tiled(backend, ParcelsFinal, inputs, tile_parcels, cache=cache, parameters=parameters, factors=factors)
+        elif workers:
+            columns = compute_metrics_parallel(backend, ParcelsFinal, inputs, workers, cache=cache, parameters=parameters, factors=factors)
+        elif incremental:
+            from incremental import compute_metrics_incremental
+            columns = compute_metrics_incremental(backend, ParcelsFinal, inputs, incremental, cache=cache, parameters=parameters, factors=factors)
         else:
-            max_patch_size_per_parcel.append(max(patchSizes))
-
-    # convert to acres for scoring
-    max_patch_size_per_parcel_acres = []
-    acre = 0
-    for patchsize in max_patch_size_per_parcel:
-        acre = patchsize / 4046.86
-        max_patch_size_per_parcel_acres.append(acre)
-
-
-    # Now we have a list that contains the largest patch that intersects each parcel.
-    # It is ordered the same as the OBJECTID and we can now create a new field in the parcels feature class and
-    # iteratively polulate the rows with each patch area value
-
-    # create new field
-    arcpy.AddField_management(ParcelsFinal, "Largest_Patch_Area", "DOUBLE", field_length = 50)
-
-    # initialize x
-    x = 0
-
-    # use update cursor to populate rows and after each time the cursor moves down to the next row,
-    # iterate to the next list element (x)
-    with arcpy.da.UpdateCursor(ParcelsFinal, "Largest_Patch_Area") as cursor:
-        for row in cursor:
-            row[0] = max_patch_size_per_parcel_acres[x]
-            cursor.updateRow(row)
-            x += 1
-
-
-    # the following code calculates the nearest protected area feature and automatically creates a new field that contains that distance for each parcel.
-    # Process: Near
-    arcpy.Near_analysis(ParcelsFinal, parksProtectedAreasAlberta, "", "NO_LOCATION", "NO_ANGLE", "PLANAR")
+            columns = compute_metrics(backend, ParcelsFinal, inputs, cache=cache, parameters=parameters, factors=factors)
 
 
     # #######################################################################################################################################################################################################
 
-    # The next section of code calulates the scores for each parcel based on the values is our newly added/created fields.
-
-
-    # ##################### INTACTNESS SCORE #######################
-
-    # extract percent intact field
-    intact_scores = []
-    percent_intact = arcpy.da.SearchCursor(ParcelsFinal, "Percent_Intact")
-    # Perform calulation for score and append to new list. Accomodate for str and tuple field types
-    for percent in percent_intact:
-        if isinstance(percent, tuple):
-            percent = percent[0] / 100
-        elif isinstance(percent, str):
-            percent = float(percent)
-        intact_scores.append(percent)
-
-    # create new field
-    arcpy.AddField_management(ParcelsFinal, "SCORE_Intactness", "DOUBLE", field_length = 50)
-
-    x = 0
-
-    # use update cursor to populate rows with list element and after each time the cursor moves down to the next row,
-    # iterate to the next list element (x)
-    with arcpy.da.UpdateCursor(ParcelsFinal, "SCORE_Intactness") as cursor:
-        for row in cursor:
-            row[0] = intact_scores[x]
-            cursor.updateRow(row)
-            x += 1
-
-
-    # ################### Lotic (Riparian) Score #########################
-
-    # extract percent lotic field
-    lotic_percent_list = []
-    percent_lotic = arcpy.da.SearchCursor(ParcelsFinal, "Percent_Lotic")
-    #  Accomodate for str and tuple field types
-    for percent in percent_lotic:
-        if isinstance(percent, tuple):
-            percent = percent[0]
-        elif isinstance(percent, str):
-            percent = float(percent)
-        lotic_percent_list.append(percent)
-
-
-    # now we create a create a lotic percent list no zeros before establishing ranges for deciles
-    lotic_percent_list_noZero = []
-    for percent in lotic_percent_list:
-        if percent != 0:
-            lotic_percent_list_noZero.append(percent)
-
-    # use numbpy to calculate the decile ranges
-    ranges = np.percentile(lotic_percent_list_noZero, np.arange(0, 100, 10))
-
-
-    # iterate through origincal lotic percent list and use the decile ranges to bin the lotic percent values to the appropriate scores
-    final_lotic_scores = []
-    for percent in lotic_percent_list:
-        if percent == 0:
-            final_lotic_scores.append(0)
-        elif percent >= ranges[0] and percent <= ranges[1]:
-             final_lotic_scores.append(0.1)
-        elif percent >= ranges[1] and percent <= ranges[2]:
-            final_lotic_scores.append(0.2)
-        elif percent >= ranges[2] and percent <= ranges[3]:
-            final_lotic_scores.append(0.3)
-        elif percent >= ranges[3] and percent <= ranges[4]:
-            final_lotic_scores.append(0.4)
-        elif percent >= ranges[4] and percent <= ranges[5]:
-            final_lotic_scores.append(0.5)
-        elif percent >= ranges[5] and percent <= ranges[6]:
-            final_lotic_scores.append(0.6)
-        elif percent >= ranges[6] and percent <= ranges[7]:
-            final_lotic_scores.append(0.7)
-        elif percent >= ranges[7] and percent <= ranges[8]:
-            final_lotic_scores.append(0.8)
-        elif percent >= ranges[8] and percent <= ranges[9]:
-            final_lotic_scores.append(0.9)
-        elif percent >= ranges[9]:
-            final_lotic_scores.append(1)
-
-
-    # the order of the resulting list is identical to the original, so it can be appended as a new field and the values will
-    # correspond with the rows they are meant to score
-
-    # create new field
-    arcpy.AddField_management(ParcelsFinal, "SCORE_Lotic_Deciles", "DOUBLE", field_length = 50)
-
-    x = 0
-
-    # use update cursor to populate rows with list element and after each time the cursor moves down to the next row,
-    # iterate to the next list element (x)
-    with arcpy.da.UpdateCursor(ParcelsFinal, "SCORE_Lotic_Deciles") as cursor:
-        for row in cursor:
-            row[0] = final_lotic_scores[x]
-            cursor.updateRow(row)
-            x += 1
-
-
-    # ######################### Wetland Score #####################
-
-    # extract Wetland edge length field
-    wetland_edge_list = []
-    wetland_field = arcpy.da.SearchCursor(ParcelsFinal, "Wetland_Edge")
-
-    # append values to new list. Accomodate for str and tuple field types.
-    for length in wetland_field:
-        if isinstance(length, tuple):
-            length = length[0]
-        elif isinstance(length, str):
-            length = float(length)
-        wetland_edge_list.append(length)
-
-
-    # now we create a create a wetland edge list no zeros before establishing ranges for deciles
-    wetland_edge_list_noZero = []
-    for edge_length in wetland_edge_list:
-        if edge_length != 0:
-            wetland_edge_list_noZero.append(edge_length)
-
-
-    # use numbpy to calculate the decile ranges
-    ranges = np.percentile(wetland_edge_list_noZero, np.arange(0, 100, 10))
-
-
-    # iterate through original wetland edge list and use the decile ranges to bin the wetland edge values to the appropriate scores
-    final_wetland_scores = []
-    for edge_length in wetland_edge_list:
-        if edge_length == 0:
-            final_wetland_scores.append(0)
-        elif edge_length >= ranges[0] and edge_length <= ranges[1]:
-             final_wetland_scores.append(0.1)
-        elif edge_length >= ranges[1] and edge_length <= ranges[2]:
-            final_wetland_scores.append(0.2)
-        elif edge_length >= ranges[2] and edge_length <= ranges[3]:
-            final_wetland_scores.append(0.3)
-        elif edge_length >= ranges[3] and edge_length <= ranges[4]:
-            final_wetland_scores.append(0.4)
-        elif edge_length >= ranges[4] and edge_length <= ranges[5]:
-            final_wetland_scores.append(0.5)
-        elif edge_length >= ranges[5] and edge_length <= ranges[6]:
-            final_wetland_scores.append(0.6)
-        elif edge_length >= ranges[6] and edge_length <= ranges[7]:
-            final_wetland_scores.append(0.7)
-        elif edge_length >= ranges[7] and edge_length <= ranges[8]:
-            final_wetland_scores.append(0.8)
-        elif edge_length >= ranges[8] and edge_length <= ranges[9]:
-            final_wetland_scores.append(0.9)
-        elif edge_length >= ranges[9]:
-            final_wetland_scores.append(1)
-
-
-    # the order of the resulting list is identical to the original, so it can be appended as a new field and the values will
-    # correspond with the rows they are meant to score
-
-    # create new field
-    arcpy.AddField_management(ParcelsFinal, "SCORE_Wetland_Deciles", "DOUBLE", field_length = 50)
-
-    x = 0
-
-    # use update cursor to populate rows with list element and after each time the cursor moves down to the next row,
-    # iterate to the next list element (x)
-    with arcpy.da.UpdateCursor(ParcelsFinal, "SCORE_Wetland_Deciles") as cursor:
-        for row in cursor:
-            row[0] = final_wetland_scores[x]
-            cursor.updateRow(row)
-            x += 1
-
-
-
-    # ################ Patch size score ####################
-
-    # extract patch size field
-    largest_patch_sizes = []
-    patch_sizes = arcpy.da.SearchCursor(ParcelsFinal, "Largest_Patch_Area")
-    # Perform calulation for score and append to new list. Accomodate for str and tuple field types
-    for size in patch_sizes:
-        if isinstance(size, tuple):
-            size = size[0]
-        elif isinstance(size, str):
-            size = float(size)
-        largest_patch_sizes.append(size)
-
-    # now we populate a new list and assign scores based on number ranges
-    patch_size_scores = []
-    for size in largest_patch_sizes:
-        if size < 160:
-            patch_size_scores.append(0)
-        elif size > 160 and size < 2500:
-             patch_size_scores.append(0.5)
-        elif size > 2500 and size < 10000:
-            patch_size_scores.append(.75)
-        elif size > 10000:
-            patch_size_scores.append(1)
-
-
-    # create new field
-    arcpy.AddField_management(ParcelsFinal, "SCORE_Patch_Size", "DOUBLE", field_length = 50)
-
-    x = 0
-
-    # use update cursor to populate rows with list element and after each time the cursor moves down to the next row,
-    # iterate to the next list element (x)
-    with arcpy.da.UpdateCursor(ParcelsFinal, "SCORE_Patch_Size") as cursor:
-        for row in cursor:
-            row[0] = patch_size_scores[x]
-            cursor.updateRow(row)
-            x += 1
-
-
-    # ############### Proximity Score #####################
-
-    # Rename Distance field to be more decriptive
-    # delete NEAD FID feild (un-needed)
-    arcpy.AlterField_management(ParcelsFinal, "NEAR_DIST", new_field_name = "Dist_to_Protected", field_is_nullable = "NULLABLE")
-    arcpy.DeleteField_management(ParcelsFinal, "NEAR_FID")
-
-    # extract proximity field
-    all_proximities = []
-    proximities = arcpy.da.SearchCursor(ParcelsFinal, "Dist_to_Protected")
-    # Perform calulation for score and append to new list. Accomodate for str and tuple field types
-    for proximity in proximities:
-        if isinstance(proximity, tuple):
-            proximity = proximity[0]
-        elif isinstance(proximity, str):
-            proximity = float(proximity)
-        all_proximities.append(proximity)
-
-    # now we populate a new list and assign scores based on number ranges
-    proximity_scores = []
-    for proximity in all_proximities:
-        if proximity == 0:
-            proximity_scores.append(1)
-        elif proximity > 0 and proximity < 2000:
-             proximity_scores.append(0.75)
-        elif proximity > 2000 and proximity < 4000:
-            proximity_scores.append(.5)
-        elif proximity > 4000:
-            proximity_scores.append(0)
-
-
-    # create new field
-    arcpy.AddField_management(ParcelsFinal, "SCORE_Proximity", "DOUBLE", field_length = 50)
-
-    x = 0
-
-    # use update cursor to populate rows with list element and after each time the cursor moves down to the next row,
-    # iterate to the next list element (x)
-    with arcpy.da.UpdateCursor(ParcelsFinal, "SCORE_Proximity") as cursor:
-        for row in cursor:
-            row[0] = proximity_scores[x]
-            cursor.updateRow(row)
-            x += 1
-
-
-    # ##################### FINAL PRIORITY SCORES ###########################
-
-    sumOfScores = []
-    scoreFields = arcpy.da.SearchCursor(ParcelsFinal,["SCORE_Lotic_Deciles", "SCORE_Wetland_Deciles", "SCORE_Intactness", "SCORE_Patch_Size", "SCORE_Proximity"])
-    for score in scoreFields:
-        sumScore = score[0] + score[1] + score[2] + score[3] +score[4]
-        sumOfScores.append(sumScore)
-
-
-    # create new field
-    arcpy.AddField_management(ParcelsFinal, "PRIORITY_SCORE", "DOUBLE", field_length = 50)
-
-    x = 0
-
-    # use update cursor to populate rows with list element and after each time the cursor moves down to the next row,
-    # iterate to the next list element (x)
-    with arcpy.da.UpdateCursor(ParcelsFinal, "PRIORITY_SCORE") as cursor:
-        for row in cursor:
-            row[0] = sumOfScores[x]
-            cursor.updateRow(row)
-            x += 1
-    # the order of the resulting list is identical to the original, so it can be appended as a new field and the values will
-    # correspond with the rows they are meant to score
-
-
-    # ################################## PRIORITY RANKING #######################################
-
-    # now we calculate ranges for priority ranking with 4 breaks (Quartiles)
-    ranges = np.percentile(sumOfScores, np.arange(0, 100, 25))
-
-    final_priority_ranking = []
-    for score in sumOfScores:
-        if score >= ranges[0] and score <= ranges[1]:
-             final_priority_ranking.append(None)
-        elif score >= ranges[1] and score <= ranges[2]:
-            final_priority_ranking.append(3)
-        elif score >= ranges[2] and score <= ranges[3]:
-            final_priority_ranking.append(2)
-        elif score >= ranges[3]:
-            final_priority_ranking.append(1)
-
-
-    # create new field
-    arcpy.AddField_management(ParcelsFinal, "PRIORITY_RANKING", "DOUBLE", field_length = 50)
-
-    x = 0
-
-    # use update cursor to populate rows with list element and after each time the cursor moves down to the next row,
-    # iterate to the next list element (x)
-    with arcpy.da.UpdateCursor(ParcelsFinal, "PRIORITY_RANKING") as cursor:
-        for row in cursor:
-            row[0] = final_priority_ranking[x]
-            cursor.updateRow(row)
-            x += 1
-
-    arcpy.CheckInExtension("spatial")
+    # The next section of code calulates the scores for each parcel based on the values in our new columns.
+
+    # Each factor is scored by its classifier (see scoring.py and classification.py):
+    #   Intactness: percent intact / 100
+    #   Lotic and Wetland: deciles (or the chosen classification) of the non-zero values, parcels with no lotic area or wetland edge score 0
+    #   Patch size: 0 up to 160 acres, 0.5 up to 2500, 0.75 up to 10000, 1 above that
+    #   Proximity: 1 inside a protected area, 0.75 within 2000 m, 0.5 within 4000 m, 0 beyond (or no protected area within the search radius)
+    #   Extra factors: their own classifiers (see factors.py)
+    # The scores are summed (weighted by the factor weights, 1 for each built in factor) into PRIORITY_SCORE, which is ranked by quartiles (or the chosen classification) into PRIORITY_RANKING (1 is the highest priority,
+    # the lowest quartile is left null)
+    with backend.stage("score_parcels", parcels=len(columns.keys)):
+        scores = score_parcels(columns, classifiers, factors=factors)
+    for score_field in score_fields(factors):
+        columns[score_field] = scores[score_field]
+
+    # Finally every new field is added to ParcelsFinal and populated in a single pass, matching rows by OBJECTID
+    backend.write_columns(ParcelsFinal, columns, "OBJECTID")
+    if metrics_out:
+        from metrics_table import save_metrics
+        with backend.stage("save_metrics " + metrics_out):
+            save_metrics(metrics_out, columns)
+
+    backend.finish()
 
     print("proccess complete")
     print("...........")
-    print("The resulting priority scored parcels feature class can be found in the user specified geodatabase by the name of 'ParcelsFinal'")
+    print("The resulting priority scored parcels feature class can be found in the user specified workspace by the name of 'ParcelsFinal'")
     print("To view the Conservation Priority ranking, symbolize the feature class by unique values, using the 'PRIORITY_RANKING' field.")
-
-main(workspace, areaOfInterest, albertaloticRiparian, albertaMergedWetlandInventory, quarterSectionBoundaries, parksProtectedAreasAlberta, humanFootprint)
-
-
-
-
-
-
-
-
-
-
-
-
-
+    if instrumentation:
+        print("slowest stages:")
+        for line in instrumentation.report():
+            print("  " + line)
+
+    return columns
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Land Parcels Conservation Priority Ranking")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="arcpy", help="geoprocessing backend (default: arcpy)")
+    parser.add_argument("--tile-parcels", type=int, default=None, help="geoprocess the parcels in tiles of whole townships with at most this many parcels, to limit memory use (the intact patches are built once, see tiling.py)")
+    parser.add_argument("--workers", type=int, default=None, help="run the factor geoprocessing chains in this many processes at once")
+    parser.add_argument("--cache", default=None, help="folder to keep geoprocessing results in between runs")
+    parser.add_argument("--cache-size", type=float, default=5, help="largest size of the cache in GB (default: 5)")
+    parser.add_argument("--incremental", default=None, help="folder for a snapshot of the metrics and inputs, so the next run only computes what changed")
+    parser.add_argument("--proximity-radius", type=float, default=None, help="search for protected areas within this many meters of each parcel (default: 4000)")
+    parser.add_argument("--engine", choices=["vector", "raster"], default="vector", help="compute intactness and patch size by vector overlay or on a grid (default: vector)")
+    parser.add_argument("--cell-size", type=float, default=None, help="cell size in meters of the raster engine (default: 25)")
+    parser.add_argument("--footprint-buffer", type=float, default=None, help="buffer the human footprint by this many meters (raster engine only)")
+    parser.add_argument("--factors", default=None, help="JSON file of extra conservation factors to measure and score (see factors.py)")
+    parser.add_argument("--projected-layers", default=None, help="folder to keep projected copies of the provincial layers in, so they are only projected once")
+    parser.add_argument("--footprint-gap", type=float, default=None, help="close the gaps of the human footprint narrower than this many meters (see footprint_prep.py)")
+    parser.add_argument("--prepared-footprints", default=None, help="folder to keep the footprint with its gaps closed in (default: prepared_footprints next to the workspace)")
+    parser.add_argument("--patch-index", default=None, help="look up intact patches in this index built by patch_index.py (.gpkg)")
+    parser.add_argument("--incidence", default=None, help="folder to save the parcel x feature matrix of every overlaid layer in (open backend only)")
+    parser.add_argument("--parcel-index", default=None, help="select the parcels from this index built by parcel_index.py (.gpkg)")
+    parser.add_argument("--townships", default=None, help="with --parcel-index, select these townships (MER-RGE-TWP,MER-RGE-TWP,...) instead of an area of interest")
+    parser.add_argument("--profile", default=None, help="write the time, CPU, memory and row counts of every stage to this JSON lines file")
+    parser.add_argument("--trace", default=None, help="write the stages to this file as a Chrome trace (chrome://tracing)")
+    parser.add_argument("--metrics-out", default=None, help="also save the parcel metrics and scores to this table (.npz, .arrow, .feather or .parquet), for rescore.py")
+    args = parser.parse_args()
+    if args.tile_parcels and args.workers:
+        parser.error("--tile-parcels and --workers can not be used together")
+    if args.incremental and (args.tile_parcels or args.workers):
+        parser.error("--incremental can not be used with --tile-parcels or --workers")
+    if args.footprint_buffer and args.engine != "raster":
+        parser.error("--footprint-buffer needs --engine raster")
+    if args.footprint_buffer and args.patch_index:
+        parser.error("--footprint-buffer can not be used with --patch-index")
+    if args.footprint_gap and args.footprint_buffer:
+        parser.error("--footprint-gap and --footprint-buffer can not be used together")
+    if args.prepared_footprints and not args.footprint_gap:
+        parser.error("--prepared-footprints needs --footprint-gap")
+    if args.incidence and (args.backend != "open" or args.workers):
+        parser.error("--incidence needs --backend open and can not be used with --workers")
+    if args.townships and not args.parcel_index:
+        parser.error("--townships needs --parcel-index")
+    townships = None
+    if args.townships:
+        from parcel_index import parse_townships
+        try:
+            townships = parse_townships(args.townships)
+        except ValueError as error:
+            parser.error(str(error))
+
+    cache = None
+    if args.cache:
+        from cache import IntermediateCache
+        cache = IntermediateCache(args.cache, int(args.cache_size * 1024 ** 3))
+
+    factors = None
+    if args.factors:
+        from factors import load_factors
+        try:
+            factors = load_factors(args.factors)
+        except ValueError as error:
+            parser.error(str(error))
+
+    instrumentation = None
+    if args.profile or args.trace:
+        from instrumentation import Instrumentation
+        instrumentation = Instrumentation(args.profile, args.trace)
+
+    inputs = ask_for_inputs(args.backend, ask_area_of_interest=not townships)
+    try:
+        main(*inputs, backend=get_backend(args.backend, inputs[0]), tile_parcels=args.tile_parcels, workers=args.workers, cache=cache, metrics_out=args.metrics_out, proximity_radius=args.proximity_radius,
+             engine=args.engine, cell_size=args.cell_size, footprint_buffer=args.footprint_buffer, instrumentation=instrumentation, incremental=args.incremental,
+             patch_index=args.patch_index, factors=factors, projected_layers=args.projected_layers,
+             footprint_gap=args.footprint_gap, prepared_footprints=args.prepared_footprints, incidence=args.incidence,
+             parcel_index=args.parcel_index, townships=townships)
+    finally:
+        if instrumentation:
+            instrumentation.close()
@@ -0,0 +1,454 @@
+#-------------------------------------------------------------------------------
+# Geoprocessing backends
+#-------------------------------------------------------------------------------
+
+# main() does its geoprocessing through a backend object instead of calling arcpy directly, so the same ranking can run
+# on a licensed ArcGIS seat (ArcpyBackend) or anywhere Shapely and GeoPandas are installed (OpenBackend, see open_backend.py).
+
+# Datasets are referred to by name, the same way the original script did: a plain name (eg. "ParcelsFinal") is a dataset
+# in the backend's workspace, anything else is a path to an existing dataset. Every step writes its output dataset
+# under the name it is given, so the intermediate data is kept in the workspace for inspection.
+
+# Output tables follow the arcpy field names, so the rest of the script does not need to know which backend produced them:
+#   tabulate_intersection: OBJECTID_1 (the zone OBJECTID), AREA and PERCENTAGE for polygons or LENGTH for lines,
+#                          with class_fields, one row per zone and class value (the patch table is classified by SHAPE_Area,
+#                          which gives one row per intersecting patch with its full area)
+#   near_table:            IN_FID, NEAR_FID, NEAR_DIST
+#   overlay:               the tables of Tabulate Intersection, or with the open backend one row per zone (see overlay.py)
+
+from instrumentation import NO_STAGE
+
+# The projected coordinate system all of the analysis is done in (NAD 1983 10TM AEP Forest, EPSG:3400)
+PROJECTED_CRS_EPSG = 3400
+PROJECTED_CRS_WKT = "PROJCS['NAD_1983_10TM_AEP_Forest',GEOGCS['GCS_North_American_1983',DATUM['D_North_American_1983',SPHEROID['GRS_1980',6378137.0,298.257222101]],PRIMEM['Greenwich',0.0],UNIT['Degree',0.0174532925199433]],PROJECTION['Transverse_Mercator'],PARAMETER['False_Easting',500000.0],PARAMETER['False_Northing',0.0],PARAMETER['Central_Meridian',-115.0],PARAMETER['Scale_Factor',0.9992],PARAMETER['Latitude_Of_Origin',0.0],UNIT['Meter',1.0]]"
+GEOGRAPHIC_CRS_WKT = "GEOGCS['GCS_North_American_1983',DATUM['D_North_American_1983',SPHEROID['GRS_1980',6378137.0,298.257222101]],PRIMEM['Greenwich',0.0],UNIT['Degree',0.0174532925199433]]"
+
+# Road allowances are removed from the quarter sections with this where clause
+PARCEL_WHERE_CLAUSE = "RA NOT LIKE 'R'"
+
+
+# SQL where clause selecting the parcels in a list of (MER, RGE, TWP) townships
+def township_where_clause(townships):
+    import numbers
+
+    def value(v):
+        return "%d" % v if isinstance(v, numbers.Number) else "'%s'" % v
+    by_range = {}
+    for mer, rge, twp in townships:
+        by_range.setdefault((mer, rge), []).append(twp)
+    clauses = []
+    for (mer, rge), twps in sorted(by_range.items()):
+        clauses.append("(MER = %s AND RGE = %s AND TWP IN (%s))" % (value(mer), value(rge), ", ".join(value(twp) for twp in sorted(twps))))
+    return " OR ".join(clauses)
+
+# backend name -> (module, class), imported only when the backend is used so arcpy and geopandas stay optional
+BACKENDS = {
+    "arcpy": ("backends", "ArcpyBackend"),
+    "open": ("open_backend", "OpenBackend"),
+}
+
+
+def get_backend_class(name):
+    import importlib
+    if name not in BACKENDS:
+        raise ValueError("unknown backend %r, expected one of %s" % (name, ", ".join(sorted(BACKENDS))))
+    module_name, class_name = BACKENDS[name]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def get_backend(name, workspace):
+    return get_backend_class(name)(workspace)
+
+
+# The operations main() needs. Each one mirrors an arcpy geoprocessing tool.
+class Backend(object):
+
+    name = None
+    # used when prompting for the workspace
+    workspace_description = None
+
+    def __init__(self, workspace):
+        self.workspace = workspace
+
+    # Class level check, so the workspace can be validated before the backend is created
+    @classmethod
+    def is_workspace(cls, path):
+        raise NotImplementedError
+
+    # Create an empty workspace called name (without extension) in folder, and return its path
+    @classmethod
+    def create_workspace(cls, folder, name):
+        raise NotImplementedError
+
+    # The path of a dataset in a workspace
+    @staticmethod
+    def dataset_path(workspace, name):
+        import os
+        return os.path.join(workspace, name)
+
+    # The full path of a dataset, so it can be opened from another workspace or process
+    def full_path(self, dataset):
+        import os
+        if os.path.basename(dataset) == dataset and os.path.splitext(dataset)[1] == "":
+            return self.dataset_path(os.path.abspath(self.workspace), dataset)
+        return os.path.abspath(dataset)
+
+    def exists(self, dataset):
+        raise NotImplementedError
+
+    # True for feature classes, shapefiles and feature datasets
+    def is_feature_data(self, dataset):
+        raise NotImplementedError
+
+    # Read datasets used by many runs (eg. the provincial inputs of a batch) once, so the backends made by with_workspace do not read them again
+    def preload(self, datasets):
+        pass
+
+    # A backend of the same kind working in another workspace, sharing the datasets this one has preloaded
+    def with_workspace(self, workspace):
+        return type(self)(workspace)
+
+    # A timed stage of the run (see instrumentation.py). Does nothing unless the backend is wrapped in an InstrumentedBackend.
+    def stage(self, name, **fields):
+        return NO_STAGE
+
+    # The size of a dataset for profiling: {"rows": row count, "bytes": size, or None when the backend can not tell}
+    def dataset_size(self, dataset):
+        raise NotImplementedError
+
+    # Called before and after the geoprocessing (licenses, environment settings)
+    def start(self):
+        pass
+
+    def finish(self):
+        pass
+
+    # Project the quarter sections, keep those intersecting the area of interest, drop road allowances, and copy them to out
+    def select_parcels(self, quarter_sections, area_of_interest, out):
+        raise NotImplementedError
+
+    # Make out refer to the parcels within the given (MER, RGE, TWP) townships, keeping their OBJECTIDs
+    def select_townships(self, parcels, townships, out):
+        raise NotImplementedError
+
+    # Make out refer to the features of a dataset with the given OBJECTIDs, keeping their OBJECTIDs
+    def select_ids(self, dataset, object_ids, out):
+        raise NotImplementedError
+
+    # The OBJECTIDs of the features of a dataset within distance (meters) of any of boxes, an array of (xmin, ymin, xmax, ymax) rows
+    def intersecting_ids(self, dataset, boxes, distance=0):
+        raise NotImplementedError
+
+    # A sha1 digest of the geometry of every feature (a numpy "S20" array) and their bounds (an n x 4 array), in the analysis coordinate system
+    def feature_index(self, dataset):
+        raise NotImplementedError
+
+    # Copy a dataset (feature class or table) to out, which can be a path in another workspace
+    def copy(self, dataset, out):
+        raise NotImplementedError
+
+    # Copy the features of a dataset with the given feature IDs (OBJECTIDs, or the fids of a GeoPackage layer) to out, in the order of the
+    # dataset and with OBJECTIDs from 1
+    def copy_ids(self, dataset, object_ids, out):
+        raise NotImplementedError
+
+    # (name, kind) of the coordinate system of a dataset, kind is "analysis" (PROJECTED_CRS_EPSG), "projected" or "geographic".
+    # (None, None) when the dataset has no coordinate system.
+    def coordinate_system(self, dataset):
+        raise NotImplementedError
+
+    # Project a dataset to the analysis coordinate system into out, which can be a path in another workspace
+    def project(self, dataset, out):
+        raise NotImplementedError
+
+    # A hash of the OBJECTIDs and geometries of a dataset, which changes whenever any of its features do
+    def fingerprint(self, dataset):
+        raise NotImplementedError
+
+    # Remove datasets that are no longer needed (eg. the intermediates of a finished tile)
+    def delete(self, datasets):
+        raise NotImplementedError
+
+    def clip(self, in_features, clip_features, out):
+        raise NotImplementedError
+
+    def erase(self, in_features, erase_features, out):
+        raise NotImplementedError
+
+    def feature_to_line(self, in_features, out):
+        raise NotImplementedError
+
+    # distance in meters, with dissolve the buffers are merged into one feature
+    def buffer(self, in_features, out, distance, dissolve=False):
+        raise NotImplementedError
+
+    # Multipart To Singlepart
+    def explode(self, in_features, out):
+        raise NotImplementedError
+
+    def tabulate_intersection(self, zones, zone_field, in_features, out, class_fields=None):
+        raise NotImplementedError
+
+    # Tabulate several layers against the same zones (see overlay.py). layers is a list of (in_features, measure, out), where out is the table
+    # written for the layer. Returns a list with the result of each layer, {field: values} lined up with zone_IDs.
+    # By default each layer is tabulated with tabulate_intersection in turn.
+    def overlay(self, zones, zone_field, zone_IDs, layers):
+        from overlay import MEASURES, check_measure
+        key = zone_field + "_1" if zone_field == "OBJECTID" else zone_field
+        results = []
+        for in_features, measure, out in layers:
+            check_measure(measure)
+            class_fields, fields, reduce = MEASURES[measure]
+            self.tabulate_intersection(zones, zone_field, in_features, out, class_fields)
+            table = self.read_table(out, [key] + [table_field for _, table_field in fields])
+            results.append(dict((field, reduce(table[key], table[table_field], zone_IDs)) for field, table_field in fields))
+        return results
+
+    # Distance from every input feature to the closest near feature. With search_radius (meters), features with no near
+    # feature within that distance are left out of the table.
+    def near_table(self, in_features, near_features, out, search_radius=None):
+        raise NotImplementedError
+
+    # (xmin, ymin, xmax, ymax) of the features of a dataset
+    def extent(self, dataset):
+        raise NotImplementedError
+
+    # Burn the features of a dataset into a numpy array over a raster.Grid: the value_field of the feature each cell centre falls in
+    # (0 for none), or a boolean mask when value_field is None. With all_touched, mask cells the feature boundaries pass through are burned too.
+    def rasterize(self, dataset, grid, value_field=None, all_touched=False):
+        raise NotImplementedError
+
+    # Read fields of a table into a mapping of field -> numpy array, nulls are read as null_value
+    def read_table(self, table, fields, null_value=0):
+        raise NotImplementedError
+
+    # Write the columns of a table_io.ColumnStore to a table, matching rows on key_field
+    def write_columns(self, table, columns, key_field="OBJECTID"):
+        raise NotImplementedError
+
+
+class ArcpyBackend(Backend):
+
+    name = "arcpy"
+    workspace_description = "Geodatabase"
+    valid_data_types = ["FeatureDataset", "ShapeFile", "FeatureClass"]
+
+    def __init__(self, workspace):
+        import arcpy
+        Backend.__init__(self, workspace)
+        self.arcpy = arcpy
+
+    @classmethod
+    def is_workspace(cls, path):
+        import arcpy
+        return path[-3:] == "gdb" and arcpy.Exists(path)
+
+    @classmethod
+    def create_workspace(cls, folder, name):
+        import arcpy
+        import os
+        path = os.path.join(folder, name + ".gdb")
+        if arcpy.Exists(path):
+            arcpy.Delete_management(path)
+        arcpy.CreateFileGDB_management(folder, name + ".gdb")
+        return path
+
+    def exists(self, dataset):
+        return self.arcpy.Exists(dataset)
+
+    def is_feature_data(self, dataset):
+        return self.arcpy.Describe(dataset).dataType in self.valid_data_types
+
+    def start(self):
+        # Overwrite output and checkout neccesary extensions
+        self.arcpy.env.overwriteOutput = True
+        self.arcpy.CheckOutExtension("spatial")
+        self.arcpy.env.workspace = self.workspace
+
+    def finish(self):
+        self.arcpy.CheckInExtension("spatial")
+
+    def select_parcels(self, quarter_sections, area_of_interest, out):
+        arcpy = self.arcpy
+        projected = "quarterSectionBoundaries_project"
+        layer = "quarterSectionBoundaries_project_layer"
+        source_layer = "quarterSectionBoundaries_layer"
+
+        # Only the quarter sections intersecting the area of interest are projected, not the whole province (the selection uses the spatial index
+        # of the quarter sections, and projects the area of interest on the fly)
+        arcpy.MakeFeatureLayer_management(quarter_sections, source_layer)
+        arcpy.SelectLayerByLocation_management(source_layer, "INTERSECT", area_of_interest, "", "NEW_SELECTION", "NOT_INVERT")
+
+        # Process: Project (a projected copy of the quarter sections, see projection.py, is copied as it is)
+        if self.coordinate_system(quarter_sections)[1] == "analysis":
+            arcpy.CopyFeatures_management(source_layer, projected)
+        else:
+            self.project(source_layer, projected)
+        self.delete([source_layer])
+
+        # Process: Make Feature Layer
+        arcpy.MakeFeatureLayer_management(projected, layer, "", "", "OBJECTID OBJECTID VISIBLE NONE;Shape Shape VISIBLE NONE;MER MER VISIBLE NONE;RGE RGE VISIBLE NONE;TWP TWP VISIBLE NONE;SEC SEC VISIBLE NONE;QS QS VISIBLE NONE;RA RA VISIBLE NONE;PARCEL_ID PARCEL_ID VISIBLE NONE;Shape_length Shape_length VISIBLE NONE;Shape_area Shape_area VISIBLE NONE")
+
+        # selects all parcels intersecting the users area of interest
+        # Process: Select Layer By Location
+        arcpy.SelectLayerByLocation_management(layer, "INTERSECT", area_of_interest, "", "NEW_SELECTION", "NOT_INVERT")
+
+        # Removes roads from parcel data to ensure that only quarter sections are selected
+        # Process: Select Layer By Attribute
+        arcpy.SelectLayerByAttribute_management(layer, "SUBSET_SELECTION", PARCEL_WHERE_CLAUSE)
+
+        # Process: Copy Features
+        arcpy.CopyFeatures_management(layer, out, "", "0", "0", "0")
+
+    # A feature layer keeps the OBJECTIDs of the parcels it selects
+    def select_townships(self, parcels, townships, out):
+        self.arcpy.MakeFeatureLayer_management(parcels, out, township_where_clause(townships))
+
+    def select_ids(self, dataset, object_ids, out):
+        self.arcpy.MakeFeatureLayer_management(dataset, out, "OBJECTID IN (%s)" % ", ".join("%d" % object_id for object_id in object_ids))
+
+    # The boxes are written to an in memory feature class and used with Select Layer By Location
+    def intersecting_ids(self, dataset, boxes, distance=0):
+        import numpy as np
+        arcpy = self.arcpy
+        boxes_class = arcpy.CreateFeatureclass_management("in_memory", "Changed_Boxes", "POLYGON", spatial_reference=arcpy.SpatialReference(PROJECTED_CRS_EPSG))[0]
+        with arcpy.da.InsertCursor(boxes_class, ["SHAPE@"]) as cursor:
+            for xmin, ymin, xmax, ymax in boxes:
+                cursor.insertRow([arcpy.Extent(xmin, ymin, xmax, ymax).polygon])
+        layer = "Intersecting_Layer"
+        arcpy.MakeFeatureLayer_management(dataset, layer)
+        arcpy.SelectLayerByLocation_management(layer, "INTERSECT", boxes_class, "%s Meters" % distance if distance else "", "NEW_SELECTION")
+        with arcpy.da.SearchCursor(layer, ["OID@"]) as cursor:
+            object_ids = np.array([object_id for object_id, in cursor], dtype=np.int64)
+        self.delete([layer, boxes_class])
+        return object_ids
+
+    def feature_index(self, dataset):
+        import hashlib
+        import numpy as np
+        digests = []
+        bounds = []
+        with self.arcpy.da.SearchCursor(dataset, ["SHAPE@"], spatial_reference=self.arcpy.SpatialReference(PROJECTED_CRS_EPSG)) as cursor:
+            for shape, in cursor:
+                if shape is None:
+                    digests.append(hashlib.sha1(b"").digest())
+                    bounds.append((np.nan,) * 4)
+                else:
+                    digests.append(hashlib.sha1(bytes(shape.WKB)).digest())
+                    bounds.append((shape.extent.XMin, shape.extent.YMin, shape.extent.XMax, shape.extent.YMax))
+        return np.array(digests, dtype="S20"), np.array(bounds, dtype=float).reshape(-1, 4)
+
+    def delete(self, datasets):
+        for dataset in datasets:
+            if self.arcpy.Exists(dataset):
+                self.arcpy.Delete_management(dataset)
+
+    def coordinate_system(self, dataset):
+        reference = self.arcpy.Describe(dataset).spatialReference
+        if reference is None or reference.name == "Unknown":
+            return None, None
+        if reference.factoryCode == PROJECTED_CRS_EPSG or reference.name == "NAD_1983_10TM_AEP_Forest":
+            return reference.name, "analysis"
+        return reference.name, reference.type.lower()
+
+    def project(self, dataset, out):
+        self.arcpy.Project_management(dataset, out, PROJECTED_CRS_WKT, "", GEOGRAPHIC_CRS_WKT, "NO_PRESERVE_SHAPE", "", "NO_VERTICAL")
+
+    def copy(self, dataset, out):
+        if hasattr(self.arcpy.Describe(dataset), "shapeType"):
+            self.arcpy.CopyFeatures_management(dataset, out)
+        else:
+            self.arcpy.CopyRows_management(dataset, out)
+
+    def copy_ids(self, dataset, object_ids, out):
+        arcpy = self.arcpy
+        layer = "Copy_Ids_Layer"
+        where_clause = "%s IN (%s)" % (arcpy.Describe(dataset).OIDFieldName, ", ".join("%d" % object_id for object_id in object_ids)) if len(object_ids) else "1 = 0"
+        arcpy.MakeFeatureLayer_management(dataset, layer, where_clause)
+        arcpy.CopyFeatures_management(layer, out)
+        self.delete([layer])
+
+    def fingerprint(self, dataset):
+        import hashlib
+        digest = hashlib.sha1()
+        # sorted here, shapefiles do not support ORDER BY
+        with self.arcpy.da.SearchCursor(dataset, ["OID@", "SHAPE@WKB"]) as cursor:
+            rows = sorted(cursor)
+        for object_id, wkb in rows:
+            digest.update(str(object_id).encode("ascii"))
+            digest.update(bytes(wkb or b""))
+        return digest.hexdigest()
+
+    # Datasets in a geodatabase have no size of their own on disk
+    def dataset_size(self, dataset):
+        return {"rows": int(self.arcpy.GetCount_management(dataset).getOutput(0)), "bytes": None}
+
+    # The input features are first selected by the clip features through their spatial index, so Clip only reads the candidates
+    def clip(self, in_features, clip_features, out):
+        layer = "Clip_Candidates_Layer"
+        self.arcpy.MakeFeatureLayer_management(in_features, layer)
+        self.arcpy.SelectLayerByLocation_management(layer, "INTERSECT", clip_features, "", "NEW_SELECTION", "NOT_INVERT")
+        self.arcpy.Clip_analysis(layer, clip_features, out, "")
+        self.delete([layer])
+
+    def erase(self, in_features, erase_features, out):
+        self.arcpy.Erase_analysis(in_features, erase_features, out, "")
+
+    def feature_to_line(self, in_features, out):
+        self.arcpy.FeatureToLine_management(in_features, out, "", "ATTRIBUTES")
+
+    def buffer(self, in_features, out, distance, dissolve=False):
+        self.arcpy.Buffer_analysis(in_features, out, "%s Meters" % distance, "FULL", "ROUND", "ALL" if dissolve else "NONE", "", "PLANAR")
+
+    def explode(self, in_features, out):
+        self.arcpy.MultipartToSinglepart_management(in_features, out)
+
+    def tabulate_intersection(self, zones, zone_field, in_features, out, class_fields=None):
+        self.arcpy.TabulateIntersection_analysis(zones, zone_field, in_features, out, class_fields or "", "", "", "UNKNOWN")
+
+    def near_table(self, in_features, near_features, out, search_radius=None):
+        radius = "%s Meters" % search_radius if search_radius else ""
+        self.arcpy.GenerateNearTable_analysis(in_features, near_features, out, radius, "NO_LOCATION", "NO_ANGLE", "CLOSEST", "0", "PLANAR")
+
+    def extent(self, dataset):
+        xmin = ymin = float("inf")
+        xmax = ymax = float("-inf")
+        # a cursor rather than Describe, so the extent of a feature layer is that of the features it selects
+        with self.arcpy.da.SearchCursor(dataset, ["SHAPE@"]) as cursor:
+            for shape, in cursor:
+                if shape is not None:
+                    xmin, ymin = min(xmin, shape.extent.XMin), min(ymin, shape.extent.YMin)
+                    xmax, ymax = max(xmax, shape.extent.XMax), max(ymax, shape.extent.YMax)
+        return xmin, ymin, xmax, ymax
+
+    # Polygon To Raster burns cell centres, the boundaries are added for all_touched with Polyline To Raster
+    def rasterize(self, dataset, grid, value_field=None, all_touched=False):
+        import numpy as np
+        arcpy = self.arcpy
+        field = value_field or arcpy.Describe(dataset).OIDFieldName
+        xmin, ymin, xmax, ymax = grid.extent
+        arcpy.env.extent = arcpy.Extent(xmin, ymin, xmax, ymax)
+        arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(PROJECTED_CRS_EPSG)
+        try:
+            arcpy.PolygonToRaster_conversion(dataset, field, "Rasterized", "CELL_CENTER", "", grid.cell_size)
+            # shapefile FIDs start at 0, so cells with no feature are read as -1
+            cells = arcpy.RasterToNumPyArray("Rasterized", arcpy.Point(xmin, ymin), grid.ncols, grid.nrows, -1)
+            if value_field is not None:
+                return np.maximum(cells, 0).astype(np.int32)
+            mask = cells != -1
+            if all_touched:
+                arcpy.PolygonToLine_management(dataset, "Rasterized_Boundary", "IGNORE_NEIGHBORS")
+                arcpy.PolylineToRaster_conversion("Rasterized_Boundary", "ORIG_FID", "Rasterized_Lines", "MAXIMUM_LENGTH", "", grid.cell_size)
+                mask |= arcpy.RasterToNumPyArray("Rasterized_Lines", arcpy.Point(xmin, ymin), grid.ncols, grid.nrows, -1) != -1
+            return mask
+        finally:
+            arcpy.env.extent = None
+            arcpy.env.outputCoordinateSystem = None
+            self.delete(["Rasterized", "Rasterized_Boundary", "Rasterized_Lines"])
+
+    def read_table(self, table, fields, null_value=0):
+        from table_io import read_table
+        return read_table(table, fields, null_value)
+
+    def write_columns(self, table, columns, key_field="OBJECTID"):
+        columns.write(table, key_field)
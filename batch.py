@@ -0,0 +1,224 @@
+#-------------------------------------------------------------------------------
+# Script Name: Conservation Priority Ranking for many areas of interest
+#-------------------------------------------------------------------------------
+
+# Ranks the parcels of every area of interest in a manifest without prompting, eg. every county and municipal district each night:
+#   python batch.py counties.csv C:/output --lotic lotic.gdb/riparian --wetlands wetlands.gdb/merged --quarter-sections ats.gdb/qs
+#                   --parks parks.gdb/protected --footprint hf.gdb/footprint [--backend open] [--workers 4]
+# The manifest is a CSV file with a name and an area_of_interest column (a polygon dataset, eg. counties.gpkg/stettler).
+
+# Each area of interest gets its own workspace in the output folder (<name>.gdb, or <name>.gpkg with the open backend) holding ParcelsFinal
+# and the intermediate data, the same as a run of Conservation_Priority_Ranking.py. With --metrics-format the metrics and scores are also saved
+# to metrics/AOI=<name>/metrics.<format>. With parquet that is one table partitioned by area of interest, which pyarrow can read
+# as a whole (pyarrow.dataset.dataset("metrics", partitioning="hive")).
+
+# The provincial inputs are read once by each process (arcpy reads them from disk for every tool, the open backend keeps them in memory) and
+# are shared by all of its areas of interest. Areas of interest are run in --workers processes, with at most --queue of them handed to the
+# processes at a time, so a long manifest is streamed through rather than queued all at once.
+
+# The outcome of each area of interest is appended to batch_state.jsonl in the output folder as soon as it is known. Running the same
+# batch again (eg. after a crash) skips the areas of interest that finished and runs the ones that failed or were never reached.
+# batch_summary.csv lists the status, parcel count, time and throughput of every area of interest, with the error of those that failed.
+
+import argparse
+import csv
+import json
+import os
+import re
+import time
+import traceback
+
+from backends import BACKENDS, get_backend, get_backend_class
+
+STATE_FILE = "batch_state.jsonl"
+SUMMARY_FILE = "batch_summary.csv"
+SUMMARY_FIELDS = ["name", "status", "parcels", "seconds", "parcels_per_second", "workspace", "error"]
+
+# The backend of a worker process, holding the provincial inputs it has read
+_shared_backend = None
+
+
+# The (name, area of interest) pairs of a manifest, in file order
+def read_manifest(path):
+    with open(path) as manifest_file:
+        reader = csv.DictReader(manifest_file)
+        missing = [field for field in ("name", "area_of_interest") if field not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError("the manifest has no %s column" % " or ".join(missing))
+        areas = [(row["name"].strip(), row["area_of_interest"].strip()) for row in reader if row["name"].strip()]
+    names = [name for name, _ in areas]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise ValueError("names must be unique in the manifest, repeated: %s" % ", ".join(duplicates))
+    # the workspaces and metrics partitions are named after workspace_name, and Windows folders ignore case
+    by_workspace = {}
+    for name in names:
+        by_workspace.setdefault(workspace_name(name).lower(), []).append(name)
+    clashes = ["%s (%s)" % (workspace_name(same[0]), ", ".join(same)) for same in by_workspace.values() if len(same) > 1]
+    if clashes:
+        raise ValueError("names must give different workspaces in the manifest, shared: %s" % "; ".join(clashes))
+    return areas
+
+
+# A workspace name for an area of interest (letters, digits and underscores)
+def workspace_name(name):
+    return re.sub(r"[^0-9A-Za-z_]", "_", name)
+
+
+# The last recorded outcome of every area of interest, name -> record
+def read_state(path):
+    state = {}
+    if os.path.exists(path):
+        with open(path) as state_file:
+            for line in state_file:
+                if line.strip():
+                    record = json.loads(line)
+                    state[record["name"]] = record
+    return state
+
+
+# Append one record and make sure it is on disk before carrying on, so a crash never loses a finished area of interest
+def append_state(path, record):
+    with open(path, "a") as state_file:
+        state_file.write(json.dumps(record, sort_keys=True) + "\n")
+        state_file.flush()
+        os.fsync(state_file.fileno())
+
+
+def write_summary(path, areas, state):
+    with open(path, "w") as summary_file:
+        writer = csv.writer(summary_file)
+        writer.writerow(SUMMARY_FIELDS)
+        for name, _ in areas:
+            record = state.get(name, {"name": name, "status": "not run"})
+            writer.writerow([record.get(field, "") for field in SUMMARY_FIELDS])
+
+
+# Process initializer: one backend per process, with the provincial inputs read into it
+def start_worker(backend_name, shared_inputs):
+    global _shared_backend
+    _shared_backend = get_backend(backend_name, None)
+    _shared_backend.preload(shared_inputs)
+
+
+# Rank one area of interest in its own workspace. Returns its state record, failures are recorded rather than raised.
+def run_area(name, area_of_interest, workspace, shared_inputs, metrics_out, options):
+    from Conservation_Priority_Ranking import main
+    started = time.time()
+    record = {"name": name, "workspace": workspace}
+    try:
+        backend = _shared_backend.with_workspace(workspace)
+        columns = main(workspace, area_of_interest, *shared_inputs, backend=backend, metrics_out=metrics_out, **options)
+        seconds = time.time() - started
+        record.update(status="done", parcels=len(columns.keys), seconds=round(seconds, 1),
+                      parcels_per_second=round(len(columns.keys) / seconds, 1) if seconds > 0 else "")
+    except Exception as error:
+        record.update(status="failed", seconds=round(time.time() - started, 1), error="%s: %s" % (type(error).__name__, error),
+                      traceback=traceback.format_exc())
+    return record
+
+
+# Run every area of interest of the manifest that has not finished yet. shared_inputs are the lotic, wetland, quarter section,
+# parks and footprint datasets (in the order of Conservation_Priority_Ranking.main), options are passed on to main
+# (eg. tile_parcels, engine, cell_size, footprint_buffer, proximity_radius, classifiers, cache).
+# Returns the state of every area of interest, name -> record.
+def run_batch(manifest, out_folder, shared_inputs, backend_name="arcpy", workers=1, queue_size=None, rerun=False, metrics_format=None, **options):
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    if workers > 1 and options.get("cache"):
+        raise ValueError("the cache can only be used with one worker, its index is not shared between processes")
+    areas = read_manifest(manifest)
+    if not os.path.isdir(out_folder):
+        os.makedirs(out_folder)
+    state_path = os.path.join(out_folder, STATE_FILE)
+    summary_path = os.path.join(out_folder, SUMMARY_FILE)
+    state = {} if rerun else read_state(state_path)
+    backend_class = get_backend_class(backend_name)
+
+    todo = [(name, area) for name, area in areas if state.get(name, {}).get("status") != "done"]
+    print("%d of %d areas of interest to run" % (len(todo), len(areas)))
+
+    def task(name, area):
+        workspace = backend_class.create_workspace(out_folder, workspace_name(name))
+        metrics_out = None
+        if metrics_format:
+            folder = os.path.join(out_folder, "metrics", "AOI=" + workspace_name(name))
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            metrics_out = os.path.join(folder, "metrics." + metrics_format)
+        return name, area, workspace, shared_inputs, metrics_out, options
+
+    def finish(record):
+        state[record["name"]] = record
+        append_state(state_path, record)
+        write_summary(summary_path, areas, state)
+        if record["status"] == "done":
+            print("%s: %d parcels in %.1f s" % (record["name"], record["parcels"], record["seconds"]))
+        else:
+            print("%s: FAILED, %s" % (record["name"], record["error"]))
+
+    started = time.time()
+    if workers <= 1:
+        start_worker(backend_name, shared_inputs)
+        for name, area in todo:
+            finish(run_area(*task(name, area)))
+    else:
+        queue_size = queue_size or 2 * workers
+        pending = list(todo)
+        with ProcessPoolExecutor(max_workers=workers, initializer=start_worker, initargs=(backend_name, shared_inputs)) as pool:
+            running = {}
+            while pending or running:
+                while pending and len(running) < queue_size:
+                    name, area = pending.pop(0)
+                    running[pool.submit(run_area, *task(name, area))] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+                    finish(future.result())
+
+    write_summary(summary_path, areas, state)
+    failed = [name for name, _ in areas if state.get(name, {}).get("status") == "failed"]
+    print("batch finished in %.1f s, %d failed, summary written to %s" % (time.time() - started, len(failed), summary_path))
+    return state
+
+
+if __name__ == "__main__":
+    from rescore import parse_assignments
+    from scoring import CLASSIFIED_FACTORS, classifier_for
+
+    parser = argparse.ArgumentParser(description="Conservation Priority Ranking for every area of interest in a manifest")
+    parser.add_argument("manifest", help="CSV file with name and area_of_interest columns")
+    parser.add_argument("out", help="folder for the workspaces, state and summary of the batch")
+    parser.add_argument("--lotic", required=True, help="Alberta Riparian/Lotic data")
+    parser.add_argument("--wetlands", required=True, help="Alberta wetlands data")
+    parser.add_argument("--quarter-sections", required=True, help="Alberta Quarter Section data")
+    parser.add_argument("--parks", required=True, help="Alberta Parks and Protected Areas data")
+    parser.add_argument("--footprint", required=True, help="Alberta Human Footprint data")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="arcpy", help="geoprocessing backend (default: arcpy)")
+    parser.add_argument("--workers", type=int, default=1, help="number of areas of interest run at once, each in its own process (default: 1)")
+    parser.add_argument("--queue", type=int, default=None, help="most areas of interest handed to the worker processes at a time (default: twice the workers)")
+    parser.add_argument("--rerun", action="store_true", help="run every area of interest again, including those that finished")
+    parser.add_argument("--metrics-format", choices=["npz", "arrow", "feather", "parquet"], default=None, help="also save the metrics and scores of each area of interest in this format")
+    parser.add_argument("--classify", action="append", help="Factor=method for %s, can be repeated" % ", ".join(CLASSIFIED_FACTORS))
+    parser.add_argument("--tile-parcels", type=int, default=None, help="geoprocess the parcels of each area of interest in tiles of at most this many parcels")
+    parser.add_argument("--cache", default=None, help="folder to keep geoprocessing results in between runs (one worker only)")
+    parser.add_argument("--cache-size", type=float, default=5, help="largest size of the cache in GB (default: 5)")
+    parser.add_argument("--proximity-radius", type=float, default=None, help="search for protected areas within this many meters of each parcel (default: 4000)")
+    parser.add_argument("--engine", choices=["vector", "raster"], default="vector", help="compute intactness and patch size by vector overlay or on a grid (default: vector)")
+    parser.add_argument("--cell-size", type=float, default=None, help="cell size in meters of the raster engine (default: 25)")
+    parser.add_argument("--footprint-buffer", type=float, default=None, help="buffer the human footprint by this many meters (raster engine only)")
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache:
+        from cache import IntermediateCache
+        cache = IntermediateCache(args.cache, int(args.cache_size * 1024 ** 3))
+
+    try:
+        classifiers = dict((factor, classifier_for(factor, method)) for factor, method in parse_assignments(args.classify, str).items())
+        run_batch(args.manifest, args.out, [args.lotic, args.wetlands, args.quarter_sections, args.parks, args.footprint],
+                  backend_name=args.backend, workers=args.workers, queue_size=args.queue, rerun=args.rerun, metrics_format=args.metrics_format,
+                  classifiers=classifiers, tile_parcels=args.tile_parcels, cache=cache, proximity_radius=args.proximity_radius,
+                  engine=args.engine, cell_size=args.cell_size, footprint_buffer=args.footprint_buffer)
+    except ValueError as error:
+        parser.error(str(error))
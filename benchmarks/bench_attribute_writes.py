@@ -0,0 +1,96 @@
+#-------------------------------------------------------------------------------
+# Benchmark: writing the derived parcel fields (requires arcpy)
+#-------------------------------------------------------------------------------
+
+# Builds a parcel fixture table in a scratch file geodatabase and times two ways of writing the 14 derived fields:
+#   before: AddField plus a positional UpdateCursor pass for every field (and a null fill pass for the joined fields),
+#           which is how main() used to write them
+#   after:  ColumnStore.write, one schema change and one cursor pass matched by OBJECTID
+#
+# usage: python benchmarks/bench_attribute_writes.py [--parcels 50000] [--scratch C:\temp]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from table_io import ColumnStore
+
+FIELDS = ["Area_Intact", "Percent_Intact", "Area_Lotic", "Percent_Lotic", "Wetland_Edge", "Largest_Patch_Area", "Dist_to_Protected",
+          "SCORE_Intactness", "SCORE_Lotic_Deciles", "SCORE_Wetland_Deciles", "SCORE_Patch_Size", "SCORE_Proximity", "PRIORITY_SCORE", "PRIORITY_RANKING"]
+JOINED_FIELDS = FIELDS[:5]
+
+
+# A table with one row per parcel and a PARCEL_ID column, so there is something to carry along like the real parcels
+def make_fixture(gdb, name, n_parcels):
+    import arcpy
+    table = os.path.join(gdb, name)
+    if arcpy.Exists(table):
+        arcpy.Delete_management(table)
+    rows = np.zeros(n_parcels, dtype=[("PARCEL_ID", "i4")])
+    rows["PARCEL_ID"] = np.arange(n_parcels)
+    arcpy.da.NumPyArrayToTable(rows, table)
+    return table
+
+
+def write_before(table, values):
+    import arcpy
+    for field in FIELDS:
+        arcpy.AddField_management(table, field, "DOUBLE", field_length = 50)
+        if field in JOINED_FIELDS:
+            with arcpy.da.UpdateCursor(table, [field]) as cursor:
+                for row in cursor:
+                    if row[0] == None:
+                        row[0] = 0
+                        cursor.updateRow(row)
+        x = 0
+        with arcpy.da.UpdateCursor(table, field) as cursor:
+            for row in cursor:
+                row[0] = values[field][x]
+                cursor.updateRow(row)
+                x += 1
+
+
+def write_after(table, keys, values):
+    columns = ColumnStore(keys)
+    for field in FIELDS:
+        columns[field] = values[field]
+    columns.write(table, "OBJECTID")
+
+
+def main():
+    import arcpy
+    parser = argparse.ArgumentParser(description="Benchmark the derived parcel field writes")
+    parser.add_argument("--parcels", type=int, default=50000)
+    parser.add_argument("--scratch", default=tempfile.gettempdir())
+    args = parser.parse_args()
+
+    gdb = os.path.join(args.scratch, "bench_attribute_writes.gdb")
+    if not arcpy.Exists(gdb):
+        arcpy.CreateFileGDB_management(args.scratch, "bench_attribute_writes.gdb")
+
+    rng = np.random.default_rng(0)
+    values = dict((field, rng.random(args.parcels)) for field in FIELDS)
+
+    before_table = make_fixture(gdb, "Parcels_Before", args.parcels)
+    start = time.time()
+    write_before(before_table, dict((field, values[field].tolist()) for field in FIELDS))
+    before = time.time() - start
+
+    after_table = make_fixture(gdb, "Parcels_After", args.parcels)
+    keys = arcpy.da.TableToNumPyArray(after_table, "OBJECTID")["OBJECTID"]
+    start = time.time()
+    write_after(after_table, keys, values)
+    after = time.time() - start
+
+    print("%d parcels, %d fields" % (args.parcels, len(FIELDS)))
+    print("before (AddField + cursor pass per field): %8.2f s" % before)
+    print("after  (ColumnStore.write):                %8.2f s" % after)
+
+
+if __name__ == "__main__":
+    main()
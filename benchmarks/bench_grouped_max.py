@@ -0,0 +1,69 @@
+#-------------------------------------------------------------------------------
+# Benchmark: largest intact patch per parcel
+#-------------------------------------------------------------------------------
+
+# Times grouped_max on synthetic Tabulate Intersection tables of increasing size and prints the cost per row.
+# If the reduction is linear (apart from the sort) the time per row stays roughly flat as the table grows.
+# The old list-scanning approach is timed on the small sizes only, to show how quickly it blows up.
+#
+# usage: python benchmarks/bench_grouped_max.py [--sizes 10000 100000 1000000] [--legacy-max 20000]
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from grouped_reduction import grouped_max
+
+
+# One row per parcel/patch intersection, about 4 patches per parcel, shuffled like a real output table
+def make_table(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    n_parcels = max(n_rows // 4, 1)
+    parcel_ids = np.arange(1, n_parcels + 1)
+    keys = rng.integers(1, n_parcels + 1, size=n_rows)
+    areas = rng.lognormal(12, 2, size=n_rows)
+    return parcel_ids, keys, areas
+
+
+# The original algorithm: re-scan the whole patch table for every parcel
+def legacy_max(parcel_ids, keys, areas):
+    keys = keys.tolist()
+    areas = areas.tolist()
+    rows = list(zip(keys, areas))
+    result = []
+    for ID in parcel_ids.tolist():
+        if ID not in keys:
+            result.append(0)
+        else:
+            result.append(max(area for key, area in rows if key == ID))
+    return result
+
+
+def best_of(func, repeat=3):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the grouped largest-patch reduction")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000, 10000000])
+    parser.add_argument("--legacy-max", type=int, default=20000, help="largest table size to run the old algorithm on")
+    args = parser.parse_args()
+
+    print("%12s %12s %14s %14s" % ("rows", "grouped (s)", "ns per row", "legacy (s)"))
+    for n_rows in args.sizes:
+        parcel_ids, keys, areas = make_table(n_rows)
+        grouped = best_of(lambda: grouped_max(keys, areas, parcel_ids))
+        legacy = ""
+        if n_rows <= args.legacy_max:
+            expected = grouped_max(keys, areas, parcel_ids)
+            assert np.allclose(legacy_max(parcel_ids, keys, areas), expected)
+            legacy = "%.3f" % best_of(lambda: legacy_max(parcel_ids, keys, areas), repeat=1)
+        print("%12d %12.4f %14.1f %14s" % (n_rows, grouped, grouped / n_rows * 1e9, legacy))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#-------------------------------------------------------------------------------
+# Benchmark: natural breaks (Fisher-Jenks)
+#-------------------------------------------------------------------------------
+
+# Compares jenks_breaks (divide and conquer, O(k n log n)) with the textbook O(k n^2) dynamic program.
+# Both are checked to reach the same total within-class squared deviation on the sizes the naive version can run.
+# For larger sizes the naive time is extrapolated from its quadratic growth (marked with ~).
+#
+# usage: python benchmarks/bench_jenks.py [--sizes 1000 100000 1000000] [--classes 10] [--naive-max 4000]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from classification import jenks_breaks
+
+
+# The textbook Fisher-Jenks dynamic program over the sorted values, O(k n^2)
+def naive_jenks_breaks(values, n_classes):
+    sorted_values = np.sort(np.asarray(values, dtype=float))
+    n = len(sorted_values)
+    x = sorted_values - sorted_values.mean()
+    S = np.concatenate([[0.0], np.cumsum(x)])
+    Q = np.concatenate([[0.0], np.cumsum(x * x)])
+    D = np.full((n_classes + 1, n + 1), np.inf)
+    split = np.zeros((n_classes + 1, n + 1), dtype=np.intp)
+    i = np.arange(1, n + 1)
+    D[1, 1:] = Q[i] - S[i] ** 2 / i
+    for c in range(2, n_classes + 1):
+        for i in range(c, n + 1):
+            j = np.arange(c - 1, i)
+            s = S[i] - S[j]
+            cost = D[c - 1, j] + (Q[i] - Q[j] - s * s / (i - j))
+            best = np.argmin(cost)
+            D[c, i] = cost[best]
+            split[c, i] = j[best]
+    breaks = []
+    i = n
+    for c in range(n_classes, 1, -1):
+        j = split[c, i]
+        breaks.append(sorted_values[j - 1])
+        i = j
+    return np.array(breaks[::-1])
+
+
+# Total within-class sum of squared deviations for a set of upper-inclusive breaks
+def within_class_ssd(values, breaks):
+    classes = np.searchsorted(breaks, values, side="left")
+    total = 0.0
+    for c in np.unique(classes):
+        members = values[classes == c]
+        total += ((members - members.mean()) ** 2).sum()
+    return total
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark natural breaks classification")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000, 100000, 300000, 1000000])
+    parser.add_argument("--classes", type=int, default=10)
+    parser.add_argument("--naive-max", type=int, default=4000, help="largest size to run the naive dynamic program on")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    naive_rate = None
+    print("%10s %12s %14s %10s" % ("values", "fast (s)", "naive (s)", "same SSD"))
+    for n in args.sizes:
+        # a mix of skewed clusters, like wetland edge lengths
+        values = np.concatenate([rng.lognormal(mu, 0.4, n // 4) for mu in (4, 5.5, 6.5, 8)])
+        fast_seconds, fast = timed(jenks_breaks, values, args.classes)
+        if n <= args.naive_max:
+            naive_seconds, naive = timed(naive_jenks_breaks, values, args.classes)
+            naive_rate = naive_seconds / float(len(values)) ** 2
+            same = np.isclose(within_class_ssd(values, fast), within_class_ssd(values, naive), rtol=1e-9)
+            print("%10d %12.3f %14.3f %10s" % (len(values), fast_seconds, naive_seconds, same))
+        else:
+            estimate = "~%.0f" % (naive_rate * float(len(values)) ** 2) if naive_rate else "-"
+            print("%10d %12.3f %14s %10s" % (len(values), fast_seconds, estimate, "-"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#-------------------------------------------------------------------------------
+# Benchmark: distance to the nearest protected area
+#-------------------------------------------------------------------------------
+
+# Compares the bounded STRtree search in proximity.py with an exhaustive Near (every parcel against every protected area)
+# and with an unbounded STRtree nearest search, on a synthetic province: a grid of quarter section parcels (800 m squares)
+# and irregular protected areas with many vertices scattered over it. Alberta has roughly a million quarter sections and
+# several hundred parks and protected areas, so by default there is one protected area per 2000 parcels.
+# The exhaustive search is timed on --sample parcels and extrapolated. The bounded search is checked against it.
+#
+# usage: python benchmarks/bench_proximity.py [--parcels 100000 1000000] [--parks N] [--radius 4000]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from proximity import nearest_exhaustive, nearest_within
+
+QUARTER_SECTION = 800.0
+
+
+def make_parcels(n_parcels):
+    import shapely
+    side = int(np.ceil(np.sqrt(n_parcels)))
+    column, row = np.divmod(np.arange(n_parcels), side)
+    return shapely.box(column * QUARTER_SECTION, row * QUARTER_SECTION, (column + 1) * QUARTER_SECTION, (row + 1) * QUARTER_SECTION), side * QUARTER_SECTION
+
+
+# Star shaped polygons of 200 to 2000 vertices, 1 to 20 km across
+def make_parks(n_parks, extent, seed=0):
+    import shapely
+    rng = np.random.default_rng(seed)
+    parks = []
+    for _ in range(n_parks):
+        n_vertices = rng.integers(200, 2000)
+        angles = np.sort(rng.uniform(0, 2 * np.pi, n_vertices))
+        radius = rng.uniform(500, 10000) * rng.uniform(0.6, 1.0, n_vertices)
+        x, y = rng.uniform(0, extent, 2)
+        parks.append(shapely.polygons(np.column_stack([x + radius * np.cos(angles), y + radius * np.sin(angles)])))
+    return shapely.make_valid(np.array(parks, dtype=object))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark nearest protected area distance")
+    parser.add_argument("--parcels", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--parks", type=int, default=None, help="number of protected areas (default: one per 2000 parcels)")
+    parser.add_argument("--radius", type=float, default=4000)
+    parser.add_argument("--sample", type=int, default=500)
+    args = parser.parse_args()
+
+    print("%10s %8s %16s %16s %16s %10s" % ("parcels", "parks", "exhaustive (s)", "unbounded (s)", "bounded (s)", "agree"))
+    for n_parcels in args.parcels:
+        parcels, extent = make_parcels(n_parcels)
+        n_parks = args.parks or max(n_parcels // 2000, 10)
+        parks = make_parks(n_parks, extent)
+        sample = np.random.default_rng(1).choice(n_parcels, min(args.sample, n_parcels), replace=False)
+
+        started = time.time()
+        _, exhaustive = nearest_exhaustive(parcels[sample], parks)
+        exhaustive_seconds = (time.time() - started) / len(sample) * n_parcels
+
+        started = time.time()
+        nearest_within(parcels, parks, search_radius=None)
+        unbounded_seconds = time.time() - started
+
+        started = time.time()
+        _, bounded = nearest_within(parcels, parks, search_radius=args.radius)
+        bounded_seconds = time.time() - started
+
+        # within the radius the distances must match, beyond it the bounded search reports none
+        expected = np.where(exhaustive <= args.radius, exhaustive, np.inf)
+        found = bounded[sample]
+        agree = np.array_equal(np.isinf(expected), np.isinf(found)) and np.allclose(expected[~np.isinf(expected)], found[~np.isinf(found)])
+        print("%10d %8d %16.1f %16.2f %16.2f %10s" % (n_parcels, n_parks, exhaustive_seconds, unbounded_seconds, bounded_seconds, agree))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#-------------------------------------------------------------------------------
+# Benchmark: vector and raster intactness and patch size
+#-------------------------------------------------------------------------------
+
+# Runs the intactness and largest_patch factors of pipeline.py with the open backend, by vector overlay and with the raster engine
+# (see raster.py), on a synthetic area: a grid of quarter section parcels (800 m squares) crossed by a road every mile in both
+# directions, with well sites and cultivated fields scattered over it. The area of interest is the parcel grid and patches are
+# searched for within 50 km of it, so the footprint covers that too. Prints the time of each engine and how far the raster metrics
+# are from the vector ones: the mean error of Percent_Intact and of the largest patch, the largest difference of Area_Intact, and
+# the number of parcels given a different SCORE_Patch_Size (with the default thresholds of 160, 2500 and 10000 acres).
+#
+# usage: python benchmarks/bench_raster.py [--parcels 2000 10000] [--cell-size 25 10] [--footprint-buffer 0]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from backends import PROJECTED_CRS_EPSG
+from open_backend import OpenBackend
+from pipeline import PATCH_SEARCH_DISTANCE, Inputs, intactness, largest_patch
+from scoring import DEFAULT_CLASSIFIERS
+
+QUARTER_SECTION = 800.0
+ROAD_SPACING = 1600.0
+ROAD_WIDTH = 20.0
+
+
+def frame(geometries, **columns):
+    import geopandas
+    return geopandas.GeoDataFrame(columns, geometry=np.asarray(geometries, dtype=object), crs="EPSG:%d" % PROJECTED_CRS_EPSG)
+
+
+def make_parcels(n_parcels):
+    import shapely
+    side = int(np.ceil(np.sqrt(n_parcels)))
+    column, row = np.divmod(np.arange(n_parcels), side)
+    parcels = shapely.box(column * QUARTER_SECTION, row * QUARTER_SECTION, (column + 1) * QUARTER_SECTION, (row + 1) * QUARTER_SECTION)
+    return parcels, side * QUARTER_SECTION
+
+
+# Roads on the section lines, 1 ha well sites and fields of 10 to 60 ha, over the area of interest and its patch search buffer
+def make_footprint(extent, seed=0):
+    import shapely
+    rng = np.random.default_rng(seed)
+    low, high = -PATCH_SEARCH_DISTANCE, extent + PATCH_SEARCH_DISTANCE
+    lines = np.arange(low, high, ROAD_SPACING)
+    roads = np.concatenate([shapely.box(lines - ROAD_WIDTH / 2, low, lines + ROAD_WIDTH / 2, high),
+                            shapely.box(low, lines - ROAD_WIDTH / 2, high, lines + ROAD_WIDTH / 2)])
+    area = (high - low) ** 2
+    n_wells = int(area / 4e6)
+    wells = shapely.buffer(shapely.points(rng.uniform(low, high, (n_wells, 2))), 60, quad_segs=4)
+    n_fields = int(area / 2e7)
+    x, y = rng.uniform(low, high, (2, n_fields))
+    width, height = rng.uniform(300, 800, (2, n_fields))
+    fields = shapely.box(x, y, x + width, y + height)
+    return np.concatenate([roads, wells, fields])
+
+
+def run_factors(backend, parcels, parcel_IDs, inputs, **settings):
+    started = time.time()
+    metrics = intactness(backend, parcels, parcel_IDs, inputs, **settings)
+    metrics.update(largest_patch(backend, parcels, parcel_IDs, inputs, **settings))
+    return metrics, time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vector and raster intactness and patch size engines")
+    parser.add_argument("--parcels", type=int, nargs="+", default=[2000, 10000])
+    parser.add_argument("--cell-size", type=float, nargs="+", default=[25, 10])
+    parser.add_argument("--footprint-buffer", type=float, default=0)
+    args = parser.parse_args()
+
+    print("%10s %10s %12s %12s %18s %18s %20s %20s" % ("parcels", "engine", "cell size", "seconds", "% intact error", "patch error (%)",
+                                                      "area intact max (m2)", "patch scores differ"))
+    for n_parcels in args.parcels:
+        parcels, extent = make_parcels(n_parcels)
+        footprint = make_footprint(extent)
+        backend = OpenBackend("bench_raster.gpkg", write_intermediates=False)
+        backend.save("Parcels", frame(parcels, OBJECTID=np.arange(1, n_parcels + 1)))
+        backend.save("AreaOfInterest", frame([parcels[0].envelope.union(parcels[-1].envelope).envelope]))
+        backend.save("Footprint", frame(footprint))
+        inputs = Inputs("AreaOfInterest", None, None, None, None, "Footprint")
+        parcel_IDs = np.arange(1, n_parcels + 1)
+
+        vector, seconds = run_factors(backend, "Parcels", parcel_IDs, inputs)
+        print("%10d %10s %12s %12.2f %18s %18s %20s %20s" % (n_parcels, "vector", "", seconds, "", "", "", ""))
+        vector_scores = DEFAULT_CLASSIFIERS["Patch_Size"](vector["Largest_Patch_Area"])
+        for cell_size in args.cell_size:
+            raster, seconds = run_factors(backend, "Parcels", parcel_IDs, inputs, engine="raster", cell_size=cell_size, footprint_buffer=args.footprint_buffer)
+            intact_error = np.abs(raster["Percent_Intact"] - vector["Percent_Intact"]).mean()
+            patch_error = np.abs(raster["Largest_Patch_Area"] / np.maximum(vector["Largest_Patch_Area"], 1e-9) - 1).mean() * 100
+            area_difference = np.abs(raster["Area_Intact"] - vector["Area_Intact"]).max()
+            scores_differ = (DEFAULT_CLASSIFIERS["Patch_Size"](raster["Largest_Patch_Area"]) != vector_scores).sum()
+            print("%10d %10s %12g %12.2f %18.2f %18.2f %20.0f %20s" % (n_parcels, "raster", cell_size, seconds, intact_error, patch_error,
+                                                                    area_difference, "%d of %d" % (scores_differ, n_parcels)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#-------------------------------------------------------------------------------
+# Benchmark: scoring and ranking
+#-------------------------------------------------------------------------------
+
+# Times score_parcels (all 5 factor scores, PRIORITY_SCORE and PRIORITY_RANKING) on synthetic metrics.
+#
+# usage: python benchmarks/bench_scoring.py [--sizes 100000 1000000 5000000]
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from scoring import score_parcels
+
+
+def make_metrics(n_parcels, seed=0):
+    rng = np.random.default_rng(seed)
+    has_lotic = rng.random(n_parcels) < 0.3
+    has_wetland = rng.random(n_parcels) < 0.6
+    return {
+        "Percent_Intact": rng.uniform(0, 100, n_parcels),
+        "Percent_Lotic": np.where(has_lotic, rng.uniform(0, 100, n_parcels), 0),
+        "Wetland_Edge": np.where(has_wetland, rng.lognormal(6, 1, n_parcels), 0),
+        "Largest_Patch_Area": rng.lognormal(6, 2, n_parcels),
+        "Dist_to_Protected": np.where(rng.random(n_parcels) < 0.05, 0, rng.exponential(8000, n_parcels)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parcel scoring")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000, 5000000])
+    args = parser.parse_args()
+
+    print("%12s %12s %14s" % ("parcels", "seconds", "ns per parcel"))
+    for n_parcels in args.sizes:
+        metrics = make_metrics(n_parcels)
+        seconds = min(timeit.repeat(lambda: score_parcels(metrics), number=1, repeat=3))
+        print("%12d %12.4f %14.1f" % (n_parcels, seconds, seconds / n_parcels * 1e9))
+
+
+if __name__ == "__main__":
+    main()
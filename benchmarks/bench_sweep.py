@@ -0,0 +1,58 @@
+#-------------------------------------------------------------------------------
+# Benchmark: sensitivity sweeps
+#-------------------------------------------------------------------------------
+
+# Times sensitivity.sweep over a grid of weight and threshold scenarios, against calling score_parcels once per scenario.
+# The loop is timed on the first --loop-scenarios scenarios only and extrapolated to the whole grid, and the rankings of the sweep are
+# checked to be the same as those of score_parcels for those scenarios (most of them weighted).
+#
+# usage: python benchmarks/bench_sweep.py [--parcels 100000] [--loop-scenarios 50]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from bench_scoring import make_metrics
+from scoring import score_parcels
+from sensitivity import scenario_grid, scenario_parameters, sweep
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sensitivity sweeps")
+    parser.add_argument("--parcels", type=int, default=100000)
+    parser.add_argument("--loop-scenarios", type=int, default=50)
+    args = parser.parse_args()
+
+    metrics = make_metrics(args.parcels)
+    scenarios = scenario_grid(
+        weights={"Lotic": [0.5, 1, 2], "Wetland": [0.5, 1, 2], "Intactness": [0.5, 1, 2], "Patch_Size": [0.5, 1, 2], "Proximity": [0.5, 1, 2]},
+        thresholds={"Proximity": [[0, 2000, 4000], [0, 1000, 3000], [0, 3000, 6000]], "Patch_Size": [[160, 2500, 10000], [80, 1280, 5000]]},
+    )
+
+    started = time.time()
+    rankings = sweep(metrics, scenarios, keep_rankings=True)[2]
+    sweep_seconds = time.time() - started
+
+    started = time.time()
+    looped = []
+    for scenario in scenarios[:args.loop_scenarios]:
+        classifiers, weights = scenario_parameters(scenario)
+        looped.append(score_parcels(metrics, classifiers, weights)["PRIORITY_RANKING"])
+    loop_seconds = (time.time() - started) / min(args.loop_scenarios, len(scenarios)) * len(scenarios)
+    checked = len(looped)
+    same = np.array_equal(rankings[:, :checked], np.column_stack(looped), equal_nan=True)
+
+    print("%d parcels, %d scenarios" % (args.parcels, len(scenarios)))
+    print("%-28s %10.2f s" % ("sweep", sweep_seconds))
+    print("%-28s %10.2f s (extrapolated)" % ("score_parcels per scenario", loop_seconds))
+    print("same rankings as score_parcels on %d scenarios: %s" % (checked, same))
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#-------------------------------------------------------------------------------
+# Synthetic Alberta-like input datasets for benchmarking
+#-------------------------------------------------------------------------------
+
+# Writes a complete set of inputs for Conservation_Priority_Ranking.main() without any provincial data, at a chosen number of
+# quarter sections. Everything is generated from a seed, so the same tier and densities always give the same datasets.
+#   - quarter sections: an Alberta Township System grid (west of the 4th meridian) of 1 mile sections in 6 x 6 section townships,
+#     each section split into SW, SE, NW and NE quarters with MER, RGE, TWP, SEC and QS fields, and a road allowance row
+#     (RA = 'R', a one chain strip along the south and west edges of the section) for every section,
+#   - human footprint: roads on every road_every'th road allowance, well sites and cultivated fields,
+#   - wetlands: round and irregular basins,
+#   - lotic (riparian) areas: buffered streams that wander across the grid,
+#   - protected areas: irregular polygons with hundreds of vertices,
+#   - the area of interest: the whole parcel grid.
+# The footprint also covers PATCH_SEARCH_DISTANCE around the grid, where the patch step looks for intact patches.
+# Densities are per square kilometre (streams and parks per 1000 km2) and can be changed for each run.
+#
+# usage: python benchmarks/fixtures.py TIER [--folder benchmarks/data]   (TIER is 1k, 10k, 100k, 1m or a number of parcels)
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from backends import PROJECTED_CRS_EPSG
+from pipeline import PATCH_SEARCH_DISTANCE
+
+# Scale tiers: name -> number of quarter section parcels (rounded up to whole sections)
+TIERS = {"1k": 1000, "10k": 10000, "100k": 100000, "1m": 1000000}
+
+SECTION = 1609.344
+ROAD_ALLOWANCE = 20.1168
+TOWNSHIP_SECTIONS = 6
+
+# South west corner of the grid (NAD 1983 10TM AEP Forest)
+ORIGIN = (300000.0, 5700000.0)
+
+DEFAULT_DENSITIES = {
+    "road_every": 2,
+    "wells": 0.5,
+    "fields": 0.05,
+    "wetlands": 1.0,
+    "streams": 5.0,
+    "parks": 0.8,
+}
+
+DEFAULT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# Inputs written for every tier, in the order of the Inputs fields of pipeline.py
+INPUT_FILES = ["area_of_interest", "lotic", "wetlands", "quarter_sections", "parks", "footprint"]
+
+
+def tier_parcels(tier):
+    return TIERS[tier] if tier in TIERS else int(tier)
+
+
+def frame(geometries, **columns):
+    import geopandas
+    return geopandas.GeoDataFrame(columns, geometry=np.asarray(geometries, dtype=object), crs="EPSG:%d" % PROJECTED_CRS_EPSG)
+
+
+# Section numbers of the Alberta Township System: 1 in the south east corner of a township, back and forth up to 36 in the north east
+def section_numbers(column, row):
+    column, row = column % TOWNSHIP_SECTIONS, row % TOWNSHIP_SECTIONS
+    eastward = row * TOWNSHIP_SECTIONS + column + 1
+    westward = row * TOWNSHIP_SECTIONS + TOWNSHIP_SECTIONS - column
+    return np.where(row % 2 == 0, westward, eastward)
+
+
+# The quarter sections and road allowances of a grid of side x side sections
+def make_quarter_sections(side):
+    import shapely
+    column, row = np.divmod(np.arange(side * side), side)
+    x = ORIGIN[0] + column * SECTION
+    y = ORIGIN[1] + row * SECTION
+    half = (SECTION + ROAD_ALLOWANCE) / 2
+
+    quarters = []
+    for name, dx, dy in [("SW", 0, 0), ("SE", 1, 0), ("NW", 0, 1), ("NE", 1, 1)]:
+        left = x + ROAD_ALLOWANCE + dx * (half - ROAD_ALLOWANCE)
+        bottom = y + ROAD_ALLOWANCE + dy * (half - ROAD_ALLOWANCE)
+        quarters.append((name, shapely.box(left, bottom, np.where(dx, x + SECTION, x + half), np.where(dy, y + SECTION, y + half))))
+
+    # the road allowance along the south and west edges of each section, as one L shaped polygon
+    corners = np.stack([np.column_stack([x, y]), np.column_stack([x + SECTION, y]), np.column_stack([x + SECTION, y + ROAD_ALLOWANCE]),
+                        np.column_stack([x + ROAD_ALLOWANCE, y + ROAD_ALLOWANCE]), np.column_stack([x + ROAD_ALLOWANCE, y + SECTION]),
+                        np.column_stack([x, y + SECTION]), np.column_stack([x, y])], axis=1)
+    roads = shapely.polygons(corners)
+
+    geometries = np.concatenate([geometry for _, geometry in quarters] + [roads])
+    count = len(x)
+    return frame(geometries,
+                 MER=np.full(5 * count, 4, dtype=np.int32),
+                 RGE=np.tile(column // TOWNSHIP_SECTIONS + 1, 5).astype(np.int32),
+                 TWP=np.tile(row // TOWNSHIP_SECTIONS + 1, 5).astype(np.int32),
+                 SEC=np.tile(section_numbers(column, row), 5).astype(np.int32),
+                 QS=np.repeat([name for name, _ in quarters] + [""], count),
+                 RA=np.repeat(["", "", "", "", "R"], count))
+
+
+# Star shaped polygons of n_vertices around centres, radius in meters (one per polygon), radii varying by up to 40% around the outline
+def make_blobs(rng, x, y, radius, n_vertices):
+    import shapely
+    angles = np.sort(rng.uniform(0, 2 * np.pi, (len(x), n_vertices)), axis=1)
+    radii = radius[:, np.newaxis] * rng.uniform(0.6, 1.0, (len(x), n_vertices))
+    rings = np.stack([x[:, np.newaxis] + radii * np.cos(angles), y[:, np.newaxis] + radii * np.sin(angles)], axis=2)
+    return shapely.make_valid(shapely.polygons(np.concatenate([rings, rings[:, :1]], axis=1)))
+
+
+def make_footprint(rng, extent, densities):
+    import shapely
+    xmin, ymin, xmax, ymax = extent
+    area_km2 = (xmax - xmin) * (ymax - ymin) / 1e6
+    spacing = SECTION * densities["road_every"]
+    east = ORIGIN[0] + np.arange(np.ceil((xmin - ORIGIN[0]) / spacing), np.floor((xmax - ORIGIN[0]) / spacing) + 1) * spacing
+    north = ORIGIN[1] + np.arange(np.ceil((ymin - ORIGIN[1]) / spacing), np.floor((ymax - ORIGIN[1]) / spacing) + 1) * spacing
+    roads = np.concatenate([shapely.box(east, ymin, east + ROAD_ALLOWANCE, ymax), shapely.box(xmin, north, xmax, north + ROAD_ALLOWANCE)])
+
+    n_wells = rng.poisson(densities["wells"] * area_km2)
+    wells = shapely.box(*np.vstack([rng.uniform(xmin, xmax, n_wells), rng.uniform(ymin, ymax, n_wells)] * 2) + np.array([[0], [0], [100], [100]]))
+    n_fields = rng.poisson(densities["fields"] * area_km2)
+    x, y = rng.uniform(xmin, xmax, n_fields), rng.uniform(ymin, ymax, n_fields)
+    fields = shapely.box(x, y, x + rng.uniform(300, 800, n_fields), y + rng.uniform(300, 800, n_fields))
+    return frame(np.concatenate([roads, wells, fields]))
+
+
+def make_wetlands(rng, extent, densities):
+    xmin, ymin, xmax, ymax = extent
+    n = rng.poisson(densities["wetlands"] * (xmax - xmin) * (ymax - ymin) / 1e6)
+    return frame(make_blobs(rng, rng.uniform(xmin, xmax, n), rng.uniform(ymin, ymax, n), rng.lognormal(4.5, 0.6, n), 24))
+
+
+# Random walks of 20 to 80 steps of 500 m, buffered by 30 to 100 m
+def make_lotic(rng, extent, densities):
+    import shapely
+    xmin, ymin, xmax, ymax = extent
+    n = max(rng.poisson(densities["streams"] * (xmax - xmin) * (ymax - ymin) / 1e9), 1)
+    streams = []
+    for _ in range(n):
+        steps = rng.integers(20, 80)
+        heading = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.3, steps))
+        x = rng.uniform(xmin, xmax) + np.cumsum(500 * np.cos(heading))
+        y = rng.uniform(ymin, ymax) + np.cumsum(500 * np.sin(heading))
+        streams.append(shapely.buffer(shapely.linestrings(np.column_stack([x, y])), rng.uniform(30, 100)))
+    return frame(streams)
+
+
+def make_parks(rng, extent, densities):
+    xmin, ymin, xmax, ymax = extent
+    n = max(rng.poisson(densities["parks"] * (xmax - xmin) * (ymax - ymin) / 1e9), 1)
+    return frame(make_blobs(rng, rng.uniform(xmin, xmax, n), rng.uniform(ymin, ymax, n), rng.uniform(500, 10000, n), 400))
+
+
+# Write the inputs of a tier to folder/<tier> (unless they are already there with the same settings).
+# Returns {input name: path} for INPUT_FILES.
+def write_fixtures(tier, folder=DEFAULT_FOLDER, densities=None, seed=0):
+    import pyogrio
+    import shapely
+    settings = {"parcels": tier_parcels(tier), "densities": dict(DEFAULT_DENSITIES, **(densities or {})), "seed": seed}
+    tier_folder = os.path.join(folder, str(tier))
+    paths = dict((name, os.path.join(tier_folder, name + ".gpkg")) for name in INPUT_FILES)
+    settings_path = os.path.join(tier_folder, "settings.json")
+    if os.path.exists(settings_path) and all(os.path.exists(path) for path in paths.values()):
+        with open(settings_path) as settings_file:
+            if json.load(settings_file) == settings:
+                return paths
+    if not os.path.isdir(tier_folder):
+        os.makedirs(tier_folder)
+
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(settings["parcels"] / 4.0)))
+    grid = (ORIGIN[0], ORIGIN[1], ORIGIN[0] + side * SECTION, ORIGIN[1] + side * SECTION)
+    surroundings = (grid[0] - PATCH_SEARCH_DISTANCE, grid[1] - PATCH_SEARCH_DISTANCE, grid[2] + PATCH_SEARCH_DISTANCE, grid[3] + PATCH_SEARCH_DISTANCE)
+    densities = settings["densities"]
+    layers = {
+        "quarter_sections": make_quarter_sections(side),
+        "area_of_interest": frame([shapely.box(*grid)]),
+        "footprint": make_footprint(rng, surroundings, densities),
+        "wetlands": make_wetlands(rng, grid, densities),
+        "lotic": make_lotic(rng, grid, densities),
+        "parks": make_parks(rng, surroundings, densities),
+    }
+    for name in INPUT_FILES:
+        if os.path.exists(paths[name]):
+            os.remove(paths[name])
+        pyogrio.write_dataframe(layers[name], paths[name])
+    with open(settings_path, "w") as settings_file:
+        json.dump(settings, settings_file, indent=1, sort_keys=True)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic input datasets for benchmarking")
+    parser.add_argument("tier", help="scale tier (%s) or a number of parcels" % ", ".join(sorted(TIERS, key=TIERS.get)))
+    parser.add_argument("--folder", default=DEFAULT_FOLDER)
+    parser.add_argument("--seed", type=int, default=0)
+    for name, value in sorted(DEFAULT_DENSITIES.items()):
+        parser.add_argument("--" + name.replace("_", "-"), type=type(value), default=value)
+    args = parser.parse_args()
+    densities = dict((name, getattr(args, name)) for name in DEFAULT_DENSITIES)
+    for name, path in sorted(write_fixtures(args.tier, args.folder, densities, args.seed).items()):
+        print("%-18s %s" % (name, path))
@@ -0,0 +1,137 @@
+#-------------------------------------------------------------------------------
+# Benchmark suite: every stage of main() on synthetic fixtures, against stored baselines
+#-------------------------------------------------------------------------------
+
+# Runs Conservation_Priority_Ranking.main() end to end on the synthetic inputs of fixtures.py for each scale tier, with instrumentation
+# on (see instrumentation.py), and reports the time of every stage: each geoprocessing tool, each factor, scoring and the write back.
+# Stages are matched by name with baselines.json, and a stage is flagged as a regression when it is more than --tolerance times slower
+# than its baseline, and by at least --min-seconds. The script exits with status 1 when anything regressed, so it can gate a build.
+#
+# Baselines depend on the machine, so they record the machine they were measured on and a warning is printed when it is not this one.
+# After a change that is meant to alter the timings, measure new ones with --update-baselines.
+#
+# usage: python benchmarks/run.py [--tiers 1k 10k] [--repeat 3] [--update-baselines] [--engine raster] [--results results.json]
+#        the 100k and 1m tiers take minutes to hours, and several GB of disk for their fixtures.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from fixtures import DEFAULT_FOLDER, INPUT_FILES, TIERS, write_fixtures
+
+DEFAULT_BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+END_TO_END = "end to end"
+
+
+def machine():
+    return "%s %s, %s, python %s" % (platform.system(), platform.machine(), platform.processor() or "unknown processor", platform.python_version())
+
+
+# Run main() once on the fixtures of a tier and return {stage: seconds}, stages that run more than once are added up
+def run_once(paths, workspace, options, verbose=False):
+    from backends import get_backend
+    from Conservation_Priority_Ranking import main
+    from instrumentation import Instrumentation
+
+    if os.path.exists(workspace):
+        os.remove(workspace)
+    instrumentation = Instrumentation()
+    output = sys.stdout if verbose else io.StringIO()
+    started = time.time()
+    with contextlib.redirect_stdout(output):
+        main(workspace, *[paths[name] for name in INPUT_FILES], backend=get_backend("open", workspace), instrumentation=instrumentation, **options)
+    seconds = {END_TO_END: time.time() - started}
+    for record in instrumentation.records:
+        seconds[record["stage"]] = seconds.get(record["stage"], 0) + record["wall_s"]
+    return seconds
+
+
+# The fastest of repeat runs for each stage
+def run_tier(tier, repeat, options, folder=DEFAULT_FOLDER, verbose=False):
+    paths = write_fixtures(tier, folder)
+    workspace = os.path.join(folder, str(tier), "workspace.gpkg")
+    best = {}
+    for _ in range(repeat):
+        for stage, seconds in run_once(paths, workspace, options, verbose).items():
+            best[stage] = min(best.get(stage, seconds), seconds)
+    return best
+
+
+# Rows of (stage, baseline, seconds, ratio, flag) for the stages of one tier, with the slowest first
+def compare(stages, baseline, tolerance, min_seconds):
+    rows = []
+    for stage in sorted(stages, key=lambda name: -stages[name]):
+        before = baseline.get(stage)
+        ratio = stages[stage] / before if before else None
+        flag = ""
+        if before is None:
+            flag = "new"
+        elif ratio > tolerance and stages[stage] - before >= min_seconds:
+            flag = "REGRESSION"
+        elif ratio < 1.0 / tolerance and before - stages[stage] >= min_seconds:
+            flag = "faster"
+        rows.append((stage, before, stages[stage], ratio, flag))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the ranking on synthetic fixtures")
+    parser.add_argument("--tiers", nargs="+", default=["1k", "10k"], help="scale tiers (%s) or numbers of parcels" % ", ".join(sorted(TIERS, key=TIERS.get)))
+    parser.add_argument("--repeat", type=int, default=1, help="runs of each tier, the fastest time of each stage is kept")
+    parser.add_argument("--baselines", default=DEFAULT_BASELINES)
+    parser.add_argument("--update-baselines", action="store_true", help="store the timings of this run as the new baselines of its tiers")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="slowdown (as a ratio) flagged as a regression (default: 1.25)")
+    parser.add_argument("--min-seconds", type=float, default=0.5, help="smallest slowdown in seconds flagged as a regression (default: 0.5)")
+    parser.add_argument("--folder", default=DEFAULT_FOLDER, help="folder for the fixtures and workspaces")
+    parser.add_argument("--results", help="also write the timings to this JSON file")
+    parser.add_argument("--engine", choices=["vector", "raster"], default="vector")
+    parser.add_argument("--tile-parcels", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true", help="show the output of main()")
+    args = parser.parse_args()
+
+    options = {"engine": args.engine, "tile_parcels": args.tile_parcels}
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as baselines_file:
+            baselines = json.load(baselines_file)
+
+    # baselines are kept per tier and settings, so eg. raster runs are only compared with raster runs
+    settings = "engine=%s tile_parcels=%s" % (args.engine, args.tile_parcels)
+    results = {}
+    regressions = 0
+    for tier in args.tiers:
+        key = "%s %s" % (tier, settings)
+        print("tier %s (%s)..." % (tier, settings))
+        stages = run_tier(tier, args.repeat, options, args.folder, args.verbose)
+        results[key] = {"machine": machine(), "stages": stages}
+        baseline = baselines.get(key, {})
+        if baseline and baseline.get("machine") != machine():
+            print("  warning: the baseline was measured on %s" % baseline.get("machine"))
+
+        print("  %-56s %10s %10s %8s" % ("stage", "baseline", "seconds", "ratio"))
+        for stage, before, seconds, ratio, flag in compare(stages, baseline.get("stages", {}), args.tolerance, args.min_seconds):
+            print("  %-56s %10s %10.2f %8s  %s" % (stage[:56], "%.2f" % before if before is not None else "", seconds, "%.2f" % ratio if ratio else "", flag))
+            regressions += flag == "REGRESSION"
+
+    if args.results:
+        with open(args.results, "w") as results_file:
+            json.dump(results, results_file, indent=1, sort_keys=True)
+    if args.update_baselines:
+        baselines.update(results)
+        with open(args.baselines, "w") as baselines_file:
+            json.dump(baselines, baselines_file, indent=1, sort_keys=True)
+        print("baselines written to " + args.baselines)
+    elif regressions:
+        print("%d stages regressed" % regressions)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#-------------------------------------------------------------------------------
+# Content-addressed cache of the geoprocessing results, shared between runs
+#-------------------------------------------------------------------------------
+
+# Analysts rerun the same areas of interest many times with different scoring. Every run used to re-project the quarter
+# sections and re-clip the provincial footprint, wetland and riparian layers, even though none of them had changed.
+# The cache keeps the selected parcels and, for each factor (see FACTOR_NODES in pipeline.py), its intermediate datasets
+# and metric columns. A rerun with unchanged inputs copies ParcelsFinal from the cache and goes straight to scoring.
+
+# Every entry is keyed by a hash of everything its result depends on:
+#   - the identity of each input dataset it reads (full path, modification time and size of the file, or of the whole
+#     geodatabase/folder it is in),
+#   - the geometry of the area of interest (or of the parcels being processed),
+#   - the step parameters (the parcel where clause, the patch search distance, the factor settings, the backend) and CACHE_VERSION.
+# Any change to those gives a new key, so stale entries are never read, they just age out of the cache.
+
+# Each entry is a folder holding a workspace with the step's datasets and a metrics.npz with its columns. index.json keeps the
+# size and last use of every entry, and the least recently used entries are deleted when the cache grows past max_bytes.
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from backends import PARCEL_WHERE_CLAUSE, PROJECTED_CRS_EPSG
+from pipeline import FACTOR_INPUTS, FACTOR_NODES, PATCH_SEARCH_DISTANCE
+
+# Change this whenever the geoprocessing changes, so results cached by older versions are not used
+CACHE_VERSION = 2
+
+DEFAULT_CACHE_BYTES = 5 * 1024 ** 3
+
+
+# Total size in bytes of a file or folder
+def disk_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for folder, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(folder, name)) for name in files)
+    return total
+
+
+# (path, modification time, size) of the file or folder holding a dataset. A layer in a geodatabase or GeoPackage is identified by
+# its container, so editing any layer of a geodatabase changes the identity of all of them. Shapefiles include their sidecar files.
+def dataset_identity(path):
+    from open_backend import split_dataset_path
+    path = os.path.abspath(split_dataset_path(path)[0])
+    if os.path.isdir(path):
+        paths = [os.path.join(folder, name) for folder, _, files in os.walk(path) for name in files]
+    else:
+        stem = os.path.splitext(path)[0]
+        folder = os.path.dirname(path)
+        paths = [os.path.join(folder, name) for name in os.listdir(folder) if os.path.splitext(os.path.join(folder, name))[0] == stem] if os.path.isdir(folder) else []
+    if not paths:
+        return [path, None, None]
+    return [path, max(os.path.getmtime(p) for p in paths), sum(os.path.getsize(p) for p in paths)]
+
+
+class IntermediateCache(object):
+
+    def __init__(self, folder, max_bytes=DEFAULT_CACHE_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(folder, "index.json")
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as index_file:
+                self.index = json.load(index_file)
+
+    def _save_index(self):
+        with open(self.index_path, "w") as index_file:
+            json.dump(self.index, index_file, indent=1, sort_keys=True)
+
+    # The hash of a list of key parts (anything json can write)
+    @staticmethod
+    def key(parts):
+        return hashlib.sha1(json.dumps([CACHE_VERSION] + list(parts), sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.folder, key)
+
+    def _workspace(self, backend, key):
+        extension = ".gpkg" if backend.name == "open" else ".gdb"
+        return os.path.join(self._entry(key), "intermediates" + extension)
+
+    # Whether key is in the cache, marking it as used
+    def _hit(self, key):
+        if key not in self.index or not os.path.isdir(self._entry(key)):
+            return False
+        self.index[key]["used"] = time.time()
+        self._save_index()
+        return True
+
+    # Record a new entry and delete the least recently used entries until the cache fits in max_bytes again (the new entry is always kept)
+    def _add(self, key):
+        self.index[key] = {"bytes": disk_size(self._entry(key)), "used": time.time()}
+        total = sum(entry["bytes"] for entry in self.index.values())
+        for old_key in sorted(self.index, key=lambda k: self.index[k]["used"]):
+            if total <= self.max_bytes:
+                break
+            if old_key == key:
+                continue
+            total -= self.index.pop(old_key)["bytes"]
+            shutil.rmtree(self._entry(old_key), ignore_errors=True)
+        self._save_index()
+
+    # Start a new entry, replacing anything left in its folder by an interrupted run
+    def _new_entry(self, backend, key):
+        shutil.rmtree(self._entry(key), ignore_errors=True)
+        os.makedirs(self._entry(key))
+        return backend.create_workspace(self._entry(key), "intermediates")
+
+    # backend.select_parcels, copying the selected parcels from the cache when the quarter sections and the area of interest have not changed
+    def select_parcels(self, backend, quarter_sections, area_of_interest, out):
+        key = self.key(["select_parcels", backend.name, dataset_identity(backend.full_path(quarter_sections)), backend.fingerprint(area_of_interest),
+                        PARCEL_WHERE_CLAUSE, PROJECTED_CRS_EPSG])
+        name = os.path.basename(out)
+        if self._hit(key):
+            print("selected parcels read from the cache")
+            backend.copy(backend.dataset_path(self._workspace(backend, key), name), out)
+            return
+        backend.select_parcels(quarter_sections, area_of_interest, out)
+        workspace = self._new_entry(backend, key)
+        backend.copy(out, backend.dataset_path(workspace, name))
+        self._add(key)
+
+    # The key of every factor node for one set of parcels (see pipeline.compute_metrics)
+    # parameters are the settings of every node, from pipeline.factor_parameters
+    def factor_keys(self, backend, parcels, inputs, suffix="", patch_extent=None, parameters=None):
+        parcels_fingerprint = backend.fingerprint(parcels)
+        keys = {}
+        for node in FACTOR_NODES:
+            parts = [node, backend.name, suffix, parcels_fingerprint, sorted((parameters or {}).get(node, {}).items())]
+            parts += [dataset_identity(backend.full_path(getattr(inputs, field))) for field in FACTOR_INPUTS[node]]
+            if node == "largest_patch":
+                # patches are searched for around the area of interest, or around the parcels themselves when patch_extent is given
+                parts += [PATCH_SEARCH_DISTANCE, "parcels" if patch_extent else backend.fingerprint(inputs.areaOfInterest)]
+                # an index rebuilt in the same place has new patches
+                patch_index = (parameters or {}).get(node, {}).get("patch_index")
+                if patch_index:
+                    parts.append(dataset_identity(patch_index))
+            keys[node] = self.key(parts)
+        return keys
+
+    # The metric columns and the workspace holding the datasets of a cached factor, or None when it is not cached.
+    # The columns must have been stored for the same parcels, in the same order.
+    def load(self, key, parcel_IDs):
+        if not self._hit(key):
+            return None
+        with np.load(os.path.join(self._entry(key), "metrics.npz")) as stored:
+            if not np.array_equal(stored["__keys__"], parcel_IDs):
+                return None
+            columns = dict((field, stored[field]) for field in stored.files if field != "__keys__")
+        # a factor that wrote no datasets (eg. with the raster engine) leaves no workspace file with the open backend
+        workspace = [name for name in os.listdir(self._entry(key)) if name.startswith("intermediates")] or ["intermediates"]
+        return columns, os.path.join(self._entry(key), workspace[0])
+
+    # Store the datasets and metric columns of a factor that has just been computed (datasets the factor did not write are skipped)
+    def store(self, key, backend, datasets, parcel_IDs, columns):
+        workspace = self._new_entry(backend, key)
+        for dataset in datasets:
+            if backend.exists(dataset):
+                backend.copy(dataset, backend.dataset_path(workspace, os.path.basename(dataset)))
+        arrays = dict(columns)
+        arrays["__keys__"] = np.asarray(parcel_IDs)
+        np.savez(os.path.join(self._entry(key), "metrics.npz"), **arrays)
+        self._add(key)
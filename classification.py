@@ -0,0 +1,236 @@
+#-------------------------------------------------------------------------------
+# Vectorized classification of parcel values into scores
+#-------------------------------------------------------------------------------
+
+# Every factor score in the ranking is a classification: a parcel value is placed into a class using a set of breaks,
+# and the class is mapped to a score. The classifiers here do this for a whole array in one np.searchsorted call.
+
+# Classes are upper-inclusive, which is what the original if/elif ladders did: a value equal to a break belongs to the
+# class below it, and a value above the last break falls into the last class. A classifier with breaks b has len(b) + 1
+# classes and needs one score for each of them.
+
+# Natural breaks (Fisher-Jenks) classes are also available: the breaks minimize the sum of squared deviations from the
+# class means. See jenks_breaks below.
+
+# Zero handling: with zero_policy="exclude", zeros are left out when the breaks are computed and receive zero_score
+# (this is how Lotic and Wetland deciles are scored, parcels with no riparian area or wetland edge score 0).
+# With zero_policy="include", zeros are classified like any other value.
+
+import numpy as np
+
+DECILES = np.arange(0, 100, 10)
+QUARTILES = np.arange(0, 100, 25)
+
+ZERO_POLICIES = ("exclude", "include")
+
+
+# Return the class index of every value. Values equal to a break go to the lower class.
+# NaN values sort above everything and end up in the last class.
+def classify(values, breaks):
+    return np.searchsorted(np.asarray(breaks, dtype=float), np.asarray(values, dtype=float), side="left")
+
+
+class Classifier(object):
+
+    def __init__(self, scores, zero_policy="include", zero_score=0):
+        if zero_policy not in ZERO_POLICIES:
+            raise ValueError("zero_policy must be one of %s, got %r" % (", ".join(ZERO_POLICIES), zero_policy))
+        self.scores = np.asarray(scores, dtype=float)
+        self.zero_policy = zero_policy
+        self.zero_score = zero_score
+
+    # Subclasses return the breaks (len(scores) - 1 of them) computed from the values that take part in classification
+    def breaks(self, values):
+        raise NotImplementedError
+
+    # The values that breaks are computed from, after the zero policy is applied
+    def _break_values(self, values):
+        if self.zero_policy == "exclude":
+            return values[values != 0]
+        return values
+
+    def __call__(self, values):
+        values = np.asarray(values, dtype=float)
+        breaks = self.breaks(self._break_values(values))
+        scores = self.scores[classify(values, breaks)]
+        if self.zero_policy == "exclude":
+            scores[values == 0] = self.zero_score
+        return scores
+
+    # Classify each column of a 2d array on its own (eg. the priority scores of many scenarios in a sensitivity sweep)
+    def columns(self, values):
+        values = np.asarray(values, dtype=float)
+        result = np.empty(values.shape)
+        for column in range(values.shape[1]):
+            result[:, column] = self(values[:, column])
+        return result
+
+
+# Breaks are percentiles of the data. The first percentile is the bottom of the first class and is not a break,
+# so np.arange(0, 100, 10) gives 10 classes (deciles). By default class i scores (i + 1) / number of classes.
+class Quantiles(Classifier):
+
+    def __init__(self, percentiles=DECILES, scores=None, zero_policy="exclude", zero_score=0):
+        self.percentiles = np.asarray(percentiles, dtype=float)
+        if scores is None:
+            n_classes = len(self.percentiles)
+            scores = np.arange(1, n_classes + 1) / float(n_classes)
+        if len(scores) != len(self.percentiles):
+            raise ValueError("Quantiles needs one score per percentile (%d), got %d" % (len(self.percentiles), len(scores)))
+        Classifier.__init__(self, scores, zero_policy, zero_score)
+
+    def breaks(self, values):
+        if values.size == 0:
+            return np.zeros(0)
+        return np.percentile(values, self.percentiles)[1:]
+
+    # Every column at once: one percentile call finds the breaks of all the columns (excluded zeros are masked as NaN),
+    # and each value's class is the number of its column's breaks below it
+    def columns(self, values):
+        import warnings
+        values = np.asarray(values, dtype=float)
+        if values.shape[0] == 0:
+            return values.copy()
+        with warnings.catch_warnings():
+            # columns that are all zero have no breaks, and are all given zero_score
+            warnings.simplefilter("ignore", RuntimeWarning)
+            if self.zero_policy == "exclude":
+                breaks = np.nanpercentile(np.where(values != 0, values, np.nan), self.percentiles, axis=0)[1:]
+            else:
+                breaks = np.percentile(values, self.percentiles, axis=0)[1:]
+        classes = np.zeros_like(values, dtype=np.intp)
+        for column_breaks in breaks:
+            classes += values > column_breaks
+        classes[np.isnan(values)] = len(breaks)
+        scores = self.scores[classes]
+        if self.zero_policy == "exclude":
+            scores[values == 0] = self.zero_score
+        return scores
+
+
+# Fixed breaks that do not depend on the data, eg. patch size in acres or distance in meters
+class Thresholds(Classifier):
+
+    def __init__(self, thresholds, scores, zero_policy="include", zero_score=0):
+        self.thresholds = np.asarray(thresholds, dtype=float)
+        if len(scores) != len(self.thresholds) + 1:
+            raise ValueError("Thresholds needs %d scores for %d thresholds, got %d" % (len(self.thresholds) + 1, len(self.thresholds), len(scores)))
+        Classifier.__init__(self, scores, zero_policy, zero_score)
+
+    def breaks(self, values):
+        return self.thresholds
+
+
+# Optimal natural breaks (Fisher-Jenks) for values, returned as n_classes - 1 upper-inclusive breaks.
+
+# The dynamic program runs over the sorted, deduplicated values (with their counts as weights), so repeated values cost
+# nothing and the result is the same as running it on the full data. For c classes and the first i unique values,
+#   D[c][i] = min over j of D[c - 1][j] + SSD(j, i)
+# where SSD(j, i) is the weighted sum of squared deviations of values j..i-1, found in constant time from prefix sums.
+# The best j never decreases as i increases, so each layer is solved by divide and conquer in O(m log m) instead of O(m^2):
+# the middle i of a range is solved first, and it bounds the search for the i values either side of it. All the ranges at
+# the same recursion depth are independent, so each depth is evaluated in one vectorized pass. Total cost is O(k m log m).
+def jenks_breaks(values, n_classes):
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if n_classes < 2 or values.size == 0:
+        return np.zeros(0)
+    unique, counts = np.unique(values, return_counts=True)
+    m = len(unique)
+    if m <= n_classes:
+        # every unique value is its own class, the remaining breaks repeat the largest value
+        return np.concatenate([unique[:-1], np.repeat(unique[-1], n_classes - m)])
+
+    # prefix sums of the weights, and of the weighted values and squared values (centred to limit rounding error)
+    centred = unique - np.average(unique, weights=counts)
+    W = np.concatenate([[0.0], np.cumsum(counts, dtype=float)])
+    S = np.concatenate([[0.0], np.cumsum(counts * centred)])
+    Q = np.concatenate([[0.0], np.cumsum(counts * centred * centred)])
+
+    def ssd(j, i):
+        s = S[i] - S[j]
+        return np.maximum(Q[i] - Q[j] - s * s / (W[i] - W[j]), 0.0)
+
+    # D[i]: best cost of splitting the first i unique values into the current number of classes
+    indices = np.arange(m + 1)
+    D = np.full(m + 1, np.inf)
+    D[1:] = ssd(np.zeros(m, dtype=np.intp), indices[1:])
+    split = np.zeros((n_classes + 1, m + 1), dtype=np.intp)
+
+    for c in range(2, n_classes + 1):
+        new_D = np.full(m + 1, np.inf)
+        # only the last layer needs to be solved for i = m alone
+        first_i = m if c == n_classes else c
+        lo = np.array([first_i])
+        hi = np.array([m])
+        opt_lo = np.array([c - 1])
+        opt_hi = np.array([m - 1])
+        while lo.size:
+            mid = (lo + hi) // 2
+            stop = np.minimum(mid - 1, opt_hi)
+            lengths = stop - opt_lo + 1
+            starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            segment = np.repeat(np.arange(lo.size), lengths)
+            j = opt_lo[segment] + (np.arange(lengths.sum()) - starts[segment])
+            # SSD(j, mid) + D[j], with the per-range terms repeated rather than gathered
+            s = np.repeat(S[mid], lengths) - S[j]
+            s *= s
+            s /= np.repeat(W[mid], lengths) - W[j]
+            cost = np.repeat(Q[mid], lengths) - Q[j]
+            cost -= s
+            np.maximum(cost, 0.0, out=cost)
+            cost += D[j]
+
+            best = np.minimum.reduceat(cost, starts)
+            hits = np.flatnonzero(cost == best[segment])
+            first_hit = hits[np.concatenate([[True], segment[hits[1:]] != segment[hits[:-1]]])]
+            best_j = j[first_hit]
+            new_D[mid] = best
+            split[c, mid] = best_j
+
+            left = lo <= mid - 1
+            right = mid + 1 <= hi
+            lo, hi, opt_lo, opt_hi = (np.concatenate([lo[left], mid[right] + 1]),
+                                      np.concatenate([mid[left] - 1, hi[right]]),
+                                      np.concatenate([opt_lo[left], best_j[right]]),
+                                      np.concatenate([best_j[left], opt_hi[right]]))
+        D = new_D
+
+    # walk back through the split points, class c holds unique values split[c][i] .. i-1
+    breaks = []
+    i = m
+    for c in range(n_classes, 1, -1):
+        j = split[c, i]
+        breaks.append(unique[j - 1])
+        i = j
+    return np.array(breaks[::-1])
+
+
+# Natural breaks classes. Very large inputs can be classified from a random sample of max_sample values
+# (the sample is seeded, so the same data always gives the same breaks). By default class i scores (i + 1) / n_classes.
+class NaturalBreaks(Classifier):
+
+    def __init__(self, n_classes=10, scores=None, zero_policy="exclude", zero_score=0, max_sample=None, seed=0):
+        self.n_classes = n_classes
+        self.max_sample = max_sample
+        self.seed = seed
+        if scores is None:
+            scores = np.arange(1, n_classes + 1) / float(n_classes)
+        if len(scores) != n_classes:
+            raise ValueError("NaturalBreaks needs one score per class (%d), got %d" % (n_classes, len(scores)))
+        Classifier.__init__(self, scores, zero_policy, zero_score)
+
+    def breaks(self, values):
+        if self.max_sample is not None and values.size > self.max_sample:
+            values = np.random.RandomState(self.seed).choice(values, self.max_sample, replace=False)
+        return jenks_breaks(values, self.n_classes)
+
+
+# Not a classification: the score is the value divided by a constant (eg. percent intact / 100)
+class Scaled(object):
+
+    def __init__(self, divisor):
+        self.divisor = divisor
+
+    def __call__(self, values):
+        return np.asarray(values, dtype=float) / self.divisor
@@ -0,0 +1,104 @@
+#-------------------------------------------------------------------------------
+# Extra conservation factors, added without changing the geoprocessing
+#-------------------------------------------------------------------------------
+
+# The five factors of the ranking are built in (see pipeline.py and scoring.py). Other factors (eg. mammal habitat) can be registered
+# for a run instead of being written into the script. A factor is declared by:
+#   - the input layer it is measured from,
+#   - its metric, one of METRICS: the area or percent of each parcel covered by the layer, the length of the layer's lines in each
+#     parcel, the area of the largest feature of the layer overlapping each parcel (eg. a habitat patch), or the distance from each
+#     parcel to the nearest feature of the layer (within search_radius meters, parcels with none that close get a null distance),
+#   - its classifier (see classification.py), and the weight of its score in PRIORITY_SCORE.
+# Every factor measured by the overlay is tabulated in the one overlay of the parcels with the layers of the built in factors
+# (see pipeline.compute_metrics), so adding a factor adds one layer to that pass. Distance factors each add a near table.
+# The metric of a factor is a new field of the parcels (eg. Percent_Mammal_Habitat) and its score is SCORE_<name>.
+#
+# Factors are registered with register_factor, or listed in a JSON file (--factors in the main script and in rescore.py), eg.
+#   [{"name": "Mammal_Habitat", "layer": "C:/data/habitat.gdb/Ungulate_Range", "metric": "percent", "classifier": "deciles", "weight": 1},
+#    {"name": "Old_Growth", "layer": "C:/data/forest.gdb/Old_Growth", "metric": "distance", "search_radius": 5000,
+#     "classifier": {"thresholds": [0, 1000, 5000], "scores": [1, 0.75, 0.5, 0]}}]
+# A classifier is given as a classification method (deciles, quartiles, quantiles:N, jenks, jenks:N, scored like Lotic and Wetland,
+# parcels with a zero metric score 0), as {"thresholds": [...], "scores": [...]}, or as {"scale": divisor} (the metric divided by divisor).
+#
+# Extra factors are not kept in the cache (cache.py) or in incremental snapshots (incremental.py), they are measured again on every run.
+
+import json
+import re
+from collections import OrderedDict
+
+from classification import Scaled, Thresholds
+from proximity import DEFAULT_SEARCH_RADIUS
+
+# metric -> (overlay measure, overlay field, prefix of the metric field). Distances are not measured by the overlay.
+METRICS = OrderedDict([
+    ("area", ("area", "AREA", "Area")),
+    ("percent", ("area", "PERCENTAGE", "Percent")),
+    ("length", ("length", "LENGTH", "Length")),
+    ("max_area", ("max_area", "MAX_AREA", "Largest")),
+    ("distance", (None, "NEAR_DIST", "Dist_to")),
+])
+
+# Registered factors, name -> Factor, in the order they were registered
+FACTOR_REGISTRY = OrderedDict()
+
+
+# A classifier from its description in a factor file (see above)
+def make_classifier(description):
+    from scoring import method_classifier
+    if isinstance(description, dict):
+        if "thresholds" in description:
+            return Thresholds(description["thresholds"], description["scores"])
+        if "scale" in description:
+            return Scaled(float(description["scale"]))
+        raise ValueError("a classifier needs thresholds and scores, or a scale, got %r" % description)
+    return method_classifier(description)
+
+
+class Factor(object):
+
+    def __init__(self, name, layer, metric, classifier="deciles", weight=1.0, search_radius=DEFAULT_SEARCH_RADIUS):
+        if not re.match(r"^[A-Za-z][A-Za-z0-9_]*$", name):
+            raise ValueError("a factor name can only have letters, digits and underscores, got %r" % name)
+        if metric not in METRICS:
+            raise ValueError("unknown metric %r for %s, expected one of %s" % (metric, name, ", ".join(METRICS)))
+        self.name = name
+        self.layer = layer
+        self.metric = metric
+        self.classifier = classifier if callable(classifier) else make_classifier(classifier)
+        self.weight = float(weight)
+        self.search_radius = search_radius
+        self.measure, self.overlay_field, prefix = METRICS[metric]
+        self.metric_field = "%s_%s" % (prefix, name)
+        self.score_field = "SCORE_" + name
+        # the table the factor is tabulated into (before the suffix is added)
+        self.table = ("%s_Per_Parcel" if self.measure else "Near_%s_Table") % name
+
+
+def register_factor(factor):
+    from scoring import FACTORS
+    if factor.name in FACTORS or factor.name == "Ranking" or factor.name in FACTOR_REGISTRY:
+        raise ValueError("there is already a factor named %s" % factor.name)
+    FACTOR_REGISTRY[factor.name] = factor
+    return factor
+
+
+def unregister_factor(name):
+    del FACTOR_REGISTRY[name]
+
+
+def registered_factors():
+    return list(FACTOR_REGISTRY.values())
+
+
+# Register the factors listed in a JSON file, and return them
+def load_factors(path):
+    with open(path) as factors_file:
+        descriptions = json.load(factors_file)
+    factors = []
+    for description in descriptions:
+        description = dict(description)
+        unknown = [key for key in description if key not in ("name", "layer", "metric", "classifier", "weight", "search_radius")]
+        if unknown:
+            raise ValueError("unknown settings %s of factor %s" % (", ".join(unknown), description.get("name")))
+        factors.append(register_factor(Factor(**description)))
+    return factors
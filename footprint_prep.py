@@ -0,0 +1,161 @@
+#-------------------------------------------------------------------------------
+# Closing the gaps of the human footprint, in chunks, once per footprint release
+#-------------------------------------------------------------------------------
+
+# The human footprint has tiny gaps between polygons that should touch (eg. a road and the well site beside it), which connect intact
+# patches that are really separate, so some patches come out much larger than they are. Buffering the whole footprint closed them but
+# crashed the run (see the notes in the main script), so the vector version of the script left them open.
+#
+# prepare_footprint closes the gaps narrower than gap meters, without ever holding more than a small part of the footprint in memory.
+# The footprint's extent is cut into square chunks of chunk_size meters, and for each chunk:
+#   1. the features within gap * 2 of the chunk are read (a bounding box read, see OpenBackend.read_window), repaired (make_valid) and
+#      snapped to a precision grid of grid_size meters, so near-coincident vertices become coincident,
+#   2. they are closed: unioned with a buffer of gap / 2 and shrunk back by gap / 2, which fills every gap (and notch) narrower than gap
+#      and leaves the rest of the outline where it was. Both buffers have mitred corners, so corners stay sharp instead of being rounded
+#      into arcs (which made the footprint about four times as many vertices, and every later Erase and Clip slower),
+#   3. the result is cut to the chunk and appended to the output.
+# The outcome at any point only depends on the footprint within gap of it, so the margin read around each chunk makes the closed footprint
+# of a chunk the same as if the whole footprint had been closed at once. Chunk edges are on the precision grid, so the pieces on both sides
+# of a seam meet exactly along it: a feature crossing a seam is split there but has no sliver or gap, and Erase, Clip and Tabulate
+# Intersection treat the pieces as one. Peak memory depends on chunk_size and on the density of the footprint, not on its size.
+#
+# The prepared footprint is kept in a folder (PreparedFootprints), keyed by the identity of the footprint (see cache.dataset_identity) and
+# the settings, so only the first run after a new footprint release prepares it. Use --footprint-gap METERS in the main script, or run it
+# on its own:
+#   python footprint_prep.py HFI2021.gdb/o01_Human_Footprint prepared_footprint --gap 2
+# Preparing needs the open backend libraries (Shapely, GeoPandas and pyogrio), the prepared footprint can then be used with either backend.
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from backends import PROJECTED_CRS_EPSG
+
+# Change this whenever the preparation changes, so footprints prepared before are not used
+PREPARATION_VERSION = 1
+
+PREPARED_LAYER = "Prepared_Footprint"
+SOURCE_FILE = "source.json"
+
+DEFAULT_GAP = 2.0
+DEFAULT_GRID_SIZE = 0.01
+DEFAULT_CHUNK_SIZE = 10000
+
+
+# (xmin, ymin, xmax, ymax) of a dataset in the analysis coordinate system, from its metadata (nothing is read but the header)
+def source_bounds(dataset):
+    import pyogrio
+    import pyproj
+    from open_backend import split_dataset_path
+    from parquet_io import GEOMETRY_COLUMN, is_columnar_file, read_metadata
+    path, layer = split_dataset_path(dataset)
+    if is_columnar_file(path):
+        geo = json.loads(read_metadata(path)[b"geo"].decode("utf-8"))["columns"][GEOMETRY_COLUMN]
+        bounds, crs = geo["bbox"], pyproj.CRS.from_json_dict(geo["crs"]) if geo.get("crs") else None
+    else:
+        info = pyogrio.read_info(path, layer=layer, force_total_bounds=True)
+        bounds, crs = info["total_bounds"], pyproj.CRS.from_user_input(info["crs"]) if info["crs"] else None
+    if crs is not None and crs.to_epsg() != PROJECTED_CRS_EPSG:
+        bounds = pyproj.Transformer.from_crs(crs, PROJECTED_CRS_EPSG, always_xy=True).transform_bounds(*bounds, densify_pts=21)
+    return tuple(float(value) for value in bounds)
+
+
+# (xmin, ymin, xmax, ymax) of the chunks of chunk_size meters covering bounds, on a grid starting at a multiple of chunk_size
+def chunk_grid(bounds, chunk_size):
+    xmin, ymin, xmax, ymax = bounds
+    columns = np.arange(np.floor(xmin / chunk_size), np.floor(xmax / chunk_size) + 1) * chunk_size
+    rows = np.arange(np.floor(ymin / chunk_size), np.floor(ymax / chunk_size) + 1) * chunk_size
+    return [(x, y, x + chunk_size, y + chunk_size) for y in rows for x in columns]
+
+
+# The footprint of one chunk with its gaps closed, as single polygons. geometries are the features read around it.
+def close_chunk(geometries, chunk, gap, grid_size):
+    import shapely
+    if not len(geometries):
+        return np.zeros(0, dtype=object)
+    margin = shapely.box(chunk[0] - 2 * gap, chunk[1] - 2 * gap, chunk[2] + 2 * gap, chunk[3] + 2 * gap)
+    snapped = shapely.set_precision(shapely.make_valid(shapely.intersection(geometries, margin)), grid_size)
+    parts = shapely.get_parts(snapped)
+    parts = parts[shapely.get_type_id(parts) == 3]
+    if not len(parts):
+        return np.zeros(0, dtype=object)
+    closed = shapely.buffer(shapely.union_all(shapely.buffer(parts, gap / 2.0, join_style="mitre")), -gap / 2.0, join_style="mitre")
+    cut = shapely.set_precision(shapely.intersection(closed, shapely.box(*chunk)), grid_size)
+    pieces = shapely.get_parts(cut)
+    return pieces[(shapely.get_type_id(pieces) == 3) & (shapely.area(pieces) > 0)]
+
+
+# Close the gaps of the footprint chunk by chunk and write it to out (a GeoPackage). Returns the number of polygons written.
+def prepare_footprint(footprint, out, gap=DEFAULT_GAP, grid_size=DEFAULT_GRID_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+    import geopandas
+    import pyogrio
+    from open_backend import OpenBackend
+
+    if abs(round(chunk_size / grid_size) * grid_size - chunk_size) > 1e-9 * chunk_size:
+        raise ValueError("chunk_size must be a multiple of grid_size, so the chunk edges are on the precision grid")
+    reader = OpenBackend(out, write_intermediates=False)
+    if os.path.exists(out):
+        os.remove(out)
+    written = 0
+    for chunk in chunk_grid(source_bounds(footprint), chunk_size):
+        window = (chunk[0] - 2 * gap, chunk[1] - 2 * gap, chunk[2] + 2 * gap, chunk[3] + 2 * gap)
+        pieces = close_chunk(np.array(reader.read_window(footprint, window, []).geometry.values, dtype=object), chunk, gap, grid_size)
+        if not len(pieces):
+            continue
+        frame = geopandas.GeoDataFrame(geometry=pieces, crs="EPSG:%d" % PROJECTED_CRS_EPSG)
+        pyogrio.write_dataframe(frame, out, layer=PREPARED_LAYER, append=written > 0, promote_to_multi=True)
+        written += len(pieces)
+    return written
+
+
+class PreparedFootprints(object):
+
+    def __init__(self, folder, gap=DEFAULT_GAP, grid_size=DEFAULT_GRID_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.folder = folder
+        self.gap = gap
+        self.grid_size = grid_size
+        self.chunk_size = chunk_size
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    # The prepared footprint for this version of footprint, prepared when there is none yet
+    def prepared(self, backend, footprint):
+        source = backend.full_path(footprint)
+        from cache import dataset_identity
+        identity = dataset_identity(source)
+        settings = {"gap": self.gap, "grid_size": self.grid_size, "chunk_size": self.chunk_size}
+        key = hashlib.sha1(json.dumps([PREPARATION_VERSION, identity, settings], sort_keys=True).encode("utf-8")).hexdigest()
+        entry = os.path.join(self.folder, key)
+        out = os.path.join(entry, "footprint.gpkg")
+        if not os.path.exists(os.path.join(entry, SOURCE_FILE)):
+            shutil.rmtree(entry, ignore_errors=True)
+            os.makedirs(entry)
+            with backend.stage("prepare footprint " + os.path.basename(source)):
+                count = prepare_footprint(source, out, self.gap, self.grid_size, self.chunk_size)
+            # written last, so a footprint that was not fully prepared is never used
+            with open(os.path.join(entry, SOURCE_FILE), "w") as source_file:
+                json.dump({"source": source, "identity": identity, "settings": settings, "polygons": count}, source_file, indent=1, sort_keys=True)
+        return backend.dataset_path(out, PREPARED_LAYER)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from backends import get_backend
+
+    parser = argparse.ArgumentParser(description="Close the gaps of the human footprint in chunks, and keep the result for the ranking runs")
+    parser.add_argument("footprint", help="human footprint, eg. HFI2021.gdb/o01_Human_Footprint")
+    parser.add_argument("folder", help="folder the prepared footprints are kept in (--prepared-footprints in the main script)")
+    parser.add_argument("--gap", type=float, default=DEFAULT_GAP, help="close gaps narrower than this many meters (default: %g)" % DEFAULT_GAP)
+    parser.add_argument("--grid-size", type=float, default=DEFAULT_GRID_SIZE, help="precision grid in meters (default: %g)" % DEFAULT_GRID_SIZE)
+    parser.add_argument("--chunk-size", type=float, default=DEFAULT_CHUNK_SIZE, help="side of the chunks in meters (default: %d)" % DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    started = time.time()
+    backend = get_backend("open", os.path.join(args.folder, "scratch.gpkg"))
+    path = PreparedFootprints(args.folder, args.gap, args.grid_size, args.chunk_size).prepared(backend, args.footprint)
+    print("prepared footprint %s ready in %.1f s" % (path, time.time() - started))
@@ -0,0 +1,59 @@
+#-------------------------------------------------------------------------------
+# Grouped reductions over key/value columns
+#-------------------------------------------------------------------------------
+
+# Tables produced by Tabulate Intersection contain one row per intersection, so a parcel OBJECTID can appear many
+# times (once for every patch it touches). The functions here collapse those rows to one value per key with a single
+# stable sort and a ufunc.reduceat, so the cost grows with the size of the table (n log n for the sort, linear for
+# everything else) instead of with parcels x rows.
+
+import numpy as np
+
+
+# Sort the keys once and return the sorted keys, the order used to sort them and the index where each run of
+# equal keys starts. Everything else in this module is built on top of this.
+def group_keys(keys):
+    keys = np.asarray(keys)
+    order = np.argsort(keys, kind="mergesort")
+    sorted_keys = keys[order]
+    if sorted_keys.size == 0:
+        return sorted_keys, order, np.zeros(0, dtype=np.intp)
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    return sorted_keys, order, starts
+
+
+# Reduce values per key with any numpy ufunc that supports reduceat (np.maximum, np.add, np.minimum ...).
+# Returns the unique keys (sorted) and one reduced value for each of them.
+def grouped_reduce(keys, values, ufunc):
+    values = np.asarray(values)
+    sorted_keys, order, starts = group_keys(keys)
+    if starts.size == 0:
+        return sorted_keys, values[:0]
+    return sorted_keys[starts], ufunc.reduceat(values[order], starts)
+
+
+# Line up reduced values with another list of keys (eg. every OBJECTID in ParcelsFinal). Keys that had no rows
+# in the grouped table receive the fill value, so parcels without any intersection get a zero rather than being skipped.
+def align_to_keys(unique_keys, reduced, target_keys, fill=0):
+    target_keys = np.asarray(target_keys)
+    result_type = np.result_type(np.asarray(reduced).dtype, np.min_scalar_type(fill))
+    out = np.full(target_keys.shape, fill, dtype=result_type)
+    if len(unique_keys) == 0:
+        return out
+    pos = np.searchsorted(unique_keys, target_keys)
+    pos_clipped = np.minimum(pos, len(unique_keys) - 1)
+    found = unique_keys[pos_clipped] == target_keys
+    out[found] = np.asarray(reduced)[pos_clipped[found]]
+    return out
+
+
+# Largest value per key, returned in the order of target_keys
+def grouped_max(keys, values, target_keys, fill=0):
+    unique_keys, reduced = grouped_reduce(keys, values, np.maximum)
+    return align_to_keys(unique_keys, reduced, target_keys, fill)
+
+
+# Sum of values per key, returned in the order of target_keys
+def grouped_sum(keys, values, target_keys, fill=0):
+    unique_keys, reduced = grouped_reduce(keys, values, np.add)
+    return align_to_keys(unique_keys, reduced, target_keys, fill)
@@ -0,0 +1,82 @@
+#-------------------------------------------------------------------------------
+# Parcel x feature incidence matrices, the result of overlaying a layer with the parcels
+#-------------------------------------------------------------------------------
+
+# Overlaying a layer with the parcels (see overlay.py) gives one measure for every parcel and feature that overlap: the area (or length)
+# of the feature within the parcel, or for the max_area measures the size of the feature. Incidence keeps them as a scipy.sparse CSR
+# matrix, with one row per parcel (in the order of the parcels dataset, keyed by zone_keys) and one column per feature of the layer
+# (the features read around the parcels, in the order of the layer). Parcels and features that do not overlap have no entry.
+#
+# Every per-parcel value of a measure is then one sparse reduction over the rows: the sum (AREA, LENGTH), the largest value (MAX_AREA),
+# the number of features and the percentage of the parcel's area, without a loop over parcels or a table to group. Overlapping features
+# of a parcel are counted once: where they overlap, the later feature only gets the part of the parcel the earlier ones did not cover,
+# so the sum of a row is the area of the union, as Tabulate Intersection gives it.
+#
+# A matrix can be saved and loaded again (.npz, readable by scipy.sparse.load_npz as well), so new metrics can be computed from it without
+# overlaying again, eg. the number of footprint features in each parcel, or the sum of a feature attribute weighted by the area covered
+# (incidence.matrix.dot(values)). Use --incidence FOLDER in the main script to save the matrix of every layer overlaid in a run.
+
+import numpy as np
+
+
+class Incidence(object):
+
+    # matrix is a scipy.sparse matrix of zones x features, zone_keys the key of each zone (eg. OBJECTID), zone_areas the area of each zone
+    def __init__(self, matrix, zone_keys, measure, zone_areas=None):
+        from scipy.sparse import csr_matrix
+        self.matrix = csr_matrix(matrix)
+        self.matrix.eliminate_zeros()
+        self.zone_keys = np.asarray(zone_keys)
+        self.measure = measure
+        self.zone_areas = None if zone_areas is None else np.asarray(zone_areas, dtype=float)
+
+    # An incidence matrix from the measures of the pairs of zone and feature positions that overlap
+    @classmethod
+    def from_pairs(cls, zone_index, feature_index, values, zone_keys, feature_count, measure, zone_areas=None):
+        from scipy.sparse import coo_matrix
+        matrix = coo_matrix((np.asarray(values, dtype=float), (zone_index, feature_index)), shape=(len(zone_keys), feature_count))
+        return cls(matrix.tocsr(), zone_keys, measure, zone_areas)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def sum(self):
+        return np.asarray(self.matrix.sum(axis=1)).ravel()
+
+    def max(self):
+        return self.matrix.max(axis=1).toarray().ravel()
+
+    # The number of features overlapping each zone
+    def count(self):
+        return np.diff(self.matrix.indptr)
+
+    def percentage(self):
+        if self.zone_areas is None:
+            raise ValueError("the areas of the zones are needed for a percentage")
+        return self.sum() / self.zone_areas * 100
+
+    # The positions of the zones the layer reaches, and {result field: values} of the measure for each of them (see overlay.MEASURES)
+    def tabulate(self):
+        reached = np.flatnonzero(self.count())
+        if self.measure in ("max_area", "max_patch_area"):
+            return reached, {"MAX_AREA": self.max()[reached]}
+        if self.measure == "length":
+            return reached, {"LENGTH": self.sum()[reached]}
+        return reached, {"AREA": self.sum()[reached], "PERCENTAGE": self.percentage()[reached]}
+
+    # The same layout as scipy.sparse.save_npz, with the keys, areas and measure of the zones added
+    def save(self, path):
+        arrays = {"format": b"csr", "shape": self.matrix.shape, "data": self.matrix.data, "indices": self.matrix.indices, "indptr": self.matrix.indptr,
+                  "zone_keys": self.zone_keys, "measure": np.array(self.measure)}
+        if self.zone_areas is not None:
+            arrays["zone_areas"] = self.zone_areas
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        from scipy.sparse import csr_matrix
+        with np.load(path) as loaded:
+            matrix = csr_matrix((loaded["data"], loaded["indices"], loaded["indptr"]), shape=tuple(loaded["shape"]))
+            zone_areas = loaded["zone_areas"] if "zone_areas" in loaded.files else None
+            return cls(matrix, loaded["zone_keys"], str(loaded["measure"]), zone_areas)
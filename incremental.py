@@ -0,0 +1,190 @@
+#-------------------------------------------------------------------------------
+# Incremental re-ranking when some of the input layers change
+#-------------------------------------------------------------------------------
+
+# The provincial layers are refreshed one at a time (eg. a new human footprint release) and most of a refresh leaves most of the
+# province untouched. Every metric column depends on a known set of input layers (FACTOR_INPUTS and FACTOR_FIELDS in pipeline.py),
+# eg. a new human footprint only changes Area_Intact, Percent_Intact and Largest_Patch_Area. So after a run, a snapshot is kept:
+#   - the metric columns of the parcels,
+#   - the identity of each input layer (see cache.dataset_identity), and the area of interest, parcels and factor settings they were computed for,
+#   - a feature index of each input layer: a digest of the geometry of every feature, and its bounding box.
+# On the next run with the same snapshot folder, the layers whose identity changed are compared feature by feature with their index.
+# Features that are gone or new are the spatial diff of the layer, and only the factors that read a changed layer are geoprocessed again:
+#   - intactness, wetland edge and lotic area only depend on the features inside each parcel, so they are only tabulated again for the
+#     parcels whose bounding box touches the bounding box of a changed feature,
+#   - proximity does the same within the search radius of the changed parks,
+#   - the largest patch is computed again for every parcel, since one new road or a removed well site can split or join patches far from it.
+# Every other metric column is copied from the snapshot. When the parcels, the area of interest or the settings are not the ones of
+# the snapshot, every factor is computed as usual and a new snapshot is kept.
+
+# Extra factors (see factors.py) are not kept in the snapshot, they are measured again for every parcel on every run.
+
+# A changed feature is compared by its bounding box, so a few parcels near a changed feature may be tabulated again without need, but none
+# that it touches is missed. Features whose attributes changed but not their geometry do not change any metric, and are not counted.
+
+import json
+import os
+
+import numpy as np
+
+from cache import dataset_identity
+from factors import registered_factors
+from metrics_table import load_metrics, save_metrics
+from pipeline import FACTOR_FIELDS, FACTOR_INPUTS, FACTOR_NODES, METRIC_FIELDS, UPSTREAM_DATASETS, compute_metrics, extra_metrics, factor_parameters, intermediate_names
+from table_io import ColumnStore
+
+# Change this whenever the snapshot or the geoprocessing changes, so older snapshots are not used
+SNAPSHOT_VERSION = 1
+
+SNAPSHOT_FILE = "snapshot.json"
+METRICS_FILE = "metrics.npz"
+
+# The input layers metrics depend on, and the metric fields that depend on each of them
+TRACKED_INPUTS = sorted(set(field for fields in FACTOR_INPUTS.values() for field in fields))
+INPUT_FIELDS = dict((layer, [field for node in FACTOR_NODES if layer in FACTOR_INPUTS[node] for field in FACTOR_FIELDS[node]]) for layer in TRACKED_INPUTS)
+
+# Nodes whose metrics can change anywhere when a feature changes, they are computed again for every parcel
+WHOLE_AREA_NODES = ["largest_patch"]
+
+# Parcels this close (meters) to the parcels being tabulated again are geoprocessed with them, so that clipping the inputs by the
+# selected parcels cuts no edges along them (which would add to their wetland edge). A quarter section is about 805 m wide.
+CONTEXT_DISTANCE = 1000
+
+UPDATE_SUFFIX = "_Update"
+UPDATE_PARCELS = "Parcels_Update"
+
+
+# How far (meters) from a changed feature the metrics of a node can change
+def node_reach(node, parameters):
+    return parameters[node].get("search_radius", 0) if node == "proximity" else 0
+
+
+# The bounding boxes of the features that are in one feature index and not the other, as an n x 4 array
+def changed_boxes(old_index, new_index):
+    old_digests, old_bounds = old_index
+    new_digests, new_bounds = new_index
+    boxes = np.concatenate([old_bounds[~np.isin(old_digests, new_digests)], new_bounds[~np.isin(new_digests, old_digests)]])
+    # empty geometries have no bounds
+    return boxes[~np.isnan(boxes).any(axis=1)]
+
+
+class Snapshot(object):
+
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def _index_path(self, layer):
+        return os.path.join(self.folder, "features_%s.npz" % layer)
+
+    # The stored state ({"context": ..., "inputs": {layer: identity}}) and metric columns, or None when there is no snapshot
+    def load(self):
+        path = os.path.join(self.folder, SNAPSHOT_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as snapshot_file:
+            state = json.load(snapshot_file)
+        return state, load_metrics(os.path.join(self.folder, METRICS_FILE))
+
+    # (digests, bounds) of one input layer
+    def feature_index(self, layer):
+        with np.load(self._index_path(layer)) as stored:
+            return stored["digests"], stored["bounds"]
+
+    # indexes are (digests, bounds) of the input layers that were read, layer -> index. The state is written last, so a snapshot that was not fully written is never read
+    def save(self, context, identities, indexes, columns):
+        path = os.path.join(self.folder, SNAPSHOT_FILE)
+        if os.path.exists(path):
+            os.remove(path)
+        for layer, (digests, bounds) in indexes.items():
+            np.savez(self._index_path(layer), digests=digests, bounds=bounds)
+        stored = ColumnStore(columns.keys)
+        for field in METRIC_FIELDS:
+            stored[field] = columns[field]
+        save_metrics(os.path.join(self.folder, METRICS_FILE), stored)
+        with open(path, "w") as snapshot_file:
+            json.dump({"context": context, "inputs": identities}, snapshot_file, indent=1, sort_keys=True)
+
+
+# Run one node for some of the parcels (with the nodes it depends on) and return its metric columns
+def compute_node(backend, node, parcels, parcel_IDs, inputs, parameters, suffix=""):
+    function, dependencies = FACTOR_NODES[node]
+    for dependency in dependencies:
+        FACTOR_NODES[dependency][0](backend, parcels, parcel_IDs, inputs, suffix, **parameters[dependency])
+    arguments = dict((argument, dataset + suffix) for argument, (upstream, dataset) in UPSTREAM_DATASETS.get(node, {}).items())
+    arguments.update(parameters[node])
+    return function(backend, parcels, parcel_IDs, inputs, suffix, **arguments)
+
+
+# The same as pipeline.compute_metrics, but only the metrics that depend on input layers that changed since the snapshot in folder are
+# computed again, for the parcels near the changed features. The snapshot is then brought up to date.
+def compute_metrics_incremental(backend, parcels, inputs, folder, cache=None, parameters=None, factors=None):
+    parameters = factor_parameters(parameters)
+    factors = registered_factors() if factors is None else factors
+    snapshot = Snapshot(folder)
+    context = {"version": SNAPSHOT_VERSION, "backend": backend.name, "parcels": backend.fingerprint(parcels),
+               "area_of_interest": backend.fingerprint(inputs.areaOfInterest), "parameters": parameters}
+    # as it reads back from JSON
+    context = json.loads(json.dumps(context))
+    identities = dict((layer, dataset_identity(backend.full_path(getattr(inputs, layer)))) for layer in TRACKED_INPUTS)
+
+    parcel_IDs = backend.read_table(parcels, "OBJECTID")["OBJECTID"]
+    stored = snapshot.load()
+    if stored is None or stored[0]["context"] != context or not np.array_equal(stored[1].keys, parcel_IDs):
+        print("no snapshot of these parcels and settings, computing every metric")
+        columns = compute_metrics(backend, parcels, inputs, cache=cache, parameters=parameters, factors=factors)
+        indexes = dict((layer, backend.feature_index(getattr(inputs, layer))) for layer in TRACKED_INPUTS)
+        snapshot.save(context, identities, indexes, columns)
+        return columns
+
+    state, columns = stored
+    indexes = {}
+    boxes = {}
+    for layer in TRACKED_INPUTS:
+        if identities[layer] == state["inputs"].get(layer):
+            continue
+        indexes[layer] = backend.feature_index(getattr(inputs, layer))
+        boxes[layer] = changed_boxes(snapshot.feature_index(layer), indexes[layer])
+        print("%s: %d features changed" % (layer, len(boxes[layer])))
+
+    for node in FACTOR_NODES:
+        node_boxes = [boxes[layer] for layer in FACTOR_INPUTS[node] if layer in boxes and len(boxes[layer])]
+        if not node_boxes:
+            continue
+        node_boxes = np.concatenate(node_boxes)
+        with backend.stage("factor %s incremental" % node) as stage:
+            if node in WHOLE_AREA_NODES:
+                print("%s: computing every parcel again" % node)
+                values = compute_node(backend, node, parcels, parcel_IDs, inputs, parameters, UPDATE_SUFFIX)
+                for field in FACTOR_FIELDS[node]:
+                    columns[field] = values[field]
+                stage.set(parcels=len(parcel_IDs))
+                continue
+
+            reach = node_reach(node, parameters)
+            touched = backend.intersecting_ids(parcels, node_boxes, reach)
+            print("%s: tabulating %d of %d parcels again" % (node, len(touched), len(parcel_IDs)))
+            stage.set(parcels=len(touched))
+            if not len(touched):
+                continue
+            backend.select_ids(parcels, backend.intersecting_ids(parcels, node_boxes, reach + CONTEXT_DISTANCE), UPDATE_PARCELS)
+            update_IDs = backend.read_table(UPDATE_PARCELS, "OBJECTID")["OBJECTID"]
+            values = compute_node(backend, node, UPDATE_PARCELS, update_IDs, inputs, parameters, UPDATE_SUFFIX)
+
+            # only the parcels near the changed features are updated, the rest of the selection was only there for context
+            order = np.argsort(update_IDs)
+            source = order[np.searchsorted(update_IDs, touched, sorter=order)]
+            order = np.argsort(parcel_IDs)
+            target = order[np.searchsorted(parcel_IDs, touched, sorter=order)]
+            for field in FACTOR_FIELDS[node]:
+                updated = np.array(columns[field], dtype=float)
+                updated[target] = np.asarray(values[field], dtype=float)[source]
+                columns[field] = updated
+
+    backend.delete(intermediate_names(UPDATE_SUFFIX, []) + [UPDATE_PARCELS])
+    # the indexes of the layers that did not change are kept as they are
+    snapshot.save(context, identities, indexes, columns)
+    for field, values in extra_metrics(backend, parcels, parcel_IDs, factors).items():
+        columns[field] = values
+    return columns
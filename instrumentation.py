@@ -0,0 +1,279 @@
+#-------------------------------------------------------------------------------
+# Per-stage profiling of a ranking run
+#-------------------------------------------------------------------------------
+
+# A run that takes hours does not say where the time went. With instrumentation on, every stage of main() is timed:
+#   - every geoprocessing tool the backend runs (Project and select, each Clip, Erase, Tabulate Intersection, Near ...), with the
+#     rows of its input datasets and the rows (and, with the open backend, the size in memory) of the dataset it writes,
+#   - every factor (marked cached when it was read from the cache) and every tile,
+#   - scoring and the write back of the new fields.
+# Each stage records its wall time, CPU time of this process, resident memory at the end and how deeply it is nested in other stages.
+# Its peak memory is peak_rss_mb, the most resident memory sampled while it ran: a thread polls it every SAMPLE_SECONDS while a stage is
+# open (and at the start and end of each stage), which needs psutil. The process high-water mark (ru_maxrss, or the peak working set
+# on Windows) never goes down, so it can not tell the stages apart: process_peak_rise_mb is only how much a stage raised it, 0 for a
+# stage that stayed below an earlier peak. Stages are written as JSON lines as they finish, and optionally as a Chrome trace, which
+# chrome://tracing or https://ui.perfetto.dev show as a timeline.
+
+# Instrumentation is off unless main() is given an Instrumentation (--profile or --trace). When it is off, Backend.stage returns
+# NO_STAGE, a shared context manager that does nothing, so the only cost is a method call per factor and tile.
+
+# Stages run in the worker processes of --workers are not recorded (the scheduler prints their times), only the parallel step as a whole.
+
+import json
+import os
+import threading
+import time
+
+# time.process_time is not in python 2
+_cpu_time = getattr(time, "process_time", time.clock if hasattr(time, "clock") else time.time)
+
+
+# Seconds between the memory samples taken while a stage is open
+SAMPLE_SECONDS = 0.05
+
+
+# Resident memory of this process in MB, None without psutil
+def rss_mb():
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / 1048576.0
+
+
+# (current, peak) resident memory of this process in MB, None when it can not be measured. The peak is the high-water mark of the process.
+def memory_mb():
+    current = peak = None
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        current = info.rss / 1048576.0
+        # Windows reports the peak working set itself
+        peak = getattr(info, "peak_wset", None)
+        peak = peak / 1048576.0 if peak else None
+    except ImportError:
+        pass
+    if peak is None:
+        try:
+            import resource
+            import sys
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # kilobytes on Linux, bytes on macOS
+            peak = peak / (1048576.0 if sys.platform == "darwin" else 1024.0)
+        except ImportError:
+            pass
+    if current is not None and peak is not None:
+        peak = max(peak, current)
+    return current, peak
+
+
+# The stage returned when instrumentation is off
+class NoStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+NO_STAGE = NoStage()
+
+
+# One timed stage, used as a context manager. Fields added with set() (eg. rows_out) are written with its timings.
+class Stage(object):
+
+    def __init__(self, instrumentation, name, fields):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.fields = fields
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.depth = self.instrumentation.depth
+        self.instrumentation.depth += 1
+        self.process_peak_started = memory_mb()[1]
+        self.peak_rss = None
+        self.instrumentation.sampler.open(self)
+        self.started = time.time()
+        self.cpu_started = _cpu_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.time() - self.started
+        cpu = _cpu_time() - self.cpu_started
+        self.instrumentation.depth -= 1
+        self.instrumentation.sampler.close(self)
+        rss, peak = memory_mb()
+        rise = peak - self.process_peak_started if peak is not None and self.process_peak_started is not None else None
+        record = {"stage": self.name, "depth": self.depth, "start": round(self.started - self.instrumentation.started, 6),
+                  "wall_s": round(wall, 6), "cpu_s": round(cpu, 6), "rss_mb": rss and round(rss, 1),
+                  "peak_rss_mb": self.peak_rss and round(self.peak_rss, 1), "process_peak_rise_mb": rise if rise is None else round(rise, 1)}
+        if exc_type is not None:
+            record["error"] = "%s: %s" % (exc_type.__name__, exc_value)
+        record.update(self.fields)
+        self.instrumentation.add(record)
+        return False
+
+
+# Samples the resident memory into the peak_rss of every open stage, from a thread that runs while a stage is open.
+# Without psutil nothing is sampled and peak_rss stays None.
+class MemorySampler(object):
+
+    def __init__(self, interval=SAMPLE_SECONDS):
+        self.interval = interval
+        self.stages = []
+        self.enabled = rss_mb() is not None
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+        self._stopped = False
+
+    def sample(self):
+        rss = rss_mb()
+        with self._lock:
+            for stage in self.stages:
+                stage.peak_rss = rss if stage.peak_rss is None else max(stage.peak_rss, rss)
+
+    def open(self, stage):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.stages.append(stage)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="memory sampler")
+                self._thread.daemon = True
+                self._thread.start()
+            self._wake.notify()
+        self.sample()
+
+    def close(self, stage):
+        if not self.enabled:
+            return
+        self.sample()
+        with self._lock:
+            self.stages.remove(stage)
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                # sleep until a stage is open
+                while not self.stages and not self._stopped:
+                    self._wake.wait()
+                if self._stopped:
+                    return
+                self._wake.wait(self.interval)
+                if self._stopped:
+                    return
+            self.sample()
+
+
+class Instrumentation(object):
+
+    # jsonl_path gets one JSON line per stage as it finishes, trace_path a Chrome trace written by close()
+    def __init__(self, jsonl_path=None, trace_path=None):
+        self.trace_path = trace_path
+        self.records = []
+        self.depth = 0
+        self.sampler = MemorySampler()
+        self.started = time.time()
+        self._jsonl = open(jsonl_path, "w") if jsonl_path else None
+
+    def stage(self, name, **fields):
+        return Stage(self, name, fields)
+
+    def add(self, record):
+        self.records.append(record)
+        if self._jsonl:
+            self._jsonl.write(json.dumps(record, sort_keys=True) + "\n")
+            self._jsonl.flush()
+
+    # Chrome trace format: one complete ("X") event per stage, times in microseconds
+    def trace_events(self):
+        pid = os.getpid()
+        events = []
+        for record in self.records:
+            args = dict((key, value) for key, value in record.items() if key not in ("stage", "start", "wall_s", "depth"))
+            events.append({"name": record["stage"], "cat": record["stage"].split(" ")[0], "ph": "X", "pid": pid, "tid": 0,
+                           "ts": int(record["start"] * 1e6), "dur": int(record["wall_s"] * 1e6), "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    # The slowest stages of a depth, as lines of text
+    def report(self, depth=None, top=10):
+        records = [record for record in self.records if depth is None or record["depth"] == depth]
+        records.sort(key=lambda record: -record["wall_s"])
+        return ["%-50s %9.1f s wall %9.1f s cpu" % (record["stage"], record["wall_s"], record["cpu_s"]) for record in records[:top]]
+
+    def close(self):
+        self.sampler.stop()
+        if self._jsonl:
+            self._jsonl.close()
+            self._jsonl = None
+        if self.trace_path:
+            with open(self.trace_path, "w") as trace_file:
+                json.dump(self.trace_events(), trace_file)
+
+
+# The position (after self) of the input datasets and of the output dataset of each backend tool that is timed
+TOOL_DATASETS = {
+    "select_parcels": ([0, 1], 2),
+    "select_townships": ([0], 2),
+    "select_ids": ([0], 2),
+    "intersecting_ids": ([0], None),
+    "feature_index": ([0], None),
+    "copy": ([0], 1),
+    "copy_ids": ([0], 2),
+    "project": ([0], 1),
+    "clip": ([0, 1], 2),
+    "erase": ([0, 1], 2),
+    "feature_to_line": ([0], 1),
+    "buffer": ([0], 1),
+    "explode": ([0], 1),
+    "tabulate_intersection": ([0, 2], 3),
+    "overlay": ([0], None),
+    "near_table": ([0, 1], 2),
+    "rasterize": ([0], None),
+    "read_table": ([0], None),
+    "write_columns": ([0], None),
+}
+
+
+# A backend that times each of its tools as a stage, with the sizes of the datasets they read and write. Everything else is passed through.
+class InstrumentedBackend(object):
+
+    def __init__(self, backend, instrumentation):
+        self.backend = backend
+        self.instrumentation = instrumentation
+
+    def stage(self, name, **fields):
+        return self.instrumentation.stage(name, **fields)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.backend, name)
+        if name not in TOOL_DATASETS:
+            return attribute
+        inputs, output = TOOL_DATASETS[name]
+        backend = self.backend
+
+        def tool(*args, **kwargs):
+            label = args[output] if output is not None and output < len(args) else os.path.basename(str(args[0]))
+            with self.instrumentation.stage("%s %s" % (name, label)) as stage:
+                result = attribute(*args, **kwargs)
+                stage.set(inputs=[dict(dataset=str(args[position]), **backend.dataset_size(args[position])) for position in inputs if position < len(args)])
+                if output is not None and output < len(args):
+                    stage.set(**dict(("%s_out" % key, value) for key, value in backend.dataset_size(args[output]).items()))
+            return result
+        return tool
@@ -0,0 +1,67 @@
+#-------------------------------------------------------------------------------
+# Per-parcel metrics tables on disk
+#-------------------------------------------------------------------------------
+
+# The metric columns computed by the geoprocessing (see pipeline.py) can be saved to a plain table file, so they can be
+# scored again without ArcGIS or the input data (see rescore.py). The format is chosen by the file extension:
+#   .npz                  NumPy, one array per field
+#   .arrow or .feather    Arrow IPC (pyarrow)
+#   .parquet              Parquet (pyarrow)
+# Every table has an OBJECTID column with the parcel keys, followed by one column per field.
+
+import os
+
+import numpy as np
+
+from table_io import ColumnStore
+
+KEY_FIELD = "OBJECTID"
+METRICS_EXTENSIONS = (".npz", ".arrow", ".feather", ".parquet")
+
+
+def is_metrics_file(path):
+    return os.path.splitext(path)[1].lower() in METRICS_EXTENSIONS
+
+
+def save_metrics(path, columns):
+    extension = os.path.splitext(path)[1].lower()
+    arrays = [(KEY_FIELD, columns.keys)] + [(field, columns[field]) for field in columns.fields()]
+    if extension == ".npz":
+        np.savez(path, **dict(arrays))
+    elif extension in (".arrow", ".feather", ".parquet"):
+        import pyarrow
+        table = pyarrow.table([pyarrow.array(values) for field, values in arrays], names=[field for field, values in arrays])
+        if extension == ".parquet":
+            import pyarrow.parquet
+            pyarrow.parquet.write_table(table, path)
+        else:
+            import pyarrow.feather
+            pyarrow.feather.write_feather(table, path)
+    else:
+        raise ValueError("unknown metrics table format %r, expected one of %s" % (extension, ", ".join(METRICS_EXTENSIONS)))
+
+
+# Load a table saved by save_metrics into a ColumnStore keyed by OBJECTID. Nulls are read as NaN.
+def load_metrics(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npz":
+        with np.load(path) as stored:
+            arrays = [(field, stored[field]) for field in stored.files]
+    elif extension in (".arrow", ".feather", ".parquet"):
+        if extension == ".parquet":
+            import pyarrow.parquet
+            table = pyarrow.parquet.read_table(path)
+        else:
+            import pyarrow.feather
+            table = pyarrow.feather.read_table(path)
+        arrays = [(field, table.column(field).to_numpy(zero_copy_only=False)) for field in table.column_names]
+    else:
+        raise ValueError("unknown metrics table format %r, expected one of %s" % (extension, ", ".join(METRICS_EXTENSIONS)))
+
+    arrays = dict(arrays)
+    if KEY_FIELD not in arrays:
+        raise ValueError("%s has no %s column" % (path, KEY_FIELD))
+    columns = ColumnStore(arrays.pop(KEY_FIELD))
+    for field, values in arrays.items():
+        columns[field] = values
+    return columns
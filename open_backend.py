@@ -0,0 +1,480 @@
+#-------------------------------------------------------------------------------
+# Open geoprocessing backend (Shapely 2, GeoPandas, pyogrio)
+#-------------------------------------------------------------------------------
+
+# Runs the same geoprocessing as ArcpyBackend without arcpy, so the ranking can run on Linux machines.
+# Geometry work uses Shapely 2's vectorized functions, and every overlay finds its candidate pairs with an STRtree
+# query instead of comparing every feature with every other feature. Data is read and written with pyogrio.
+
+# The workspace is a GeoPackage, or a folder ending in .parquet or .arrow with one GeoParquet or Arrow file per dataset (see
+# parquet_io.py), created on the first write. Every output is written to it as a layer with the name
+# it was given, and is also kept in memory so the next step does not have to read it back. With write_intermediates=False
+# only the results of write_columns are written, everything else stays in memory until it is deleted.
+# Inputs can be any format OGR reads (shapefile, GeoPackage, file geodatabase through the OpenFileGDB driver). Use
+# "path/to/data.gdb/layer" or "path/to/data.gpkg/layer" for one layer of a multi-layer dataset. GeoParquet and Arrow files written by
+# parquet_io.py can also be used as inputs.
+
+# Spatial inputs are projected to NAD 1983 10TM AEP Forest as they are read, the same way arcpy projects on the fly.
+
+# The provincial layers are not read whole. Each step that reads an input from a path (rather than a dataset of the workspace) only asks
+# the data source for the features whose bounding boxes overlap the area it works on (the parcels, the area of interest or its 50 km
+# buffer), through an OGR spatial filter that uses the GeoPackage R-tree, the shapefile .qix or the file geodatabase spatial index. The
+# attributes the ranking never uses are not read either (INPUT_COLUMNS), so time and memory depend on the size of the area of interest
+# rather than the size of the province. Inputs already in memory (see preload) are filtered there instead. The protected areas are a small
+# layer and are read whole, so the NEAR_FID of the near table is the position of the protected area in the layer.
+
+import json
+import os
+
+import numpy as np
+
+from backends import PROJECTED_CRS_EPSG, Backend
+from grouped_reduction import group_keys
+from parquet_io import COLUMNAR_EXTENSIONS, is_columnar_file
+from proximity import nearest_within
+
+CONTAINER_EXTENSIONS = (".gdb", ".gpkg") + COLUMNAR_EXTENSIONS
+
+# The attributes read from the quarter sections (the fields arcpy's select_parcels keeps), other inputs are read without attributes
+PARCEL_COLUMNS = ["MER", "RGE", "TWP", "SEC", "QS", "RA", "PARCEL_ID"]
+
+
+# Split "path/to/data.gdb/layer" into ("path/to/data.gdb", "layer"). Paths without a layer return (path, None).
+def split_dataset_path(dataset):
+    normalized = dataset.replace("\\", "/")
+    for extension in CONTAINER_EXTENSIONS:
+        marker = extension + "/"
+        position = normalized.lower().find(marker)
+        if position != -1:
+            end = position + len(extension)
+            return dataset[:end], dataset[end + 1:]
+    return dataset, None
+
+
+# Group the second array of an STRtree query result by the first. Returns the unique first indices, the second
+# indices sorted by group, and the start of each group.
+def group_pairs(first, second):
+    sorted_first, order, starts = group_keys(first)
+    return sorted_first[starts], second[order], starts
+
+
+# Union the geometries of each group (as returned by group_pairs) into one geometry per group
+def union_groups(geometries, members, starts):
+    import shapely
+    ends = np.append(starts[1:], len(members))
+    return np.array([shapely.union_all(geometries[members[start:end]]) for start, end in zip(starts, ends)], dtype=object)
+
+
+class OpenBackend(Backend):
+
+    name = "open"
+    workspace_description = "GeoPackage, or a folder ending in .parquet or .arrow"
+
+    def __init__(self, workspace, write_intermediates=True, incidence_folder=None):
+        Backend.__init__(self, workspace)
+        self.write_intermediates = write_intermediates
+        # folder the incidence matrix of every overlaid layer is saved to (see incidence.py), they are not kept otherwise
+        self.incidence_folder = incidence_folder
+        self._datasets = {}
+        # the last part of each input read by read_window: (dataset, columns) -> (bbox, frame)
+        self._windows = {}
+
+    # The GeoPackage (or columnar folder) does not need to exist yet, but the folder it goes in does
+    @classmethod
+    def is_workspace(cls, path):
+        folder = os.path.dirname(os.path.abspath(path))
+        return path.lower().endswith((".gpkg",) + COLUMNAR_EXTENSIONS) and os.path.isdir(folder)
+
+    @classmethod
+    def create_workspace(cls, folder, name):
+        path = os.path.join(folder, name + ".gpkg")
+        if os.path.exists(path):
+            os.remove(path)
+        return path
+
+    def _is_workspace_name(self, dataset):
+        return os.path.basename(dataset) == dataset and os.path.splitext(dataset)[1] == ""
+
+    def _layers(self, path):
+        import pyogrio
+        try:
+            return [layer for layer, geometry_type in pyogrio.list_layers(path)]
+        except Exception:
+            return []
+
+    def _source(self, dataset):
+        if self._is_workspace_name(dataset):
+            return self.workspace, dataset
+        return split_dataset_path(dataset)
+
+    # The .parquet or .arrow file of a dataset, in a columnar workspace or given by its path. None for other formats.
+    def _columnar_file(self, dataset):
+        path, layer = self._source(dataset)
+        if not is_columnar_file(path):
+            return None
+        return path if layer is None else os.path.join(path, layer + os.path.splitext(path)[1])
+
+    def exists(self, dataset):
+        if dataset in self._datasets:
+            return True
+        if self._columnar_file(dataset):
+            return os.path.exists(self._columnar_file(dataset))
+        path, layer = self._source(dataset)
+        if not os.path.exists(path):
+            return False
+        return layer is None or layer in self._layers(path)
+
+    def is_feature_data(self, dataset):
+        import pyogrio
+        from parquet_io import read_metadata
+        if self._columnar_file(dataset):
+            try:
+                return b"geo" in read_metadata(self._columnar_file(dataset))
+            except Exception:
+                return False
+        path, layer = self._source(dataset)
+        try:
+            return pyogrio.read_info(path, layer=layer)["geometry_type"] is not None
+        except Exception:
+            return False
+
+    def preload(self, datasets):
+        for dataset in datasets:
+            self.read(dataset)
+
+    # Datasets read from paths (not from this workspace) are shared, none of the steps change the frames they read
+    def with_workspace(self, workspace):
+        backend = OpenBackend(workspace, self.write_intermediates, self.incidence_folder)
+        backend._datasets = dict((name, frame) for name, frame in self._datasets.items() if not self._is_workspace_name(name))
+        backend._windows = self._windows
+        return backend
+
+    # Read a dataset (from memory if this backend wrote it), projected to the analysis coordinate system
+    def read(self, dataset):
+        import pyogrio
+        from parquet_io import read_frame
+        if dataset not in self._datasets:
+            path, layer = self._source(dataset)
+            if self._columnar_file(dataset):
+                frame = read_frame(self._columnar_file(dataset))
+            else:
+                frame = pyogrio.read_dataframe(path, layer=layer)
+            if getattr(frame, "crs", None) is not None and frame.crs.to_epsg() != PROJECTED_CRS_EPSG:
+                frame = frame.to_crs(epsg=PROJECTED_CRS_EPSG)
+            self._datasets[dataset] = frame
+        return self._datasets[dataset]
+
+    # The features of an input whose bounding boxes overlap bbox (xmin, ymin, xmax, ymax in the analysis coordinate system), with only the
+    # given attribute columns (all of them when columns is None). Datasets of the workspace, datasets already in memory and columnar files
+    # are filtered in memory, anything else is filtered by the data source. A window inside the last one read of the input is filtered from it.
+    def read_window(self, dataset, bbox, columns=None):
+        import pyogrio
+        if dataset in self._datasets or self._is_workspace_name(dataset) or self._columnar_file(dataset):
+            return self._within(self.read(dataset), bbox)
+        key = (dataset, tuple(columns) if columns is not None else None)
+        if key in self._windows:
+            window, frame = self._windows[key]
+            if window[0] <= bbox[0] and window[1] <= bbox[1] and window[2] >= bbox[2] and window[3] >= bbox[3]:
+                return self._within(frame, bbox)
+
+        path, layer = self._source(dataset)
+        info = pyogrio.read_info(path, layer=layer)
+        source_bbox = tuple(bbox)
+        if info["crs"] is not None:
+            import pyproj
+            source_crs = pyproj.CRS.from_user_input(info["crs"])
+            if source_crs.to_epsg() != PROJECTED_CRS_EPSG:
+                source_bbox = pyproj.Transformer.from_crs(PROJECTED_CRS_EPSG, source_crs, always_xy=True).transform_bounds(*bbox, densify_pts=21)
+        if columns is not None:
+            columns = [column for column in columns if column in info["fields"]]
+        # features come back in the order of the spatial index, they are put back in the order of the layer (which OBJECTIDs are given in)
+        frame = pyogrio.read_dataframe(path, layer=layer, bbox=source_bbox, columns=columns, fid_as_index=True)
+        frame = frame.sort_index(kind="mergesort").reset_index(drop=True)
+        if getattr(frame, "crs", None) is not None and frame.crs.to_epsg() != PROJECTED_CRS_EPSG:
+            frame = frame.to_crs(epsg=PROJECTED_CRS_EPSG)
+        self._windows[key] = (tuple(bbox), frame)
+        return frame
+
+    # The features of a frame whose bounding boxes overlap bbox
+    def _within(self, frame, bbox):
+        import shapely
+        bounds = shapely.bounds(frame.geometry.values)
+        overlap = (bounds[:, 0] <= bbox[2]) & (bounds[:, 2] >= bbox[0]) & (bounds[:, 1] <= bbox[3]) & (bounds[:, 3] >= bbox[1])
+        return frame if overlap.all() else frame[overlap].reset_index(drop=True)
+
+    # name is a dataset name in the workspace, or a path (eg. "other.gpkg/layer")
+    def save(self, name, frame, final=False):
+        import pyogrio
+        self._datasets[name] = frame
+        if final or self.write_intermediates:
+            path, layer = self._source(name)
+            if self._columnar_file(name):
+                from parquet_io import write_frame
+                if layer is not None and not os.path.isdir(path):
+                    os.makedirs(path)
+                write_frame(frame, self._columnar_file(name))
+            else:
+                pyogrio.write_dataframe(frame, path, layer=layer)
+
+    # Deleted datasets are released from memory. Layers already written to the workspace are left in it.
+    def delete(self, datasets):
+        for dataset in datasets:
+            self._datasets.pop(dataset, None)
+
+    def copy(self, dataset, out):
+        self.save(out, self.read(dataset), final=True)
+
+    # Only the features with those IDs are read from the data source
+    def copy_ids(self, dataset, object_ids, out):
+        import pyogrio
+        path, layer = self._source(dataset)
+        frame = pyogrio.read_dataframe(path, layer=layer, fids=np.sort(np.asarray(object_ids, dtype=np.int64)), fid_as_index=True)
+        frame = frame.sort_index(kind="mergesort").reset_index(drop=True)
+        if getattr(frame, "crs", None) is not None and frame.crs.to_epsg() != PROJECTED_CRS_EPSG:
+            frame = frame.to_crs(epsg=PROJECTED_CRS_EPSG)
+        frame["OBJECTID"] = np.arange(1, len(frame) + 1)
+        self.save(out, frame, final=True)
+
+    # Datasets of the workspace and in memory were written in the analysis coordinate system
+    def coordinate_system(self, dataset):
+        import pyogrio
+        import pyproj
+        from parquet_io import GEOMETRY_COLUMN, read_metadata
+        if dataset in self._datasets or self._is_workspace_name(dataset):
+            return pyproj.CRS.from_epsg(PROJECTED_CRS_EPSG).name, "analysis"
+        if self._columnar_file(dataset):
+            geo = json.loads(read_metadata(self._columnar_file(dataset))[b"geo"].decode("utf-8"))["columns"][GEOMETRY_COLUMN]
+            crs = pyproj.CRS.from_json_dict(geo["crs"]) if geo.get("crs") else None
+        else:
+            path, layer = self._source(dataset)
+            info = pyogrio.read_info(path, layer=layer)
+            crs = pyproj.CRS.from_user_input(info["crs"]) if info["crs"] else None
+        if crs is None:
+            return None, None
+        if crs.to_epsg() == PROJECTED_CRS_EPSG:
+            return crs.name, "analysis"
+        return crs.name, "geographic" if crs.is_geographic else "projected"
+
+    # read projects the whole dataset, with GeoDataFrame.to_crs (one pyproj call for all of its coordinates)
+    def project(self, dataset, out):
+        self.save(out, self.read(dataset), final=True)
+
+    def fingerprint(self, dataset):
+        import hashlib
+        import shapely
+        frame = self.read(dataset)
+        digest = hashlib.sha1()
+        if "OBJECTID" in frame.columns:
+            order = np.argsort(frame["OBJECTID"].values, kind="mergesort")
+            digest.update(np.ascontiguousarray(frame["OBJECTID"].values[order], dtype=np.int64).tobytes())
+        else:
+            order = np.arange(len(frame))
+        for wkb in shapely.to_wkb(frame.geometry.values[order]):
+            digest.update(wkb or b"")
+        return digest.hexdigest()
+
+    # The size in memory: the attribute columns, plus 16 bytes per coordinate of the geometries
+    def dataset_size(self, dataset):
+        import shapely
+        frame = self.read(dataset)
+        geometry = getattr(frame, "geometry", None)
+        if geometry is None:
+            return {"rows": len(frame), "bytes": int(frame.memory_usage(deep=True, index=False).sum())}
+        attributes = frame.drop(columns=geometry.name).memory_usage(deep=True, index=False).sum()
+        return {"rows": len(frame), "bytes": int(attributes) + int(shapely.get_num_coordinates(geometry.values).sum()) * 16}
+
+    def select_townships(self, parcels, townships, out):
+        import pandas
+        frame = self.read(parcels)
+        wanted = pandas.MultiIndex.from_tuples(list(townships))
+        inside = pandas.MultiIndex.from_arrays([frame["MER"], frame["RGE"], frame["TWP"]]).isin(wanted)
+        self.save(out, frame[inside].reset_index(drop=True))
+
+    def select_ids(self, dataset, object_ids, out):
+        frame = self.read(dataset)
+        self.save(out, frame[np.isin(frame["OBJECTID"].values, object_ids)].reset_index(drop=True))
+
+    def intersecting_ids(self, dataset, boxes, distance=0):
+        import shapely
+        frame = self.read(dataset)
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        query = shapely.box(boxes[:, 0] - distance, boxes[:, 1] - distance, boxes[:, 2] + distance, boxes[:, 3] + distance)
+        hits = shapely.STRtree(frame.geometry.values).query(query, predicate="intersects")[1]
+        return frame["OBJECTID"].values[np.unique(hits)]
+
+    def feature_index(self, dataset):
+        import hashlib
+        import shapely
+        geometries = self.read(dataset).geometry.values
+        digests = np.array([hashlib.sha1(wkb or b"").digest() for wkb in shapely.to_wkb(geometries)], dtype="S20")
+        return digests, shapely.bounds(geometries)
+
+    # A new GeoDataFrame with the given geometries, carrying the attributes of rows keep of like (or no attributes)
+    def _features(self, geometries, like, keep=None):
+        import geopandas
+        import pandas
+        if keep is None:
+            attributes = pandas.DataFrame(index=pandas.RangeIndex(len(geometries)))
+        else:
+            attributes = like.drop(columns=like.geometry.name).iloc[keep].reset_index(drop=True)
+        return geopandas.GeoDataFrame(attributes, geometry=geopandas.GeoSeries(geometries, crs=like.crs).values, crs=like.crs)
+
+    def select_parcels(self, quarter_sections, area_of_interest, out):
+        import shapely
+        aoi = shapely.union_all(self.read(area_of_interest).geometry.values)
+        parcels = self.read_window(quarter_sections, shapely.bounds(aoi), PARCEL_COLUMNS)
+
+        # Removes roads from parcel data to ensure that only quarter sections are selected ("RA NOT LIKE 'R'", nulls are not selected)
+        not_road = parcels["RA"].notna().values & (parcels["RA"].astype(str).values != "R")
+
+        # selects all parcels intersecting the users area of interest
+        intersecting = np.zeros(len(parcels), dtype=bool)
+        intersecting[shapely.STRtree(parcels.geometry.values).query(aoi, predicate="intersects")] = True
+
+        selected = parcels[intersecting & not_road].reset_index(drop=True)
+        selected["OBJECTID"] = np.arange(1, len(selected) + 1)
+        self.save(out, selected, final=True)
+
+    def clip(self, in_features, clip_features, out):
+        import shapely
+        mask = shapely.union_all(self.read(clip_features).geometry.values)
+        source = self.read_window(in_features, shapely.bounds(mask), [])
+        geometries = source.geometry.values
+        hits = shapely.STRtree(geometries).query(mask, predicate="intersects")
+        clipped = shapely.intersection(geometries[hits], mask)
+        # keep only pieces of the same dimension as the input (touching features give points or lines)
+        keep = shapely.get_dimensions(clipped) == shapely.get_dimensions(geometries[hits])
+        keep &= ~shapely.is_empty(clipped)
+        self.save(out, self._features(clipped[keep], source, hits[keep]))
+
+    def erase(self, in_features, erase_features, out):
+        import shapely
+        source = self.read(in_features)
+        geometries = np.array(source.geometry.values, dtype=object)
+        erasers = np.array(self.read(erase_features).geometry.values, dtype=object)
+
+        result = geometries.copy()
+        if len(erasers):
+            source_index, eraser_index = shapely.STRtree(erasers).query(geometries, predicate="intersects")
+            if len(source_index):
+                affected, members, starts = group_pairs(source_index, eraser_index)
+                result[affected] = shapely.difference(geometries[affected], union_groups(erasers, members, starts))
+        keep = ~shapely.is_empty(result)
+        self.save(out, self._features(result[keep], source, np.flatnonzero(keep)))
+
+    def feature_to_line(self, in_features, out):
+        import shapely
+        source = self.read(in_features)
+        # the boundaries are unioned so shared edges are kept once and lines are split where they cross
+        lines = shapely.get_parts(shapely.line_merge(shapely.union_all(shapely.boundary(source.geometry.values))))
+        self.save(out, self._features(lines, source))
+
+    def buffer(self, in_features, out, distance, dissolve=False):
+        import shapely
+        source = self.read(in_features)
+        if dissolve:
+            buffered = shapely.buffer(shapely.union_all(source.geometry.values), distance)
+            self.save(out, self._features(np.array([buffered], dtype=object), source))
+        else:
+            self.save(out, self._features(shapely.buffer(source.geometry.values, distance), source, np.arange(len(source))))
+
+    def explode(self, in_features, out):
+        source = self.read(in_features)
+        self.save(out, source.explode(index_parts=False).reset_index(drop=True))
+
+    def tabulate_intersection(self, zones, zone_field, in_features, out, class_fields=None):
+        import pandas
+        import shapely
+        zone_frame = self.read(zones)
+        zone_geometries = np.array(zone_frame.geometry.values, dtype=object)
+        feature_frame = self.read(in_features)
+        features = np.array(feature_frame.geometry.values, dtype=object)
+        zone_ids = zone_frame[zone_field].values
+        key = zone_field + "_1" if zone_field == "OBJECTID" else zone_field
+        lines = len(features) > 0 and shapely.get_dimensions(features[0]) == 1
+
+        if len(features):
+            zone_index, feature_index = shapely.STRtree(features).query(zone_geometries, predicate="intersects")
+        else:
+            zone_index = feature_index = np.zeros(0, dtype=np.intp)
+
+        if class_fields:
+            # one row per zone and intersecting feature, carrying the feature's own area or the value of its class field
+            if class_fields != "SHAPE_Area" and class_fields not in feature_frame.columns:
+                raise ValueError("the open backend can only classify by SHAPE_Area or a field of the features, got %r" % class_fields)
+            # features that only touch the edge of a zone do not intersect it
+            inside = shapely.relate_pattern(zone_geometries[zone_index], features[feature_index], "T********")
+            zone_index, feature_index = zone_index[inside], feature_index[inside]
+            classes = shapely.area(features) if class_fields == "SHAPE_Area" else feature_frame[class_fields].values
+            table = pandas.DataFrame({key: zone_ids[zone_index], class_fields: classes[feature_index]})
+        elif len(zone_index) == 0:
+            # the geometry type is unknown without features, so the empty table gets the fields of both
+            fields = ["LENGTH"] if lines else ["AREA", "PERCENTAGE"] if len(features) else ["AREA", "PERCENTAGE", "LENGTH"]
+            table = pandas.DataFrame(dict([(key, zone_ids[:0])] + [(field, np.zeros(0)) for field in fields]))
+        else:
+            # overlapping features are counted once: each zone is intersected with the union of its features
+            zone_with_hits, members, starts = group_pairs(zone_index, feature_index)
+            pieces = shapely.intersection(zone_geometries[zone_with_hits], union_groups(features, members, starts))
+            if lines:
+                table = pandas.DataFrame({key: zone_ids[zone_with_hits], "LENGTH": shapely.length(pieces)})
+            else:
+                area = shapely.area(pieces)
+                table = pandas.DataFrame({key: zone_ids[zone_with_hits], "AREA": area,
+                                          "PERCENTAGE": area / shapely.area(zone_geometries[zone_with_hits]) * 100})
+        self.save(out, table)
+
+    # One pass: the zones are indexed once and every layer is tabulated against the same index
+    def overlay(self, zones, zone_field, zone_IDs, layers):
+        import pandas
+        from overlay import MEASURES, ZoneIndex, check_measure
+        zone_frame = self.read(zones)
+        zone_keys = zone_frame[zone_field].values
+        key = zone_field + "_1" if zone_field == "OBJECTID" else zone_field
+        index = ZoneIndex(zone_frame.geometry.values, zone_keys)
+        results = []
+        for in_features, measure, out in layers:
+            check_measure(measure)
+            class_fields, fields, reduce = MEASURES[measure]
+            # only the features around the zones are read, so a provincial layer (eg. a patch index) is not read whole
+            class_field = class_fields if class_fields not in (None, "SHAPE_Area") else None
+            features = self.read_window(in_features, zone_frame.total_bounds, [class_field] if class_field else [])
+            incidence = index.incidence(features.geometry.values, measure, features[class_field].values if class_field else None)
+            if self.incidence_folder:
+                incidence.save(os.path.join(self.incidence_folder, out + ".npz"))
+            positions, values = incidence.tabulate()
+            self.save(out, pandas.DataFrame(dict([(key, zone_keys[positions])] + [(table_field, values[field]) for field, table_field in fields])))
+            results.append(dict((field, reduce(zone_keys[positions], values[field], zone_IDs)) for field, _ in fields))
+        return results
+
+    def near_table(self, in_features, near_features, out, search_radius=None):
+        import pandas
+        source = self.read(in_features)
+        nearest, distance = nearest_within(source.geometry.values, self.read(near_features).geometry.values, search_radius)
+        found = nearest >= 0
+        self.save(out, pandas.DataFrame({"IN_FID": source["OBJECTID"].values[found], "NEAR_FID": nearest[found] + 1, "NEAR_DIST": distance[found]}))
+
+    def extent(self, dataset):
+        return tuple(self.read(dataset).total_bounds)
+
+    def rasterize(self, dataset, grid, value_field=None, all_touched=False):
+        from raster import rasterize_geometries
+        frame = self.read_window(dataset, grid.extent, [value_field] if value_field else [])
+        values = frame[value_field].values if value_field else None
+        return rasterize_geometries(frame.geometry.values, grid, values, all_touched)
+
+    def read_table(self, table, fields, null_value=0):
+        if isinstance(fields, str):
+            fields = [fields]
+        frame = self.read(table)
+        return dict((field, frame[field].fillna(null_value).values) for field in fields)
+
+    def write_columns(self, table, columns, key_field="OBJECTID"):
+        frame = self.read(table).copy()
+        lookup = dict((key, position) for position, key in enumerate(columns.keys.tolist()))
+        rows = np.array([lookup.get(key, -1) for key in frame[key_field].tolist()], dtype=np.intp)
+        found = rows >= 0
+        for field in columns.fields():
+            values = np.full(len(frame), np.nan)
+            values[found] = columns[field][rows[found]]
+            frame[field] = values
+        self.save(table, frame, final=True)
@@ -0,0 +1,98 @@
+#-------------------------------------------------------------------------------
+# One overlay of the parcels with many layers
+#-------------------------------------------------------------------------------
+
+# Intactness, wetland edge, lotic area and patch size each end with a Tabulate Intersection of the parcels with one layer, and each
+# of those builds an index of the parcels and walks every parcel again. Backend.overlay tabulates any number of layers against the
+# parcels at once instead, and compute_metrics (see pipeline.py) gives it the layers of every factor together. With the open backend
+# the parcels are indexed (an STRtree of prepared geometries) and their areas are computed once, for all of the layers (ZoneIndex).
+# ArcpyBackend runs Tabulate Intersection for each layer as before.
+
+# Each layer is tabulated with one measure:
+#   area       AREA and PERCENTAGE of each parcel covered by the layer (overlapping features are counted once)
+#   length     LENGTH of the layer's lines within each parcel
+#   max_area   MAX_AREA, the full area of the largest feature that overlaps the inside of each parcel (not only its edge)
+#   max_patch_area   MAX_AREA as for max_area, from the PATCH_AREA field of the features instead of their own area (see patch_index.py)
+# The result of each layer is a mapping of field -> values lined up with the parcel IDs, parcels the layer does not reach get 0.
+
+import numpy as np
+
+from grouped_reduction import grouped_max, grouped_sum
+
+# measure -> (class_fields for Tabulate Intersection, [(result field, field of the tabulated table)], how rows of a parcel are combined)
+MEASURES = {
+    "area": (None, [("AREA", "AREA"), ("PERCENTAGE", "PERCENTAGE")], grouped_sum),
+    "length": (None, [("LENGTH", "LENGTH")], grouped_sum),
+    "max_area": ("SHAPE_Area", [("MAX_AREA", "SHAPE_Area")], grouped_max),
+    "max_patch_area": ("PATCH_AREA", [("MAX_AREA", "PATCH_AREA")], grouped_max),
+}
+
+
+def check_measure(measure):
+    if measure not in MEASURES:
+        raise ValueError("unknown overlay measure %r, expected one of %s" % (measure, ", ".join(sorted(MEASURES))))
+
+
+# The parcels (zones) of an overlay, indexed once for every layer tabulated against them. keys are the zone keys (eg. OBJECTID),
+# their positions by default.
+class ZoneIndex(object):
+
+    def __init__(self, zones, keys=None):
+        import shapely
+        self.zones = np.array(zones, dtype=object)
+        self.keys = np.arange(len(self.zones)) if keys is None else np.asarray(keys)
+        shapely.prepare(self.zones)
+        self.tree = shapely.STRtree(self.zones)
+        self._areas = None
+
+    @property
+    def areas(self):
+        import shapely
+        if self._areas is None:
+            self._areas = shapely.area(self.zones)
+        return self._areas
+
+    # The incidence matrix of the zones and a layer's features for the measure (see incidence.py).
+    # values are the class field of the features for measures that have one other than SHAPE_Area.
+    def incidence(self, features, measure, values=None):
+        import shapely
+        from incidence import Incidence
+        from open_backend import group_pairs
+        check_measure(measure)
+        features = np.array(features, dtype=object)
+        if not len(features):
+            return Incidence.from_pairs([], [], [], self.keys, 0, measure, self.areas)
+        feature_index, zone_index = self.tree.query(features, predicate="intersects")
+
+        if measure in ("max_area", "max_patch_area"):
+            # features that only touch the edge of a zone do not overlap it
+            inside = shapely.relate_pattern(self.zones[zone_index], features[feature_index], "T********")
+            zone_index, feature_index = zone_index[inside], feature_index[inside]
+            sizes = shapely.area(features) if values is None else np.asarray(values, dtype=float)
+            return Incidence.from_pairs(zone_index, feature_index, sizes[feature_index], self.keys, len(features), measure, self.areas)
+
+        # each feature is cut to each zone it reaches first, which is much faster than intersecting the zone with the union of whole features
+        # when they are large (eg. riparian areas)
+        measured = shapely.length if measure == "length" else shapely.area
+        cut = shapely.intersection(self.zones[zone_index], features[feature_index])
+        sizes = measured(cut)
+        # features that only touch a zone leave an empty piece, which the incidence matrix drops anyway
+        kept = sizes > 0
+        zone_index, feature_index, cut, sizes = zone_index[kept], feature_index[kept], cut[kept], sizes[kept]
+        # overlapping features are counted once: only in the zones whose pieces overlap (their union is smaller than their sum), each
+        # piece is measured without the pieces before it
+        _, members, starts = group_pairs(zone_index, np.arange(len(zone_index)))
+        ends = np.append(starts[1:], len(members))
+        for position in np.flatnonzero(ends - starts > 1):
+            pieces = members[starts[position]:ends[position]]
+            if measured(shapely.union_all(cut[pieces])) >= sizes[pieces].sum() * (1 - 1e-9):
+                continue
+            covered = cut[pieces[0]]
+            for piece in pieces[1:]:
+                sizes[piece] = measured(shapely.difference(cut[piece], covered))
+                covered = shapely.union(covered, cut[piece])
+        return Incidence.from_pairs(zone_index, feature_index, sizes, self.keys, len(features), measure, self.areas)
+
+    # The positions of the zones a layer's features reach, with one row per zone: {result field: values} for the measure
+    def tabulate(self, features, measure, values=None):
+        return self.incidence(features, measure, values).tabulate()
@@ -0,0 +1,228 @@
+#-------------------------------------------------------------------------------
+# Province-wide index of the parcels, built once per quarter section release
+#-------------------------------------------------------------------------------
+
+# Selecting the parcels of a run makes a layer of the provincial quarter sections, selects those intersecting the area of interest, removes
+# the road rows (RA = 'R') and copies the rest (see Backend.select_parcels). The quarter sections are projected on every run, every road
+# row is tested against the area of interest, and the selection has to be repeated for every area of interest.
+#
+# build_parcel_index does the part that is the same for every run once: it projects the quarter sections to the analysis coordinate system,
+# drops the road rows and writes the rest to a GeoPackage layer (Parcels, in the order of the quarter sections). Next to it, a .npz file
+# holds a packed R-tree of the parcels' bounding boxes (PackedRTree: the boxes are sorted into nodes of NODE_SIZE by Sort-Tile-Recursive
+# and every level is an array of node boxes, so the tree is loaded with no building and queried with a few vectorized comparisons per level)
+# and the MER, RGE, TWP, SEC and QS keys of every parcel. A run given the index (--parcel-index in the main script):
+#   - selects the parcels of an area of interest with one query of the tree for its bounding box, and an exact intersects test of the
+#     prepared area of interest with the candidates only, which are the only parcels read,
+#   - or selects whole townships by their keys (--townships MER-RGE-TWP,...), with no geometry test at all. The area of interest is then
+#     the outline of the selected parcels.
+# The parcels selected are the same, in the same order, as without the index.
+#
+# The index is versioned by the quarter sections it was built from, as the patch index is (see patch_index.py), and a run whose quarter
+# sections are not those stops with an error. Build it with:
+#   python parcel_index.py ATS_V4_1.gdb/Quarter_Sections parcels.gpkg
+# Building needs the open backend libraries (Shapely, GeoPandas and pyogrio), the index can then be used with either backend.
+
+import json
+import os
+
+import numpy as np
+
+# Change this whenever the layout of the index changes, so older indexes are not used
+INDEX_VERSION = 1
+
+PARCEL_INDEX_LAYER = "Parcels"
+KEY_FIELDS = ["MER", "RGE", "TWP", "SEC", "QS"]
+
+# Number of children of every node of the tree
+NODE_SIZE = 16
+
+
+def description_path(parcel_index):
+    return os.path.splitext(parcel_index)[0] + ".json"
+
+
+def tree_path(parcel_index):
+    return os.path.splitext(parcel_index)[0] + ".npz"
+
+
+# Positions of boxes in Sort-Tile-Recursive order: slices of whole leaves along x, each sorted along y
+def str_order(boxes, node_size=NODE_SIZE):
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+    leaves = int(np.ceil(len(boxes) / float(node_size)))
+    per_slice = int(np.ceil(np.sqrt(leaves))) * node_size
+    by_x = np.argsort(centers[:, 0], kind="mergesort")
+    slices = np.arange(len(boxes)) // per_slice
+    return by_x[np.lexsort((centers[by_x, 1], slices))]
+
+
+# Which of boxes (an n x 4 array) overlap bbox
+def overlapping(boxes, bbox):
+    return (boxes[:, 0] <= bbox[2]) & (boxes[:, 2] >= bbox[0]) & (boxes[:, 1] <= bbox[3]) & (boxes[:, 3] >= bbox[1])
+
+
+# A static R-tree: levels[0] are the boxes of the entries (in the order they were given), every level above has the box of each run of
+# node_size boxes of the level below
+class PackedRTree(object):
+
+    def __init__(self, levels, node_size=NODE_SIZE):
+        self.levels = levels
+        self.node_size = node_size
+
+    @classmethod
+    def build(cls, boxes, node_size=NODE_SIZE):
+        levels = [np.asarray(boxes, dtype=float).reshape(-1, 4)]
+        while len(levels[-1]) > 1:
+            below = levels[-1]
+            starts = np.arange(0, len(below), node_size)
+            levels.append(np.column_stack([np.minimum.reduceat(below[:, 0], starts), np.minimum.reduceat(below[:, 1], starts),
+                                           np.maximum.reduceat(below[:, 2], starts), np.maximum.reduceat(below[:, 3], starts)]))
+        return cls(levels, node_size)
+
+    # The positions of the entries whose boxes overlap bbox, in increasing order
+    def query(self, bbox):
+        nodes = np.arange(len(self.levels[-1]))
+        for level in range(len(self.levels) - 1, -1, -1):
+            nodes = nodes[overlapping(self.levels[level][nodes], bbox)]
+            if level == 0:
+                return np.sort(nodes)
+            children = (nodes[:, None] * self.node_size + np.arange(self.node_size)).ravel()
+            nodes = children[children < len(self.levels[level - 1])]
+
+    # The levels as arrays to save, see from_arrays
+    def arrays(self):
+        return {"tree_boxes": np.concatenate(self.levels), "tree_level_sizes": np.array([len(level) for level in self.levels]), "tree_node_size": np.array(self.node_size)}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        ends = np.cumsum(arrays["tree_level_sizes"])
+        return cls(np.split(arrays["tree_boxes"], ends[:-1]), int(arrays["tree_node_size"]))
+
+
+class ParcelIndex(object):
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(description_path(path)) or not os.path.exists(tree_path(path)):
+            raise ValueError("%s is not a parcel index, build it with parcel_index.py" % path)
+        with open(description_path(path)) as description_file:
+            self.description = json.load(description_file)
+        if self.description.get("version") != INDEX_VERSION:
+            raise ValueError("%s is not a parcel index of this version, build it with parcel_index.py" % path)
+        with np.load(tree_path(path), allow_pickle=False) as arrays:
+            # the tree's entries are the parcels in Sort-Tile-Recursive order, rows are their positions in the layer
+            self.rows = arrays["rows"]
+            self.tree = PackedRTree.from_arrays(arrays)
+            self.keys = dict((field, arrays[field]) for field in KEY_FIELDS)
+
+    # Stop with an error when the index was not built from these quarter sections
+    def check(self, backend, quarter_sections):
+        from cache import dataset_identity
+        if self.description["quarter_sections"] != dataset_identity(backend.full_path(quarter_sections)):
+            raise ValueError("the parcel index %s was built from %s, not from these quarter sections, rebuild it with parcel_index.py"
+                             % (self.path, self.description["quarter_sections"][0]))
+
+    # The rows (from 0, in layer order) of the parcels intersecting a geometry: a query of the tree for its bounding box, and the exact test
+    # for the candidates only
+    def intersecting(self, geometry):
+        import pyogrio
+        import shapely
+        candidates = np.sort(self.rows[self.tree.query(shapely.bounds(geometry))])
+        if not len(candidates):
+            return candidates
+        frame = pyogrio.read_dataframe(self.path, layer=PARCEL_INDEX_LAYER, columns=[], fids=candidates + 1, fid_as_index=True)
+        geometries = frame.geometry.values[np.argsort(frame.index.values, kind="mergesort")]
+        shapely.prepare(geometry)
+        return candidates[shapely.intersects(geometry, geometries)]
+
+    # The rows of the parcels in the given (MER, RGE, TWP) townships
+    def in_townships(self, townships):
+        import pandas
+        wanted = pandas.MultiIndex.from_tuples([tuple(township) for township in townships])
+        inside = pandas.MultiIndex.from_arrays([self.keys["MER"], self.keys["RGE"], self.keys["TWP"]]).isin(wanted)
+        return np.flatnonzero(inside)
+
+    # The rows of the parcels with the given (MER, RGE, TWP, SEC, QS) keys, -1 for keys that are not in the index
+    def lookup(self, keys):
+        import pandas
+        index = pandas.MultiIndex.from_arrays([self.keys[field] for field in KEY_FIELDS])
+        return index.get_indexer(pandas.MultiIndex.from_tuples([tuple(key) for key in keys]))
+
+    # Copy the parcels at rows to out, with OBJECTIDs from 1 in the order of the layer
+    def copy_rows(self, backend, rows, out):
+        backend.copy_ids(backend.dataset_path(self.path, PARCEL_INDEX_LAYER), np.sort(rows) + 1, out)
+
+
+# Select the parcels intersecting the area of interest from the index into out, as Backend.select_parcels does from the quarter sections
+def select_parcels(backend, parcel_index, area_of_interest, out):
+    import shapely
+    from open_backend import OpenBackend
+    # the area of interest is read with the open backend libraries whichever backend selects the parcels
+    if backend.name == "open":
+        frame = backend.read(area_of_interest)
+    else:
+        frame = OpenBackend(backend.workspace, write_intermediates=False).read(backend.full_path(area_of_interest))
+    aoi = shapely.union_all(frame.geometry.values)
+    parcel_index.copy_rows(backend, parcel_index.intersecting(aoi), out)
+
+
+# Parse "MER-RGE-TWP,MER-RGE-TWP,..." into (MER, RGE, TWP) townships
+def parse_townships(text):
+    townships = []
+    for part in text.split(","):
+        values = part.strip().split("-")
+        if len(values) != 3 or not all(value.isdigit() for value in values):
+            raise ValueError("a township is given as MER-RGE-TWP, eg. 4-1-1, got %r" % part)
+        townships.append(tuple(int(value) for value in values))
+    return townships
+
+
+# Build the index of the parcels of the quarter sections (every one but the road rows) and write it to out (a GeoPackage)
+def build_parcel_index(quarter_sections, out, node_size=NODE_SIZE):
+    import pyogrio
+    import shapely
+    from cache import dataset_identity
+    from open_backend import PARCEL_COLUMNS, OpenBackend
+
+    reader = OpenBackend(out, write_intermediates=False)
+    parcels = reader.read(quarter_sections)
+    missing = [field for field in KEY_FIELDS + ["RA"] if field not in parcels.columns]
+    if missing:
+        raise ValueError("the quarter sections have no %s field" % ", ".join(missing))
+    # Removes roads from parcel data to ensure that only quarter sections are selected ("RA NOT LIKE 'R'", nulls are not selected)
+    not_road = parcels["RA"].notna().values & (parcels["RA"].astype(str).values != "R")
+    parcels = parcels[not_road][[column for column in PARCEL_COLUMNS if column in parcels.columns] + [parcels.geometry.name]].reset_index(drop=True)
+
+    boxes = shapely.bounds(parcels.geometry.values)
+    rows = str_order(boxes, node_size)
+    tree = PackedRTree.build(boxes[rows], node_size)
+
+    # the description is removed first and written last, so an index that was not fully written is never used
+    for path in (description_path(out), tree_path(out), out):
+        if os.path.exists(path):
+            os.remove(path)
+    pyogrio.write_dataframe(parcels, out, layer=PARCEL_INDEX_LAYER)
+    arrays = dict((field, np.array(parcels[field].tolist(), dtype=str if field == "QS" else np.int64)) for field in KEY_FIELDS)
+    arrays.update(tree.arrays())
+    np.savez(tree_path(out), rows=rows, **arrays)
+    description = {"version": INDEX_VERSION, "quarter_sections": dataset_identity(quarter_sections), "parcels": len(parcels),
+                   "roads_removed": int((~not_road).sum()), "node_size": node_size}
+    with open(description_path(out), "w") as description_file:
+        json.dump(description, description_file, indent=1, sort_keys=True)
+    return description
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Build the province-wide index of parcels used by --parcel-index")
+    parser.add_argument("quarter_sections", help="quarter section boundaries, eg. ATS_V4_1.gdb/Quarter_Sections")
+    parser.add_argument("out", help="GeoPackage to write the index to")
+    parser.add_argument("--node-size", type=int, default=NODE_SIZE, help="children of every node of the tree (default: %d)" % NODE_SIZE)
+    args = parser.parse_args()
+    if not args.out.lower().endswith(".gpkg"):
+        parser.error("the index must be a .gpkg file")
+
+    started = time.time()
+    description = build_parcel_index(args.quarter_sections, args.out, args.node_size)
+    print("%d parcels (%d road rows removed) written to %s in %.1f s" % (description["parcels"], description["roads_removed"], args.out, time.time() - started))
@@ -0,0 +1,236 @@
+#-------------------------------------------------------------------------------
+# GeoParquet and Arrow datasets, with one row group per township
+#-------------------------------------------------------------------------------
+
+# The parcels, the intermediate data and the metrics can be written as columnar files instead of geodatabase or GeoPackage layers:
+#   .parquet   GeoParquet (compressed), for keeping and sharing results
+#   .arrow     Arrow IPC with the same layout, uncompressed, so it can be memory mapped and read without copying
+# Geometry is stored as WKB in a "geometry" column, with the GeoParquet "geo" metadata (encoding, geometry types, CRS and bounding box),
+# which GeoPandas, GDAL and DuckDB read as they are.
+
+# Features with MER, RGE and TWP fields (the parcels) are written sorted by township, with one row group (record batch in an .arrow
+# file) per township. The township and bounding box of every row group are kept in the "row_groups" metadata, so read_arrow and
+# read_frame only read the row groups of the townships or area asked for, and only the columns asked for. Other tables are written
+# in row groups of ROW_GROUP_ROWS rows.
+
+# With the open backend, a workspace that is a folder ending in .parquet or .arrow keeps every dataset in it in that format
+# (eg. output.parquet/ParcelsFinal.parquet), see open_backend.py. A geodatabase or GeoPackage layer can be converted with:
+#   python parquet_io.py workspace.gdb/ParcelsFinal ParcelsFinal.parquet [--check]
+# --check reads the file back and compares every value and geometry with the layer.
+
+import json
+import os
+
+import numpy as np
+
+COLUMNAR_EXTENSIONS = (".parquet", ".arrow")
+
+TOWNSHIP_FIELDS = ["MER", "RGE", "TWP"]
+ROW_GROUP_ROWS = 65536
+GEOMETRY_COLUMN = "geometry"
+ROW_GROUPS_KEY = b"row_groups"
+
+# GeoParquet names of the shapely geometry type ids
+GEOMETRY_TYPES = {0: "Point", 1: "LineString", 3: "Polygon", 4: "MultiPoint", 5: "MultiLineString", 6: "MultiPolygon", 7: "GeometryCollection"}
+
+
+def is_columnar_file(path):
+    return os.path.splitext(path)[1].lower() in COLUMNAR_EXTENSIONS
+
+
+# (start, stop, township) of the row groups of a frame, which must already be sorted by township when it has the township fields
+def row_groups(frame):
+    if not all(field in frame.columns for field in TOWNSHIP_FIELDS):
+        starts = list(range(0, len(frame), ROW_GROUP_ROWS)) or [0]
+        return [(start, min(start + ROW_GROUP_ROWS, len(frame)), None) for start in starts]
+    townships = np.column_stack([frame[field].values for field in TOWNSHIP_FIELDS])
+    changes = np.flatnonzero((townships[1:] != townships[:-1]).any(axis=1)) + 1
+    starts = np.concatenate([[0], changes]) if len(frame) else np.array([0])
+    stops = np.append(starts[1:], len(frame))
+    return [(int(start), int(stop), [value.item() for value in townships[start]] if stop > start else None) for start, stop in zip(starts, stops)]
+
+
+# The frame (a GeoDataFrame or a plain DataFrame for tables) as an Arrow table with WKB geometry, and the GeoParquet metadata
+def to_arrow(frame):
+    import geopandas
+    import pyarrow
+    import shapely
+    if not isinstance(frame, geopandas.GeoDataFrame):
+        return pyarrow.Table.from_pandas(frame, preserve_index=False), None
+    values = frame.geometry.values
+    wkb = pyarrow.array(shapely.to_wkb(values), type=pyarrow.binary())
+    attributes = frame.drop(columns=frame.geometry.name)
+    # a frame with no attribute columns would give a table with no rows
+    if len(attributes.columns):
+        table = pyarrow.Table.from_pandas(attributes, preserve_index=False).append_column(GEOMETRY_COLUMN, wkb)
+    else:
+        table = pyarrow.table({GEOMETRY_COLUMN: wkb})
+    types = sorted(set(shapely.get_type_id(values[~shapely.is_missing(values)]).tolist()))
+    geo = {"version": "1.0.0", "primary_column": GEOMETRY_COLUMN, "columns": {GEOMETRY_COLUMN: {
+        "encoding": "WKB",
+        "geometry_types": [GEOMETRY_TYPES[type_id] for type_id in types],
+        "crs": frame.crs.to_json_dict() if frame.crs is not None else None,
+        "bbox": [float(value) for value in frame.total_bounds] if len(frame) else [],
+    }}}
+    return table, geo
+
+
+# Write a GeoDataFrame (or a DataFrame) to a .parquet or .arrow file
+def write_frame(frame, path):
+    import pyarrow
+    import pyarrow.parquet as pq
+    import shapely
+    if all(field in frame.columns for field in TOWNSHIP_FIELDS):
+        frame = frame.sort_values(TOWNSHIP_FIELDS, kind="mergesort")
+    table, geo = to_arrow(frame)
+    groups = row_groups(frame)
+    bounds = shapely.bounds(frame.geometry.values) if geo else None
+    descriptions = []
+    for start, stop, township in groups:
+        group_bbox = None
+        if geo and stop > start:
+            group_bounds = bounds[start:stop]
+            group_bbox = [float(value) for value in (np.nanmin(group_bounds[:, 0]), np.nanmin(group_bounds[:, 1]), np.nanmax(group_bounds[:, 2]), np.nanmax(group_bounds[:, 3]))]
+        descriptions.append({"township": township, "bbox": group_bbox, "rows": stop - start})
+
+    metadata = dict(table.schema.metadata or {})
+    metadata[ROW_GROUPS_KEY] = json.dumps(descriptions).encode("utf-8")
+    if geo:
+        metadata[b"geo"] = json.dumps(geo).encode("utf-8")
+    table = table.replace_schema_metadata(metadata)
+
+    if os.path.exists(path):
+        os.remove(path)
+    if path.lower().endswith(".arrow"):
+        with pyarrow.ipc.new_file(path, table.schema) as writer:
+            for start, stop, _ in groups:
+                for batch in table.slice(start, stop - start).combine_chunks().to_batches(max_chunksize=max(stop - start, 1)):
+                    writer.write_batch(batch)
+    else:
+        with pq.ParquetWriter(path, table.schema) as writer:
+            for start, stop, _ in groups:
+                writer.write_table(table.slice(start, stop - start), row_group_size=max(stop - start, 1))
+
+
+# The schema metadata of a file, without reading its data
+def read_metadata(path):
+    import pyarrow
+    import pyarrow.parquet as pq
+    if path.lower().endswith(".arrow"):
+        with pyarrow.memory_map(path) as source:
+            return pyarrow.ipc.open_file(source).schema.metadata or {}
+    return pq.read_schema(path, memory_map=True).metadata or {}
+
+
+# The indices of the row groups of the given (MER, RGE, TWP) townships that overlap bbox (xmin, ymin, xmax, ymax), all of them by default
+def select_row_groups(descriptions, townships=None, bbox=None):
+    wanted = set(tuple(township) for township in townships) if townships is not None else None
+    selected = []
+    for position, description in enumerate(descriptions):
+        if wanted is not None and (description["township"] is None or tuple(description["township"]) not in wanted):
+            continue
+        if bbox is not None and description["bbox"] is not None:
+            xmin, ymin, xmax, ymax = description["bbox"]
+            if xmin > bbox[2] or xmax < bbox[0] or ymin > bbox[3] or ymax < bbox[1]:
+                continue
+        selected.append(position)
+    return selected
+
+
+# Read the columns (all by default, the geometry column is one of them) of the row groups of some townships or of an area, as an Arrow table.
+# .arrow files are memory mapped and their columns are not copied.
+def read_arrow(path, columns=None, townships=None, bbox=None):
+    import pyarrow
+    import pyarrow.parquet as pq
+    metadata = read_metadata(path)
+    descriptions = json.loads(metadata[ROW_GROUPS_KEY].decode("utf-8")) if ROW_GROUPS_KEY in metadata else None
+    groups = select_row_groups(descriptions, townships, bbox) if descriptions is not None and (townships is not None or bbox is not None) else None
+    if path.lower().endswith(".arrow"):
+        reader = pyarrow.ipc.open_file(pyarrow.memory_map(path))
+        batches = [reader.get_batch(position) for position in (range(reader.num_record_batches) if groups is None else groups)]
+        table = pyarrow.Table.from_batches(batches, schema=reader.schema)
+        return table.select(columns) if columns is not None else table
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    if groups is None:
+        return parquet_file.read(columns=columns)
+    return parquet_file.read_row_groups(groups, columns=columns)
+
+
+# The same as read_arrow, as a GeoDataFrame (or a DataFrame for tables and when the geometry column is not read)
+def read_frame(path, columns=None, townships=None, bbox=None):
+    import geopandas
+    import shapely
+    if columns is not None:
+        columns = list(columns) + ([GEOMETRY_COLUMN] if GEOMETRY_COLUMN not in columns else [])
+    table = read_arrow(path, columns, townships, bbox)
+    metadata = table.schema.metadata or {}
+    if b"geo" not in metadata or GEOMETRY_COLUMN not in table.column_names:
+        return table.to_pandas()
+    geo = json.loads(metadata[b"geo"].decode("utf-8"))["columns"][GEOMETRY_COLUMN]
+    geometry = shapely.from_wkb(table.column(GEOMETRY_COLUMN).to_numpy(zero_copy_only=False))
+    attributes = table.drop_columns([GEOMETRY_COLUMN]).to_pandas()
+    crs = json.dumps(geo["crs"]) if geo.get("crs") else None
+    return geopandas.GeoDataFrame(attributes, geometry=geometry, crs=crs)
+
+
+# Compare a frame with a file written from it: every row (matched by OBJECTID when there is one), value and geometry (by WKB).
+# Returns a list of the differences, empty when the file round trips exactly.
+def compare(frame, path):
+    import geopandas
+    import shapely
+    written = read_frame(path)
+    problems = []
+    if len(written) != len(frame):
+        return ["%d rows written, %d expected" % (len(written), len(frame))]
+    if "OBJECTID" in frame.columns:
+        frame = frame.sort_values("OBJECTID", kind="mergesort")
+        written = written.sort_values("OBJECTID", kind="mergesort")
+    elif all(field in frame.columns for field in TOWNSHIP_FIELDS):
+        frame = frame.sort_values(TOWNSHIP_FIELDS, kind="mergesort")
+    frame = frame.reset_index(drop=True)
+    written = written.reset_index(drop=True)
+    geometry_name = frame.geometry.name if isinstance(frame, geopandas.GeoDataFrame) else None
+    for column in frame.columns:
+        if column == geometry_name:
+            if list(shapely.to_wkb(frame.geometry.values)) != list(shapely.to_wkb(written.geometry.values)):
+                problems.append("geometries differ")
+            if (frame.crs is None) != (written.crs is None) or (frame.crs is not None and not frame.crs.equals(written.crs)):
+                problems.append("coordinate systems differ")
+        elif column not in written.columns:
+            problems.append("%s is missing" % column)
+        else:
+            expected, actual = frame[column], written[column]
+            same = (expected.isna() & actual.isna()) | (expected == actual)
+            if not bool(same.all()):
+                problems.append("%s differs in %d rows" % (column, int((~same).sum())))
+    return problems
+
+
+if __name__ == "__main__":
+    import argparse
+    import pyogrio
+    from open_backend import split_dataset_path
+
+    parser = argparse.ArgumentParser(description="Convert a geodatabase or GeoPackage layer to GeoParquet or Arrow, with one row group per township")
+    parser.add_argument("layer", help="eg. workspace.gdb/ParcelsFinal")
+    parser.add_argument("out", help=".parquet or .arrow file")
+    parser.add_argument("--check", action="store_true", help="read the file back and compare it with the layer")
+    args = parser.parse_args()
+    if not is_columnar_file(args.out):
+        parser.error("the output must be a .parquet or .arrow file")
+
+    source, layer = split_dataset_path(args.layer)
+    # the feature ids of a geodatabase are its OBJECTIDs
+    frame = pyogrio.read_dataframe(source, layer=layer, fid_as_index=True)
+    if "OBJECTID" not in frame.columns and source.lower().endswith(".gdb"):
+        frame.insert(0, "OBJECTID", frame.index.values.astype(np.int64))
+    frame = frame.reset_index(drop=True)
+    write_frame(frame, args.out)
+    print("%d rows written to %s" % (len(frame), args.out))
+    if args.check:
+        problems = compare(frame, args.out)
+        for problem in problems:
+            print("  " + problem)
+        print("round trip %s" % ("failed" if problems else "exact"))
+        if problems:
+            raise SystemExit(1)
@@ -0,0 +1,169 @@
+#-------------------------------------------------------------------------------
+# Province-wide index of intact patches, built once per human footprint release
+#-------------------------------------------------------------------------------
+
+# Every run of the patch size factor buffers the area of interest by PATCH_SEARCH_DISTANCE, clips the human footprint to it, erases the
+# footprint from the buffer and splits the result into single patches (Buffer, Clip, Erase, Multipart To Singlepart), which is most of the
+# geoprocessing time of a run, and is the same work for every area of interest in the same part of the province. Patches that reach the
+# edge of the buffer are also cut short there.
+#
+# build_patch_index does that work once, for a whole region (eg. the province boundary), and writes the patches to a GeoPackage layer
+# (Intact_Patches, which has a spatial index). Every patch has its true area in PATCH_AREA, however far it extends. A run given the index
+# (patch_index, or --patch-index in the main script) only reads the patches around its parcels and tabulates the largest PATCH_AREA
+# intersecting each parcel, with none of the four steps above.
+#
+# The region is processed in square tiles of tile_size meters, so only the footprint of one tile is read and erased at a time. A patch
+# crossing tile edges is made of one piece per tile: pieces of neighbouring tiles that share a stretch of tile edge are joined into one
+# patch (pieces that only meet at a corner point are separate patches, as Multipart To Singlepart leaves them), and every piece of a
+# patch carries its PATCH_ID and the PATCH_AREA of the whole patch. The pieces are never dissolved, so no province-sized polygon is built.
+#
+# The index is versioned by the footprint it was built from: a JSON file next to it records the identity of the footprint (path,
+# modification time and size, see cache.dataset_identity) and an optional release name. A run whose footprint is not that one stops
+# with an error instead of ranking with out of date patches, and the index is then rebuilt for the new release:
+#   python patch_index.py HFI2021.gdb/o01_Human_Footprint province.gpkg patches_2021.gpkg --release 2021
+# Building needs the open backend libraries (Shapely, GeoPandas and pyogrio), the index can then be used with either backend.
+
+import json
+import os
+
+import numpy as np
+
+from backends import PROJECTED_CRS_EPSG
+
+# Change this whenever the layout of the index changes, so older indexes are not used
+INDEX_VERSION = 1
+
+PATCH_INDEX_LAYER = "Intact_Patches"
+PATCH_AREA_FIELD = "PATCH_AREA"
+
+# Side (meters) of the tiles the region is built in
+DEFAULT_TILE_SIZE = 20000
+
+
+# The JSON file describing an index
+def description_path(patch_index):
+    return os.path.splitext(patch_index)[0] + ".json"
+
+
+# The stored description of an index, or None when there is no index there
+def read_description(patch_index):
+    path = description_path(patch_index)
+    if not os.path.exists(path) or not os.path.exists(patch_index):
+        return None
+    with open(path) as description_file:
+        return json.load(description_file)
+
+
+# The patch layer of an index, after checking it was built from this human footprint
+def check_patch_index(backend, patch_index, footprint):
+    from cache import dataset_identity
+    description = read_description(patch_index)
+    if description is None or description.get("version") != INDEX_VERSION:
+        raise ValueError("%s is not a patch index of this version, build it with patch_index.py" % patch_index)
+    if description["footprint"] != dataset_identity(backend.full_path(footprint)):
+        raise ValueError("the patch index %s was built from another human footprint (%s, release %s), rebuild it with patch_index.py"
+                         % (patch_index, description["footprint"][0], description.get("release")))
+    return backend.dataset_path(patch_index, PATCH_INDEX_LAYER)
+
+
+# (row, column, box) of the tiles of tile_size meters covering bounds
+def tile_grid(bounds, tile_size):
+    import shapely
+    xmin, ymin, xmax, ymax = bounds
+    columns = max(int(np.ceil((xmax - xmin) / tile_size)), 1)
+    rows = max(int(np.ceil((ymax - ymin) / tile_size)), 1)
+    for row in range(rows):
+        for column in range(columns):
+            left, bottom = xmin + column * tile_size, ymin + row * tile_size
+            yield row, column, shapely.box(left, bottom, left + tile_size, bottom + tile_size)
+
+
+# The intact pieces of one tile: its part of the region with the footprint erased, as single polygons
+def tile_pieces(region, tile, footprint):
+    import shapely
+    area = tile if region.contains(tile) else shapely.intersection(region, tile)
+    if len(footprint):
+        # the footprint is cut to the tile before it is unioned, so features crossing many tiles are only unioned once each
+        area = shapely.difference(area, shapely.union_all(shapely.intersection(footprint, tile)))
+    parts = shapely.get_parts(area)
+    return parts[(shapely.get_type_id(parts) == 3) & (shapely.area(parts) > 0)]
+
+
+# Label the pieces of the tiles with the patches they are part of: pieces of different tiles that share part of a tile edge are in the
+# same patch. Only pieces that reach the edges of their tile can share one. Returns the patch of every piece, from 0.
+def stitch(pieces, tile_IDs, tile_bounds):
+    import shapely
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    bounds = shapely.bounds(pieces)
+    on_edge = np.flatnonzero((bounds == tile_bounds).any(axis=1))
+    edge_pieces = pieces[on_edge]
+    first, second = shapely.STRtree(edge_pieces).query(edge_pieces, predicate="intersects")
+    crossing = (first < second) & (tile_IDs[on_edge[first]] != tile_IDs[on_edge[second]])
+    first, second = on_edge[first[crossing]], on_edge[second[crossing]]
+    shared = shapely.length(shapely.intersection(pieces[first], pieces[second])) > 0
+    first, second = first[shared], second[shared]
+    graph = coo_matrix((np.ones(len(first)), (first, second)), shape=(len(pieces), len(pieces)))
+    return connected_components(graph, directed=False)[1]
+
+
+# Build the index of the intact patches of the region covered by the boundary dataset (eg. the province), with the human footprint
+# erased, and write it to out (a GeoPackage). release is a name for the footprint release, kept in the description of the index.
+def build_patch_index(footprint, boundary, out, tile_size=DEFAULT_TILE_SIZE, release=None):
+    import geopandas
+    import pyogrio
+    import shapely
+    from cache import dataset_identity
+    from open_backend import OpenBackend
+
+    reader = OpenBackend(out, write_intermediates=False)
+    region = shapely.union_all(reader.read(boundary).geometry.values)
+    shapely.prepare(region)
+    pieces, tile_IDs, tile_bounds = [], [], []
+    for row, column, tile in tile_grid(region.bounds, tile_size):
+        if not region.intersects(tile):
+            continue
+        tile_footprint = np.array(reader.read_window(footprint, tile.bounds, []).geometry.values, dtype=object)
+        parts = tile_pieces(region, tile, tile_footprint)
+        pieces.append(parts)
+        tile_IDs.append(np.full(len(parts), len(tile_bounds)))
+        tile_bounds.append(np.tile(tile.bounds, (len(parts), 1)))
+    pieces = np.concatenate(pieces) if pieces else np.zeros(0, dtype=object)
+    tile_IDs = np.concatenate(tile_IDs) if tile_IDs else np.zeros(0, dtype=np.intp)
+    tile_bounds = np.concatenate(tile_bounds) if tile_bounds else np.zeros((0, 4))
+
+    patches = stitch(pieces, tile_IDs, tile_bounds) if len(pieces) else np.zeros(0, dtype=np.intp)
+    patch_areas = np.bincount(patches, weights=shapely.area(pieces), minlength=patches.max() + 1 if len(patches) else 0)
+    frame = geopandas.GeoDataFrame({"PATCH_ID": (patches + 1).astype(np.int64), PATCH_AREA_FIELD: patch_areas[patches]},
+                                   geometry=pieces, crs="EPSG:%d" % PROJECTED_CRS_EPSG)
+
+    # the description is removed first and written last, so an index that was not fully written is never used
+    if os.path.exists(description_path(out)):
+        os.remove(description_path(out))
+    if os.path.exists(out):
+        os.remove(out)
+    pyogrio.write_dataframe(frame, out, layer=PATCH_INDEX_LAYER)
+    description = {"version": INDEX_VERSION, "footprint": dataset_identity(footprint), "release": release, "boundary": os.path.abspath(boundary),
+                   "tile_size": tile_size, "patches": len(patch_areas), "pieces": len(pieces)}
+    with open(description_path(out), "w") as description_file:
+        json.dump(description, description_file, indent=1, sort_keys=True)
+    return description
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Build the province-wide index of intact patches used by --patch-index")
+    parser.add_argument("footprint", help="human footprint, eg. HFI2021.gdb/o01_Human_Footprint")
+    parser.add_argument("boundary", help="polygons of the region to index, eg. the province boundary")
+    parser.add_argument("out", help="GeoPackage to write the index to")
+    parser.add_argument("--tile-size", type=float, default=DEFAULT_TILE_SIZE, help="side of the tiles built at once, in meters (default: %d)" % DEFAULT_TILE_SIZE)
+    parser.add_argument("--release", default=None, help="name of the footprint release, kept with the index")
+    args = parser.parse_args()
+    if not args.out.lower().endswith(".gpkg"):
+        parser.error("the index must be a .gpkg file")
+
+    started = time.time()
+    description = build_patch_index(args.footprint, args.boundary, args.out, args.tile_size, args.release)
+    print("%d patches (%d pieces) written to %s in %.1f s" % (description["patches"], description["pieces"], args.out, time.time() - started))
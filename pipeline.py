@@ -0,0 +1,366 @@
+#-------------------------------------------------------------------------------
+# Per-parcel metrics: the geoprocessing half of the ranking
+#-------------------------------------------------------------------------------
+
+# This module holds the geoprocessing that was exported from ArcMap's Model builder. It determines the spatial relationships between the parcels
+# and the user provided data (Human footprint, Lotic(Riparian), Wetlands, Patch Size, and Proximity), and reads the resulting tables into
+# per-parcel metric columns. Every step goes through a geoprocessing backend (see backends.py).
+
+# Intactness and patch size can also be computed on a grid instead of with vector overlays (engine="raster", see raster.py).
+
+# Each factor is its own function, so the factors can be run for a subset of the parcels (see tiling.py). Intermediate datasets keep their
+# original names, with a suffix added when more than one set of them is written to the same workspace.
+
+# Extra factors registered for a run (see factors.py) are measured with the built in ones: their layers are tabulated in the same overlay.
+
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from factors import registered_factors
+from grouped_reduction import grouped_max
+from proximity import DEFAULT_SEARCH_RADIUS
+from raster import DEFAULT_CELL_SIZE, intact_area, largest_patch_area
+from table_io import ColumnStore
+
+# The user provided input datasets, named as in main()
+Inputs = namedtuple("Inputs", ["areaOfInterest", "albertaloticRiparian", "albertaMergedWetlandInventory", "quarterSectionBoundaries", "parksProtectedAreasAlberta", "humanFootprint"])
+
+# The metric fields added to the parcels, in the order they are added
+METRIC_FIELDS = ["Area_Intact", "Percent_Intact", "Area_Lotic", "Percent_Lotic", "Wetland_Edge", "Largest_Patch_Area", "Dist_to_Protected"]
+
+# Intact patches are measured within this distance (meters) of the parcels, so patches extending outside the area of interest are not cut short at its edge
+PATCH_SEARCH_DISTANCE = 50000
+
+SQUARE_METERS_PER_ACRE = 4046.86
+
+# How intactness and patch size are computed: by vector overlay (Erase), or on a grid of cell_size meters (see raster.py)
+ENGINES = ["vector", "raster"]
+
+
+# Check the engine settings of the intactness and patch size steps. The footprint can only be buffered on a grid.
+def check_engine(engine, footprint_buffer):
+    if engine not in ENGINES:
+        raise ValueError("unknown engine %r, expected one of %s" % (engine, ", ".join(ENGINES)))
+    if footprint_buffer and engine != "raster":
+        raise ValueError("the human footprint can only be buffered with the raster engine")
+
+
+# Intactness: the area and percent of each parcel not covered by human footprint.
+# With engine="raster" the footprint (buffered by footprint_buffer meters) is rasterized instead, and no intermediate datasets are written.
+# With tabulate=False the vector factors stop before tabulating their layer against the parcels and return {}, so compute_metrics can
+# tabulate the layers of several factors in one overlay (see overlay_metrics). This is the same for wetland_edge, lotic and largest_patch.
+def intactness(backend, parcels, parcel_IDs, inputs, suffix="", engine="vector", cell_size=DEFAULT_CELL_SIZE, footprint_buffer=0, tabulate=True):
+    check_engine(engine, footprint_buffer)
+    if engine == "raster":
+        area, percent = intact_area(backend, parcels, parcel_IDs, inputs.humanFootprint, cell_size, footprint_buffer)
+        return {"Area_Intact": area, "Percent_Intact": percent}
+
+    # local Variables:
+    footprint_EXTENT_CLIPPED = "Footprint_Extent_Clipped" + suffix
+    Footprint_Inverse = "Footprint_Inverse" + suffix
+
+    # Process: Clip
+    backend.clip(inputs.humanFootprint, parcels, footprint_EXTENT_CLIPPED)
+
+    # Process: Erase
+    backend.erase(parcels, footprint_EXTENT_CLIPPED, Footprint_Inverse)
+
+    # Process: Tabulate Intersection (Intact_Area_Per_Parcel)
+    if not tabulate:
+        return {}
+    return overlay_metrics(backend, parcels, parcel_IDs, ["intactness"], suffix)
+
+
+# Wetlands: the length of wetland edge within each parcel. Also leaves the clipped wetlands (Wetland_Extent_Clipped) for the lotic step.
+def wetland_edge(backend, parcels, parcel_IDs, inputs, suffix="", tabulate=True):
+    # local Variables:
+    Wetland_Extent_Clipped = "Wetland_Extent_Clipped" + suffix
+    Wetland_Lines = "Wetland_Lines" + suffix
+
+    # Process: Clip (3)
+    backend.clip(inputs.albertaMergedWetlandInventory, parcels, Wetland_Extent_Clipped)
+
+    # Process: Feature To Line
+    backend.feature_to_line(Wetland_Extent_Clipped, Wetland_Lines)
+
+    # Process: Tabulate Intersection (2) (Wetland_Edge_Per_Parcel)
+    if not tabulate:
+        return {}
+    return overlay_metrics(backend, parcels, parcel_IDs, ["wetland_edge"], suffix)
+
+
+# Lotic: the area and percent of each parcel covered by riparian (lotic) areas that are not wetlands. Needs wetland_edge to have run first,
+# wetland_clipped is its Wetland_Extent_Clipped output when that was written somewhere else (eg. another worker's scratch workspace).
+def lotic(backend, parcels, parcel_IDs, inputs, suffix="", wetland_clipped=None, tabulate=True):
+    # local Variables:
+    Wetland_Extent_Clipped = wetland_clipped or "Wetland_Extent_Clipped" + suffix
+    Lotic_Extent_Clipped = "Lotic_Extent_Clipped" + suffix
+    Lotic_No_Wetlands = "Lotic_No_Wetlands" + suffix
+
+    # Process: Clip (4)
+    backend.clip(inputs.albertaloticRiparian, parcels, Lotic_Extent_Clipped)
+
+    # Process: Erase (2)
+    backend.erase(Lotic_Extent_Clipped, Wetland_Extent_Clipped, Lotic_No_Wetlands)
+
+    # Process: Tabulate Intersection (3) (Lotic_Area_Per_Parcel)
+    if not tabulate:
+        return {}
+    return overlay_metrics(backend, parcels, parcel_IDs, ["lotic"], suffix)
+
+
+# Patch size: the largest intact patch (in acres) that intersects each parcel. Patches are found within PATCH_SEARCH_DISTANCE of patch_extent
+# (the area of interest, or the parcels themselves when they are processed in tiles). engine, cell_size and footprint_buffer are as for intactness,
+# the raster engine only writes the buffered area of interest.
+# With patch_index (a GeoPackage built by patch_index.py), the patches are looked up in that province-wide index instead, with their true
+# areas, and only the patch table is written. The engine settings are then not used, and the footprint can not be buffered.
+def largest_patch(backend, parcels, parcel_IDs, inputs, suffix="", patch_extent=None, engine="vector", cell_size=DEFAULT_CELL_SIZE, footprint_buffer=0, patch_index=None, tabulate=True):
+    check_engine(engine, footprint_buffer)
+
+    # local Variables:
+    Area_Of_Interest_Buffered = "Area_Of_Interest_Buffered" + suffix
+    Footprint_Larger_Extent = "Footprint_Larger_Extent" + suffix
+    Footprint_INVERSE_Large = "Footprint_INVERSE_Large" + suffix
+    Footprint_INVERSE_Large_Explode = "Footprint_INVERSE_Large_Explode" + suffix
+    Patch_Sizes_Per_Parcel = "Patch_Sizes_Per_Parcel" + suffix
+
+    if patch_index:
+        from patch_index import check_patch_index
+        if footprint_buffer:
+            raise ValueError("the patch index is built from the human footprint as it is, it can not be used with footprint_buffer")
+        # Process: Tabulate Intersection (Patch_Sizes_Per_Parcel) with the indexed patches around the parcels
+        patches = check_patch_index(backend, patch_index, inputs.humanFootprint)
+        result = backend.overlay(parcels, "OBJECTID", parcel_IDs, [(patches, "max_patch_area", Patch_Sizes_Per_Parcel)])[0]
+        return {"Largest_Patch_Area": result["MAX_AREA"] / SQUARE_METERS_PER_ACRE}
+
+    # Process: Buffer (the parcels of a tile are dissolved into one buffer)
+    if patch_extent:
+        backend.buffer(patch_extent, Area_Of_Interest_Buffered, PATCH_SEARCH_DISTANCE, dissolve=True)
+    else:
+        backend.buffer(inputs.areaOfInterest, Area_Of_Interest_Buffered, PATCH_SEARCH_DISTANCE)
+
+    if engine == "raster":
+        area = largest_patch_area(backend, parcels, parcel_IDs, inputs.humanFootprint, Area_Of_Interest_Buffered, cell_size, footprint_buffer)
+        return {"Largest_Patch_Area": area / SQUARE_METERS_PER_ACRE}
+
+    # Process: Clip (2)
+    backend.clip(inputs.humanFootprint, Area_Of_Interest_Buffered, Footprint_Larger_Extent)
+
+    # Process: Erase (3)
+    backend.erase(Area_Of_Interest_Buffered, Footprint_Larger_Extent, Footprint_INVERSE_Large)
+
+    # Process: Multipart To Singlepart
+    backend.explode(Footprint_INVERSE_Large, Footprint_INVERSE_Large_Explode)
+
+    # Process: Tabulate Intersection (Patch_Sizes_Per_Parcel)
+    if not tabulate:
+        return {}
+    return overlay_metrics(backend, parcels, parcel_IDs, ["largest_patch"], suffix)
+
+
+# Proximity: the distance from each parcel to the nearest protected area, calculated into a separate table so the parcels are not changed.
+# Protected areas are only searched for within search_radius meters (see proximity.py), parcels with none that close get a null distance,
+# which scores the same as any distance beyond the last proximity threshold. search_radius must not be less than that threshold.
+def proximity(backend, parcels, parcel_IDs, inputs, suffix="", search_radius=DEFAULT_SEARCH_RADIUS):
+    # Local Variables
+    Near_Protected_Table = "Near_Protected_Table" + suffix
+
+    # Process: Generate Near Table
+    return {"Dist_to_Protected": near_distance(backend, parcels, parcel_IDs, inputs.parksProtectedAreasAlberta, Near_Protected_Table, search_radius)}
+
+
+# The distance from each parcel to the nearest of near_features within search_radius, null when there is none that close
+def near_distance(backend, parcels, parcel_IDs, near_features, table, search_radius):
+    backend.near_table(parcels, near_features, table, search_radius)
+
+    # IN_FID is the parcel OBJECTID, parcels that are not in the table had no feature within the search radius
+    near = backend.read_table(table, ["IN_FID", "NEAR_DIST"])
+    distance = grouped_max(near["IN_FID"], near["NEAR_DIST"], parcel_IDs, fill=np.inf)
+    distance[np.isinf(distance)] = np.nan
+    return distance
+
+
+# The factors as the nodes of a dependency graph: node -> (factor function, nodes it depends on). Lotic needs the wetlands clipped by wetland_edge.
+FACTOR_NODES = OrderedDict([
+    ("intactness", (intactness, [])),
+    ("wetland_edge", (wetland_edge, [])),
+    ("lotic", (lotic, ["wetland_edge"])),
+    ("largest_patch", (largest_patch, [])),
+    ("proximity", (proximity, [])),
+])
+
+# Datasets a node reads from its upstream nodes: node -> {factor function argument: (upstream node, dataset name)}
+UPSTREAM_DATASETS = {
+    "lotic": {"wetland_clipped": ("wetland_edge", "Wetland_Extent_Clipped")},
+}
+
+# The intermediate datasets each node writes (before the suffix is added), the raster engine writes fewer of them
+FACTOR_DATASETS = OrderedDict([
+    ("intactness", ["Footprint_Extent_Clipped", "Footprint_Inverse", "Intact_Area_Per_Parcel"]),
+    ("wetland_edge", ["Wetland_Extent_Clipped", "Wetland_Lines", "Wetland_Edge_Per_Parcel"]),
+    ("lotic", ["Lotic_Extent_Clipped", "Lotic_No_Wetlands", "Lotic_Area_Per_Parcel"]),
+    ("largest_patch", ["Area_Of_Interest_Buffered", "Footprint_Larger_Extent", "Footprint_INVERSE_Large", "Footprint_INVERSE_Large_Explode", "Patch_Sizes_Per_Parcel"]),
+    ("proximity", ["Near_Protected_Table"]),
+])
+
+# The Tabulate Intersection each vector node ends with: node -> (layer, overlay measure, table written, {metric field: (overlay field, scale)}).
+# See overlay.py for the measures. The patch table has the areas of all intact patches that intersect each parcel, the largest of them is
+# converted to acres for scoring. The Area and Percent coverage fields are given more descriptive names, so there are no confusing duplicate
+# field names in our ParcelsFinal feature class.
+NODE_OVERLAYS = OrderedDict([
+    ("intactness", ("Footprint_Inverse", "area", "Intact_Area_Per_Parcel", {"Area_Intact": ("AREA", 1), "Percent_Intact": ("PERCENTAGE", 1)})),
+    ("wetland_edge", ("Wetland_Lines", "length", "Wetland_Edge_Per_Parcel", {"Wetland_Edge": ("LENGTH", 1)})),
+    ("lotic", ("Lotic_No_Wetlands", "area", "Lotic_Area_Per_Parcel", {"Area_Lotic": ("AREA", 1), "Percent_Lotic": ("PERCENTAGE", 1)})),
+    ("largest_patch", ("Footprint_INVERSE_Large_Explode", "max_area", "Patch_Sizes_Per_Parcel", {"Largest_Patch_Area": ("MAX_AREA", 1 / SQUARE_METERS_PER_ACRE)})),
+])
+
+# The metric fields each node computes
+FACTOR_FIELDS = OrderedDict([
+    ("intactness", ["Area_Intact", "Percent_Intact"]),
+    ("wetland_edge", ["Wetland_Edge"]),
+    ("lotic", ["Area_Lotic", "Percent_Lotic"]),
+    ("largest_patch", ["Largest_Patch_Area"]),
+    ("proximity", ["Dist_to_Protected"]),
+])
+
+# The user inputs (Inputs fields) each node reads, directly or through its upstream nodes
+FACTOR_INPUTS = {
+    "intactness": ["humanFootprint"],
+    "wetland_edge": ["albertaMergedWetlandInventory"],
+    "lotic": ["albertaloticRiparian", "albertaMergedWetlandInventory"],
+    "largest_patch": ["humanFootprint"],
+    "proximity": ["parksProtectedAreasAlberta"],
+}
+
+
+# Settings of the factor functions that can be changed for a run: node -> {argument: default}
+FACTOR_PARAMETERS = {
+    "intactness": {"engine": "vector", "cell_size": DEFAULT_CELL_SIZE, "footprint_buffer": 0},
+    "largest_patch": {"engine": "vector", "cell_size": DEFAULT_CELL_SIZE, "footprint_buffer": 0, "patch_index": None},
+    "proximity": {"search_radius": DEFAULT_SEARCH_RADIUS},
+}
+
+
+# The settings of every node, with the values given in parameters (node -> {argument: value}) replacing the defaults
+def factor_parameters(parameters=None):
+    merged = dict((node, dict(FACTOR_PARAMETERS.get(node, {}))) for node in FACTOR_NODES)
+    for node, values in (parameters or {}).items():
+        if node not in FACTOR_NODES:
+            raise ValueError("unknown factor %r, expected one of %s" % (node, ", ".join(FACTOR_NODES)))
+        for argument in values:
+            if argument not in merged[node]:
+                raise ValueError("%s has no setting %r" % (node, argument))
+        merged[node].update(values)
+    return merged
+
+
+# The intactness and patch size settings for an engine (see ENGINES), as parameters for compute_metrics
+def engine_parameters(engine="vector", cell_size=None, footprint_buffer=None):
+    check_engine(engine, footprint_buffer)
+    values = {"engine": engine}
+    if cell_size:
+        values["cell_size"] = cell_size
+    if footprint_buffer:
+        values["footprint_buffer"] = footprint_buffer
+    return {"intactness": dict(values), "largest_patch": dict(values)}
+
+
+# Tabulate the layers of the given vector nodes (see NODE_OVERLAYS) and of the extra factors measured by overlay against the parcels
+# in one overlay, and return their metrics
+def overlay_metrics(backend, parcels, parcel_IDs, nodes, suffix="", factors=()):
+    overlaid = [factor for factor in factors if factor.measure]
+    layers = [(NODE_OVERLAYS[node][0] + suffix, NODE_OVERLAYS[node][1], NODE_OVERLAYS[node][2] + suffix) for node in nodes]
+    layers += [(factor.layer, factor.measure, factor.table + suffix) for factor in overlaid]
+    results = backend.overlay(parcels, "OBJECTID", parcel_IDs, layers)
+    metrics = {}
+    for node, result in zip(nodes, results):
+        for field, (overlay_field, scale) in NODE_OVERLAYS[node][3].items():
+            metrics[field] = result[overlay_field] * scale
+    for factor, result in zip(overlaid, results[len(nodes):]):
+        metrics[factor.metric_field] = result[factor.overlay_field]
+    return metrics
+
+
+# The metrics of the extra factors measured by distance, one near table each
+def distance_metrics(backend, parcels, parcel_IDs, factors, suffix=""):
+    metrics = {}
+    for factor in factors:
+        if not factor.measure:
+            with backend.stage("factor " + factor.name + suffix, parcels=len(parcel_IDs)):
+                metrics[factor.metric_field] = near_distance(backend, parcels, parcel_IDs, factor.layer, factor.table + suffix, factor.search_radius)
+    return metrics
+
+
+# The metrics of the extra factors on their own, for the runs that do not use compute_metrics (see scheduler.py and incremental.py)
+def extra_metrics(backend, parcels, parcel_IDs, factors, suffix=""):
+    metrics = {}
+    if any(factor.measure for factor in factors):
+        with backend.stage("overlay extra factors" + suffix, parcels=len(parcel_IDs)):
+            metrics.update(overlay_metrics(backend, parcels, parcel_IDs, [], suffix, factors))
+    metrics.update(distance_metrics(backend, parcels, parcel_IDs, factors, suffix))
+    return metrics
+
+
+# The metric fields of the parcels, with those of the extra factors (the registered ones by default) after METRIC_FIELDS
+def metric_fields(factors=None):
+    return METRIC_FIELDS + [factor.metric_field for factor in (registered_factors() if factors is None else factors)]
+
+
+# The intermediate datasets written for one set of parcels, so they can be deleted afterwards
+def intermediate_names(suffix="", factors=None):
+    return [name + suffix for names in FACTOR_DATASETS.values() for name in names] + [factor.table + suffix for factor in (registered_factors() if factors is None else factors)]
+
+
+# Run every factor for the parcels in the parcels dataset and return their metrics as a ColumnStore keyed by OBJECTID.
+# NOTE: not all of the parcels necessarily intersect with each table, those parcels receive a zero.
+# With a cache (see cache.py), factors whose inputs have not changed since an earlier run are read from the cache instead of being geoprocessed.
+# The vector factors leave their last step, tabulating a layer against the parcels, to one overlay of all of their layers at the end (see overlay.py).
+# parameters changes the settings of the factors (see FACTOR_PARAMETERS), eg. {"proximity": {"search_radius": 5000}}
+# factors are the extra factors to measure (see factors.py), the registered ones by default. They are not cached.
+def compute_metrics(backend, parcels, inputs, suffix="", patch_extent=None, cache=None, parameters=None, factors=None):
+    parcel_IDs = backend.read_table(parcels, "OBJECTID")["OBJECTID"]
+    parameters = factor_parameters(parameters)
+    factors = registered_factors() if factors is None else factors
+    keys = cache.factor_keys(backend, parcels, inputs, suffix, patch_extent, parameters) if cache else {}
+
+    metrics = {}
+    # where the datasets of cached nodes are, for the nodes downstream of them
+    locations = {}
+    # nodes whose layers are waiting for the overlay
+    pending = []
+    for node, (function, dependencies) in FACTOR_NODES.items():
+        with backend.stage("factor " + node + suffix, parcels=len(parcel_IDs)) as stage:
+            cached = cache.load(keys[node], parcel_IDs) if cache else None
+            stage.set(cached=bool(cached))
+            if cached:
+                columns, workspace = cached
+                for name in FACTOR_DATASETS[node]:
+                    locations[name] = backend.dataset_path(workspace, name + suffix)
+            else:
+                arguments = dict((argument, locations[dataset]) for argument, (upstream, dataset) in UPSTREAM_DATASETS.get(node, {}).items() if dataset in locations)
+                if node == "largest_patch":
+                    arguments["patch_extent"] = patch_extent
+                if node in NODE_OVERLAYS:
+                    arguments["tabulate"] = False
+                arguments.update(parameters[node])
+                columns = function(backend, parcels, parcel_IDs, inputs, suffix, **arguments)
+                if not columns:
+                    pending.append(node)
+                elif cache:
+                    cache.store(keys[node], backend, [name + suffix for name in FACTOR_DATASETS[node]], parcel_IDs, columns)
+        metrics.update(columns)
+
+    overlaid = [factor for factor in factors if factor.measure]
+    if pending or overlaid:
+        with backend.stage("overlay" + suffix, parcels=len(parcel_IDs), layers=len(pending) + len(overlaid)):
+            metrics.update(overlay_metrics(backend, parcels, parcel_IDs, pending, suffix, overlaid))
+        if cache:
+            for node in pending:
+                cache.store(keys[node], backend, [name + suffix for name in FACTOR_DATASETS[node]], parcel_IDs, dict((field, metrics[field]) for field in FACTOR_FIELDS[node]))
+    metrics.update(distance_metrics(backend, parcels, parcel_IDs, factors, suffix))
+
+    columns = ColumnStore(parcel_IDs)
+    for field in metric_fields(factors):
+        columns[field] = metrics[field]
+    return columns
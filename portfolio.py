@@ -0,0 +1,340 @@
+#-------------------------------------------------------------------------------
+# Script Name: Conservation Parcel Portfolio
+#-------------------------------------------------------------------------------
+
+# PRIORITY_RANKING puts every parcel in a class, but an acquisition has a budget: this script picks the set of parcels (the portfolio)
+# with the largest total score whose total cost is within the budget, from the scores of a run, without any geoprocessing, eg.
+#   python portfolio.py C:/data/stettler.gdb/ParcelsFinal --budget 5000
+#   python portfolio.py metrics.parquet --parcels C:/data/stettler.gdb/ParcelsFinal --cost LAND_VALUE --budget 2000000 --adjacency-bonus 0.5 --exact
+# The value of a parcel is its PRIORITY_SCORE, or the weighted sum of its factor scores when weights are given (--weight Lotic=2, as in
+# rescore.py). Its cost is a field of the parcels (eg. a land value joined to them), or by default its area in acres.
+#
+# Parcels that share an edge (not only a corner) are adjacent. With an adjacency bonus, every pair of adjacent parcels in the portfolio adds
+# the bonus to its value, so blocks of parcels are favoured over scattered ones of the same score.
+#
+# Two solvers:
+#   greedy   (the default) takes the parcels in order of value per unit of cost, as long as they fit in the budget, in a few vectorized
+#            passes. With an adjacency bonus, the parcels are taken again in order of their value plus the bonus of their neighbours in the
+#            last portfolio, until the portfolio stops improving. Solves 10^5 parcels in well under a second.
+#   exact    (--exact) solves the integer program with the HiGHS solver bundled with SciPy (scipy.optimize.milp): one binary variable per
+#            parcel, one per pair of adjacent parcels (which can only be 1 when both parcels are), and the budget constraint. Parcels whose
+#            value per cost is far enough from that of the budget's last parcel are fixed in or out of the portfolio first, using the bound
+#            and the greedy portfolio (reduced cost fixing, which never excludes a better portfolio), so the solver only gets the parcels near
+#            the margin. It stops at --time-limit seconds with the best portfolio found (the greedy one if it found none).
+#            With an adjacency bonus the bound is too loose to fix parcels (every parcel is given half the bonus of all its neighbours), and
+#            parcels tied with the margin (eg. quarter sections of the same area and score) can not be fixed either. When more than
+#            MAX_SOLVER_PARCELS parcels are left this is NOT exact: the solver only gets the parcels nearest the margin, the others are
+#            fixed as the bound takes them, and the portfolio (method "restricted") is often no better than the greedy one.
+# Both report the solve time and the optimality gap: how far the value of the portfolio can be below the best possible one. For the greedy
+# solver the gap is measured against the fractional knapsack bound (the value if parcels could be bought in part, with half the bonus of
+# each pair given to each of its parcels), for the exact solver it is the gap HiGHS proves.
+#
+# The portfolio is written to the parcels as PORTFOLIO (1 for parcels in it, 0 for the others), or to the --out table.
+
+import argparse
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from backends import BACKENDS
+from pipeline import SQUARE_METERS_PER_ACRE
+from table_io import ColumnStore
+
+# The parcels picked (a boolean array), with the total value and cost, an upper bound of the best value, the optimality gap
+# ((bound - value) / bound) and the time taken to solve
+Portfolio = namedtuple("Portfolio", ["selected", "value", "cost", "bound", "gap", "seconds", "method"])
+
+DEFAULT_TIME_LIMIT = 60
+# Most parcels the exact solver is given, past that it takes minutes (and does not stop at its time limit)
+MAX_SOLVER_PARCELS = 2000
+
+
+# The value of every parcel: PRIORITY_SCORE, or the sum of the factor scores with the given weights (factor -> weight, 1 for those not given)
+def parcel_values(columns, weights=None, factors=None):
+    from scoring import default_scoring, scored_factors
+    if not weights:
+        return np.nan_to_num(np.asarray(columns["PRIORITY_SCORE"], dtype=float))
+    named = scored_factors(factors)
+    unknown = [factor for factor in weights if factor not in named]
+    if unknown:
+        raise ValueError("unknown factors %s, expected %s" % (", ".join(unknown), ", ".join(named)))
+    chosen = default_scoring(factors)[1]
+    chosen.update(weights)
+    # added up factor by factor, in the order score_parcels adds them
+    value = 0
+    for factor, (_, score_field) in named.items():
+        value = value + chosen[factor] * np.nan_to_num(np.asarray(columns[score_field], dtype=float))
+    return value
+
+
+# The pairs (first < second) of parcels that share an edge: their interiors do not overlap and their boundaries meet along a line
+def shared_edges(geometries):
+    import shapely
+    geometries = np.array(geometries, dtype=object)
+    first, second = shapely.STRtree(geometries).query(geometries, predicate="touches")
+    ordered = first < second
+    first, second = first[ordered], second[ordered]
+    along_line = shapely.relate_pattern(geometries[first], geometries[second], "F***1****")
+    return first[along_line], second[along_line]
+
+
+# The total value of a portfolio, with the bonus of every pair of adjacent parcels in it
+def portfolio_value(selected, values, edges=None, bonus=0):
+    value = values[selected].sum()
+    if edges is not None and bonus:
+        value += bonus * np.count_nonzero(selected[edges[0]] & selected[edges[1]])
+    return float(value)
+
+
+# The fractional knapsack bound: the value of the parcels in order of value per cost up to the budget, with a part of the first that does not
+# fit. Returns the bound, the value per cost of that first parcel (0 when every parcel fits), the price of the budget in the bound, and which
+# parcels the bound takes whole (their total cost is within the budget).
+def fractional_bound(values, costs, budget):
+    taken = np.zeros(len(values), dtype=bool)
+    useful = np.flatnonzero(values > 0)
+    free = useful[costs[useful] <= 0]
+    taken[free] = True
+    bound = values[free].sum()
+    paid = useful[costs[useful] > 0]
+    order = paid[np.argsort(-values[paid] / costs[paid], kind="mergesort")]
+    spent = np.cumsum(costs[order])
+    whole = np.searchsorted(spent, budget, side="right")
+    taken[order[:whole]] = True
+    bound += values[order[:whole]].sum()
+    if whole == len(order):
+        return float(bound), 0.0, taken
+    left = budget - (spent[whole - 1] if whole else 0)
+    split = order[whole]
+    return float(bound + values[split] * left / costs[split]), float(values[split] / costs[split]), taken
+
+
+# Parcels that are in (or out of) every portfolio better than lower: taking a parcel the bound takes out of the portfolio (or adding one it
+# leaves out) lowers the bound by at least its value less its cost at the price of the budget (its reduced cost), so when that brings the
+# bound under lower the parcel can be fixed. Only parcels the bound takes whole are fixed in: parcels tied with the price of the budget can
+# come out with a reduced cost a rounding error above 0, and fixing them in too could go over the budget. Returns (fixed in, fixed out,
+# reduced costs, taken whole by the bound).
+def fixed_parcels(values, costs, budget, lower):
+    bound, price, taken = fractional_bound(values, costs, budget)
+    reduced = values - price * costs
+    return taken & (reduced > 0) & (bound - reduced < lower), ~taken & (reduced <= 0) & (bound + reduced < lower), reduced, taken
+
+
+# Add the parcels in order to the selection while they fit in the budget. Each pass takes the longest run of candidates that fits,
+# and drops the candidates that no longer fit in what is left.
+def fill(order, costs, budget, selected):
+    remaining = budget - costs[selected].sum()
+    candidates = order[~selected[order]]
+    while len(candidates):
+        candidates = candidates[costs[candidates] <= remaining]
+        if not len(candidates):
+            break
+        count = np.searchsorted(np.cumsum(costs[candidates]), remaining, side="right")
+        selected[candidates[:count]] = True
+        remaining -= costs[candidates[:count]].sum()
+        candidates = candidates[count:]
+    return selected
+
+
+def ratio_order(values, costs):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = np.where(costs > 0, values / costs, np.inf)
+    order = np.argsort(-ratios, kind="mergesort")
+    return order[values[order] > 0]
+
+
+def greedy_portfolio(values, costs, budget, edges=None, bonus=0, rounds=20):
+    started = time.time()
+    selected = fill(ratio_order(values, costs), costs, budget, np.zeros(len(values), dtype=bool))
+    best, best_value = selected, portfolio_value(selected, values, edges, bonus)
+    if edges is not None and bonus and len(edges[0]):
+        from scipy.sparse import coo_matrix
+        adjacency = coo_matrix((np.ones(2 * len(edges[0])), (np.r_[edges[0], edges[1]], np.r_[edges[1], edges[0]])), shape=(len(values),) * 2).tocsr()
+        for _ in range(rounds):
+            # the value of each parcel with the bonus of its neighbours in the last portfolio
+            effective = values + bonus * adjacency.dot(selected.astype(float))
+            selected = fill(ratio_order(effective, costs), costs, budget, np.zeros(len(values), dtype=bool))
+            value = portfolio_value(selected, values, edges, bonus)
+            if value <= best_value:
+                break
+            best, best_value = selected, value
+    degrees = np.bincount(np.r_[edges[0], edges[1]], minlength=len(values)) if edges is not None and bonus else 0
+    bound = fractional_bound(values + bonus * degrees / 2.0, costs, budget)[0]
+    return Portfolio(best, best_value, float(costs[best].sum()), bound, gap(best_value, bound), time.time() - started, "greedy")
+
+
+# The integer program is only solved for the parcels that can not be fixed (see fixed_parcels) from the bound and the greedy portfolio,
+# which is usually a small part of them: HiGHS slows down quickly with the number of parcels sharing the budget constraint. When more than
+# max_parcels are left (eg. with a large adjacency bonus, which loosens the bound), the ones furthest from the margin are fixed as the bound
+# takes them, the portfolio is then not proven optimal and its gap is measured against the bound.
+def exact_portfolio(values, costs, budget, edges=None, bonus=0, time_limit=DEFAULT_TIME_LIMIT, max_parcels=MAX_SOLVER_PARCELS):
+    from scipy.optimize import Bounds, LinearConstraint, milp
+    from scipy.sparse import coo_matrix, vstack
+    started = time.time()
+    greedy = greedy_portfolio(values, costs, budget, edges, bonus)
+    bonus = bonus if edges is not None else 0
+    degrees = np.bincount(np.r_[edges[0], edges[1]], minlength=len(values)) if bonus else np.zeros(len(values))
+    fixed_in, fixed_out, reduced, taken = fixed_parcels(values + bonus * degrees / 2.0, costs, budget, greedy.value)
+    core = np.flatnonzero(~fixed_in & ~fixed_out)
+    print("%d parcels fixed in and %d out of the portfolio, %d left for the solver" % (fixed_in.sum(), fixed_out.sum(), len(core)))
+    proven = len(core) <= max_parcels
+    if not proven:
+        rest = core[np.argsort(np.abs(reduced[core]), kind="mergesort")[max_parcels:]]
+        fixed_in[rest[taken[rest]]] = True
+        fixed_out[rest[~taken[rest]]] = True
+        core = np.flatnonzero(~fixed_in & ~fixed_out)
+        print("not exact: only the %d parcels nearest the margin are left for the solver, the others are fixed as the bound takes them, "
+              "so the portfolio is not proven optimal" % len(core))
+    assert costs[fixed_in].sum() <= budget, "the parcels fixed in the portfolio cost more than the budget"
+
+    # pairs with a parcel fixed in add the bonus to the other parcel, pairs of two core parcels get a variable
+    position = np.full(len(values), -1)
+    position[core] = np.arange(len(core))
+    core_values = values[core].astype(float)
+    pairs = np.zeros((2, 0), dtype=np.intp)
+    if bonus:
+        first, second = edges
+        np.add.at(core_values, position[second[fixed_in[first] & (position[second] >= 0)]], bonus)
+        np.add.at(core_values, position[first[fixed_in[second] & (position[first] >= 0)]], bonus)
+        both = (position[first] >= 0) & (position[second] >= 0)
+        pairs = np.vstack([position[first[both]], position[second[both]]])
+    count, pair_count = len(core), pairs.shape[1]
+
+    selected = fixed_in.copy()
+    bound = greedy.bound
+    if count:
+        objective = -np.r_[core_values, np.full(pair_count, float(bonus))]
+        # the budget left by the parcels fixed in, then y - x <= 0 for both parcels of every pair
+        rows = [coo_matrix(np.r_[costs[core], np.zeros(pair_count)][None, :])]
+        pair_rows = np.r_[np.arange(pair_count), np.arange(pair_count)]
+        for parcels in pairs:
+            rows.append(coo_matrix((np.r_[np.ones(pair_count), -np.ones(pair_count)], (pair_rows, np.r_[count + np.arange(pair_count), parcels])),
+                                   shape=(pair_count, count + pair_count)))
+        upper = np.r_[budget - costs[fixed_in].sum(), np.zeros(2 * pair_count)]
+        # the pair variables do not need to be integers: at the optimum each is the smaller of its two parcels
+        result = milp(objective, integrality=np.r_[np.ones(count), np.zeros(pair_count)], bounds=Bounds(0, 1),
+                      constraints=LinearConstraint(vstack(rows).tocsr(), -np.inf, upper),
+                      options={"time_limit": max(time_limit - (time.time() - started), 1)})
+        if result.status == 2:
+            raise RuntimeError("the solver found the portfolio infeasible with %d parcels fixed in: %s" % (fixed_in.sum(), result.message))
+        if result.x is None:
+            print("the solver found no portfolio in time (%s), keeping the greedy one" % result.message)
+            return greedy._replace(seconds=time.time() - started)
+        selected[core[result.x[:count] > 0.5]] = True
+        if proven and result.mip_dual_bound is not None:
+            # the value of the parcels fixed in (and of the pairs of them) is not in the objective of the solver
+            fixed_value = portfolio_value(fixed_in, values, edges, bonus)
+            bound = min(bound, fixed_value - result.mip_dual_bound)
+    value = portfolio_value(selected, values, edges, bonus)
+    if value < greedy.value:
+        selected, value = greedy.selected, greedy.value
+    bound = max(bound, value)
+    return Portfolio(selected, value, float(costs[selected].sum()), bound, gap(value, bound), time.time() - started,
+                     "exact" if proven else "restricted")
+
+
+def gap(value, bound):
+    return max(bound - value, 0.0) / bound if bound > 0 else 0.0
+
+
+# The parcel geometries and OBJECTIDs of a feature class, read with the open backend libraries whichever backend ran the ranking
+def read_parcels(parcels):
+    import pyogrio
+    from backends import PROJECTED_CRS_EPSG
+    from open_backend import split_dataset_path
+    path, layer = split_dataset_path(parcels)
+    frame = pyogrio.read_dataframe(path, layer=layer, fid_as_index=True)
+    if frame.crs is not None and frame.crs.to_epsg() != PROJECTED_CRS_EPSG:
+        frame = frame.to_crs(epsg=PROJECTED_CRS_EPSG)
+    keys = frame["OBJECTID"].values if "OBJECTID" in frame.columns else frame.index.values
+    return keys, frame
+
+
+# Line up the rows of frame (keyed by frame_keys) with keys
+def lined_up(frame_keys, keys):
+    order = np.argsort(frame_keys, kind="mergesort")
+    positions = np.searchsorted(frame_keys[order], keys)
+    positions = np.minimum(positions, len(order) - 1)
+    if not len(order) or not np.array_equal(frame_keys[order][positions], keys):
+        raise ValueError("the parcels do not have every OBJECTID of the scores")
+    return order[positions]
+
+
+def main(source, budget, backend_name="arcpy", parcels=None, cost_field=None, weights=None, adjacency_bonus=0, exact=False,
+         time_limit=DEFAULT_TIME_LIMIT, out=None):
+    from metrics_table import is_metrics_file, load_metrics
+    from rescore import write_columns
+    from scoring import score_fields
+
+    if is_metrics_file(source):
+        columns, backend = load_metrics(source), None
+        if parcels is None and (cost_field is None or adjacency_bonus):
+            raise ValueError("the parcels (--parcels) are needed for their areas or adjacency, a metrics table has no geometry")
+    else:
+        from backends import get_backend
+        backend = get_backend(backend_name, os.path.dirname(source))
+        table = backend.read_table(source, score_fields(), null_value=np.nan)
+        columns = ColumnStore(backend.read_table(source, "OBJECTID")["OBJECTID"])
+        for field in score_fields():
+            columns[field] = table[field]
+        parcels = parcels or source
+
+    values = parcel_values(columns, weights)
+    edges = None
+    if parcels:
+        frame_keys, frame = read_parcels(parcels)
+        frame = frame.iloc[lined_up(np.asarray(frame_keys), columns.keys)]
+        geometries = frame.geometry.values
+        if adjacency_bonus:
+            edges = shared_edges(geometries)
+            print("%d pairs of adjacent parcels" % len(edges[0]))
+    if cost_field:
+        costs = frame[cost_field].values if parcels and cost_field in frame.columns else columns[cost_field]
+        costs = np.nan_to_num(np.asarray(costs, dtype=float))
+    else:
+        import shapely
+        costs = shapely.area(geometries) / SQUARE_METERS_PER_ACRE
+    if (costs < 0).any():
+        raise ValueError("%d parcels have a negative cost" % (costs < 0).sum())
+
+    if exact:
+        portfolio = exact_portfolio(values, costs, budget, edges, adjacency_bonus, time_limit)
+    else:
+        portfolio = greedy_portfolio(values, costs, budget, edges, adjacency_bonus)
+    print("%s portfolio of %d of %d parcels, cost %.2f of %.2f, value %.3f (bound %.3f, gap %.3f%%), solved in %.3f s"
+          % (portfolio.method, portfolio.selected.sum(), len(values), portfolio.cost, budget, portfolio.value, portfolio.bound,
+             portfolio.gap * 100, portfolio.seconds))
+
+    result = ColumnStore(columns.keys)
+    result["PORTFOLIO"] = portfolio.selected.astype(np.int32)
+    write_columns(result, source, backend, out)
+    return portfolio
+
+
+if __name__ == "__main__":
+    from rescore import parse_assignments
+
+    parser = argparse.ArgumentParser(description="Pick the parcels with the largest total score within a budget, from the scores of a run")
+    parser.add_argument("scores", help="ParcelsFinal (or another feature class with the score fields), or a metrics table written with --metrics-out")
+    parser.add_argument("--budget", type=float, required=True, help="largest total cost of the portfolio (acres, unless --cost is given)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="arcpy", help="backend used to read and write a feature class (default: arcpy)")
+    parser.add_argument("--parcels", default=None, help="feature class of the parcels, for their areas and adjacency when the scores are a metrics table")
+    parser.add_argument("--cost", default=None, help="field of the parcels with their cost (default: their area in acres)")
+    parser.add_argument("--weight", action="append", help="Factor=weight of a factor score in the value of a parcel (default: PRIORITY_SCORE), can be repeated")
+    parser.add_argument("--adjacency-bonus", type=float, default=0, help="value added for every pair of parcels in the portfolio that share an edge")
+    parser.add_argument("--exact", action="store_true", help="solve the integer program with HiGHS instead of the greedy solver (not exact with "
+                        "--adjacency-bonus on more than %d parcels, see the notes at the top)" % MAX_SOLVER_PARCELS)
+    parser.add_argument("--time-limit", type=float, default=DEFAULT_TIME_LIMIT, help="seconds the exact solver runs for at most (default: %d)" % DEFAULT_TIME_LIMIT)
+    parser.add_argument("--factors", help="JSON file of the extra factors the scores were computed with (see factors.py)")
+    parser.add_argument("--out", help="table to write PORTFOLIO to, instead of writing it back to the feature class")
+    args = parser.parse_args()
+
+    try:
+        if args.factors:
+            from factors import load_factors
+            load_factors(args.factors)
+        main(args.scores, args.budget, args.backend, parcels=args.parcels, cost_field=args.cost, weights=parse_assignments(args.weight, float),
+             adjacency_bonus=args.adjacency_bonus, exact=args.exact, time_limit=args.time_limit, out=args.out)
+    except ValueError as error:
+        parser.error(str(error))
@@ -0,0 +1,107 @@
+#-------------------------------------------------------------------------------
+# Coordinate systems of the inputs, and kept projected copies of the provincial layers
+#-------------------------------------------------------------------------------
+
+# The analysis is done in NAD 1983 10TM AEP Forest (PROJECTED_CRS_EPSG, in meters). The area of interest used to be assumed to be in
+# a projected coordinate system with linear units, and every run projected the quarter sections again. Before any geoprocessing,
+# prepare_inputs now reads the coordinate system of every input (Backend.coordinate_system):
+#   - an input with no coordinate system stops the run, since its coordinates can not be placed,
+#   - an area of interest in any other coordinate system is projected into the workspace (Area_Of_Interest_Projected), so it is
+#     buffered and selected by in meters,
+#   - with a folder for projected copies (--projected-layers in the main script), each provincial layer in another coordinate system
+#     is projected once, whole, and kept there. A copy is keyed by the identity of its source (path, modification time and size, see
+#     cache.dataset_identity) and the source's coordinate system, so every later run reads the copy instead, until the source changes
+#     and is projected again (the copy of the older version is then deleted).
+# Without the folder, the provincial layers are projected as the steps read them, and only the parts they need: the open backend reads
+# the features within the bounding box of a step (the box is projected to the source coordinate system, see OpenBackend.read_window)
+# and transforms their coordinates in one vectorized pyproj call (GeoDataFrame.to_crs), and the arcpy backend only projects the quarter
+# sections that intersect the area of interest.
+
+import hashlib
+import json
+import os
+import shutil
+from collections import OrderedDict
+
+from backends import PROJECTED_CRS_EPSG
+from cache import dataset_identity
+
+# Change this whenever the projected copies change, so older copies are not used
+PROJECTION_VERSION = 1
+
+AREA_OF_INTEREST_PROJECTED = "Area_Of_Interest_Projected"
+PROJECTED_DATASET = "Projected"
+SOURCE_FILE = "source.json"
+
+
+# The coordinate system of every input: Inputs field -> (name, kind), see Backend.coordinate_system. Inputs that are not given (the area of
+# interest, when the parcels are selected by township, see parcel_index.py) are left out.
+def check_coordinate_systems(backend, inputs):
+    systems = OrderedDict()
+    for field, dataset in zip(inputs._fields, inputs):
+        if dataset is None:
+            continue
+        name, kind = backend.coordinate_system(dataset)
+        if kind is None:
+            raise ValueError("%s (%s) has no coordinate system, define one before running the ranking" % (dataset, field))
+        systems[field] = (name, kind)
+    return systems
+
+
+class ProjectedLayers(object):
+
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def _entries(self):
+        for key in sorted(os.listdir(self.folder)):
+            path = os.path.join(self.folder, key, SOURCE_FILE)
+            if os.path.exists(path):
+                with open(path) as source_file:
+                    yield key, json.load(source_file)
+
+    # The projected copy of dataset (in the coordinate system named crs_name), made when there is none for this version of it
+    def projected(self, backend, dataset, crs_name):
+        source = backend.full_path(dataset)
+        identity = dataset_identity(source)
+        key = hashlib.sha1(json.dumps([PROJECTION_VERSION, backend.name, identity, crs_name, PROJECTED_CRS_EPSG]).encode("utf-8")).hexdigest()
+        entry = os.path.join(self.folder, key)
+        extension = ".gpkg" if backend.name == "open" else ".gdb"
+        if os.path.exists(os.path.join(entry, SOURCE_FILE)):
+            return backend.dataset_path(os.path.join(entry, "projected" + extension), PROJECTED_DATASET)
+
+        # copies of older versions of the same layer are not used again
+        for old_key, description in list(self._entries()):
+            if description["source"] == source:
+                shutil.rmtree(os.path.join(self.folder, old_key), ignore_errors=True)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.makedirs(entry)
+        workspace = backend.create_workspace(entry, "projected")
+        with backend.stage("project " + os.path.basename(source)):
+            backend.project(dataset, backend.dataset_path(workspace, PROJECTED_DATASET))
+        # written last, so a copy that was not fully written is never used
+        with open(os.path.join(entry, SOURCE_FILE), "w") as source_file:
+            json.dump({"source": source, "identity": identity, "coordinate_system": crs_name}, source_file, indent=1, sort_keys=True)
+        return backend.dataset_path(workspace, PROJECTED_DATASET)
+
+
+# Check the coordinate systems of the inputs (a pipeline.Inputs) and return the inputs to use: the area of interest projected into the
+# workspace when it is not in the analysis coordinate system, and the provincial layers replaced by their projected copies in layers
+# (a ProjectedLayers) when they are not either
+def prepare_inputs(backend, inputs, layers=None):
+    replaced = {}
+    for field, (name, kind) in check_coordinate_systems(backend, inputs).items():
+        if kind == "analysis":
+            continue
+        if field == "areaOfInterest":
+            print("the area of interest is in %s, projecting it" % name)
+            backend.project(inputs.areaOfInterest, AREA_OF_INTEREST_PROJECTED)
+            replaced[field] = AREA_OF_INTEREST_PROJECTED
+        elif layers is not None:
+            replaced[field] = layers.projected(backend, getattr(inputs, field), name)
+            print("%s is in %s, using its projected copy %s" % (field, name, replaced[field]))
+        else:
+            print("%s is in %s, it is projected as it is read" % (field, name))
+    return inputs._replace(**replaced)
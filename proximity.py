@@ -0,0 +1,99 @@
+#-------------------------------------------------------------------------------
+# Distance to the nearest protected area, bounded by a search radius
+#-------------------------------------------------------------------------------
+
+# Proximity scoring only tells apart parcels inside a protected area, within 2000 m, within 4000 m and beyond, so the
+# exact distance to a park more than 4 km away is never used. Near without a search radius still finds it, by comparing
+# every parcel with the whole provincial parks layer.
+
+# Protected areas are large polygons with thousands of vertices, so their bounding boxes hold many parcels and every
+# exact distance to one is expensive. The search is done in two steps instead:
+#   1. parcels that intersect a protected area are at distance 0. Each protected area is prepared once and tested
+#      against the parcels its bounding box overlaps, through an STRtree of the parcels.
+#   2. the distance from any other parcel to a protected area is its distance to the area's boundary. The boundaries are cut
+#      into short pieces (at most PIECE_VERTICES vertices) and put into an STRtree. The remaining parcels are queried against it in
+#      batches for their nearest piece within search_radius. Piece bounding boxes are small, so the tree hands back only
+#      a few candidates, each with a cheap exact distance, and parcels far from any park are answered from the index alone.
+# Parcels with no protected area within the radius get an infinite distance.
+
+# The open backend's near_table runs on this (see open_backend.py), ArcpyBackend passes the radius to Generate Near Table.
+
+import numpy as np
+
+# Distances beyond the last proximity threshold (4000 m) all score the same, so there is no need to search further
+DEFAULT_SEARCH_RADIUS = 4000
+
+DEFAULT_BATCH_SIZE = 100000
+
+PIECE_VERTICES = 16
+
+
+# Cut the boundaries of polygons into linestrings of at most piece_vertices vertices.
+# Returns (pieces, index of the polygon each piece came from).
+def boundary_pieces(polygons, piece_vertices=PIECE_VERTICES):
+    import shapely
+    rings, ring_polygon = shapely.get_parts(shapely.boundary(polygons), return_index=True)
+    coordinates, ring_of = shapely.get_coordinates(rings, return_index=True)
+    counts = np.bincount(ring_of, minlength=len(rings))
+    ring_start = np.cumsum(counts) - counts
+
+    # consecutive pieces share their end vertex, so each piece covers step segments of its ring
+    step = piece_vertices - 1
+    piece_counts = np.maximum((counts - 2) // step + 1, 1)
+    piece_ring = np.repeat(np.arange(len(rings)), piece_counts)
+    piece_number = np.arange(len(piece_ring)) - np.repeat(np.cumsum(piece_counts) - piece_counts, piece_counts)
+    first = ring_start[piece_ring] + piece_number * step
+    last = np.minimum(first + step, ring_start[piece_ring] + counts[piece_ring] - 1)
+    lengths = last - first + 1
+    positions = np.repeat(first, lengths) + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    pieces = shapely.linestrings(coordinates[positions], indices=np.repeat(np.arange(len(piece_ring)), lengths))
+    return pieces, ring_polygon[piece_ring]
+
+
+# The nearest target polygon of every geometry within search_radius (meters, None searches without a limit).
+# geometries and targets are arrays of shapely geometries.
+# Returns (target index, distance) arrays lined up with geometries, with -1 and inf where no target is within the radius.
+def nearest_within(geometries, targets, search_radius=DEFAULT_SEARCH_RADIUS, batch_size=DEFAULT_BATCH_SIZE):
+    import shapely
+    geometries = np.asarray(geometries, dtype=object)
+    targets = np.asarray(targets, dtype=object)
+    nearest = np.full(len(geometries), -1, dtype=np.intp)
+    distance = np.full(len(geometries), np.inf)
+    if len(geometries) == 0 or len(targets) == 0:
+        return nearest, distance
+
+    # 1. geometries intersecting a target (the targets are prepared as the query geometries)
+    target_index, inside = shapely.STRtree(geometries).query(targets, predicate="intersects")
+    nearest[inside] = target_index
+    distance[inside] = 0
+
+    # 2. the nearest boundary piece of every other geometry (points and lines are searched for as they are)
+    if np.all(np.isin(shapely.get_type_id(targets), [3, 6])):
+        pieces, piece_target = boundary_pieces(targets)
+    else:
+        pieces, piece_target = targets, np.arange(len(targets))
+    tree = shapely.STRtree(pieces)
+    outside = np.flatnonzero(np.isinf(distance))
+    # batches bound the memory used by the candidate pairs of one query
+    for start in range(0, len(outside), batch_size):
+        batch = outside[start:start + batch_size]
+        (found, piece), found_distance = tree.query_nearest(geometries[batch], max_distance=search_radius, return_distance=True, all_matches=False)
+        nearest[batch[found]] = piece_target[piece]
+        distance[batch[found]] = found_distance
+    return nearest, distance
+
+
+# Exhaustive nearest distances (every geometry against every target), for checking and benchmarking nearest_within
+def nearest_exhaustive(geometries, targets):
+    import shapely
+    geometries = np.asarray(geometries, dtype=object)
+    targets = np.asarray(targets, dtype=object)
+    nearest = np.full(len(geometries), -1, dtype=np.intp)
+    distance = np.full(len(geometries), np.inf)
+    if len(targets) == 0:
+        return nearest, distance
+    for position, geometry in enumerate(geometries):
+        distances = shapely.distance(geometry, targets)
+        nearest[position] = np.argmin(distances)
+        distance[position] = distances[nearest[position]]
+    return nearest, distance
@@ -0,0 +1,294 @@
+#-------------------------------------------------------------------------------
+# Raster engine for the intactness and patch size factors
+#-------------------------------------------------------------------------------
+
+# The vector intactness and patch steps erase the human footprint from the parcels and from a 50 km buffer around the area
+# of interest. Erase has to union thousands of footprint polygons per patch, which is what makes these steps the slowest of the
+# ranking and what ran out of memory when the footprint was buffered (see the notes in the script header).
+
+# In raster mode the footprint is burned into a grid of cell_size meters instead, and everything else is array work:
+#   - intactness: the parcels are burned into the same grid (each cell gets the parcel its centre falls in), and the intact
+#     cells of each parcel are counted with a bincount (a zonal sum),
+#   - patch size: the intact cells within the buffered area of interest are labelled into connected patches with
+#     scipy.ndimage.label, the cells of each patch are counted, and every parcel gets the largest patch among its cells
+#     (a zonal max, see grouped_reduction.py).
+# Buffering the footprint becomes a morphological dilation of the grid, which costs about as much as rasterizing it.
+
+# A cell is footprint when its centre is inside a footprint polygon, which keeps intact areas unbiased. For patches, cells the
+# footprint boundary passes through are footprint too, so roads and other features narrower than a cell still split the intact
+# patches on either side (patches are connected through cell edges, not corners). Counting those boundary cells as wholly footprint
+# shrank every patch by about a cell along its whole outline, which moved patches just above a Patch_Size threshold (160, 2500 or
+# 10000 acres) below it. So the footprint is measured in each boundary cell on SUBCELLS x SUBCELLS subcells, the cell is given to a
+# patch beside it, and the patch counts only the part of the cell the footprint leaves intact. Boundary cells are not counted as
+# reaching into a parcel, as the vector patches stop at the footprint.
+#
+# On the 1k benchmark fixture (whose patches are mostly just above 2500 acres) the raster engine gives these differences from the
+# vector engine:
+#   cell size   patch scores differ   largest patch error (mean / max)   Area_Intact max difference   PRIORITY_RANKING differs
+#   25 m        0 of 1024             0.10% / 0.32%                       32455 m2                     2 of 1024
+# Intact areas are cell counts times the cell area, so they are accurate to about one cell along each edge. The patch grid covers
+# the area of interest plus 50 km on every side, cells x 4 bytes for the patch labels: about 200 MB for a county at 25 m.
+
+import numpy as np
+
+DEFAULT_CELL_SIZE = 25
+
+# Polygons are filled in blocks of at most this many cells, to bound the memory used by the cell indices
+BLOCK_CELLS = 1 << 20
+
+# Subcells per side of a cell the footprint is measured with in the cells it covers in part, and the most subcells rasterized at once
+SUBCELLS = 5
+FRACTION_BLOCK_CELLS = 1 << 25
+
+# Passes giving the cells the footprint covers in part to the patches beside them (a footprint boundary crosses at most two cells)
+EDGE_PASSES = 2
+
+
+# A grid of square cells aligned to multiples of cell_size, so grids over different extents line up cell for cell.
+# Row 0 is the northern edge, like the arrays of arcpy.RasterToNumPyArray.
+class Grid(object):
+
+    def __init__(self, xmin, ymax, ncols, nrows, cell_size):
+        self.xmin = xmin
+        self.ymax = ymax
+        self.ncols = ncols
+        self.nrows = nrows
+        self.cell_size = float(cell_size)
+
+    # The grid covering extent (xmin, ymin, xmax, ymax), grown by margin cells on every side
+    @classmethod
+    def covering(cls, extent, cell_size, margin=0):
+        xmin, ymin, xmax, ymax = extent
+        first_col = int(np.floor(xmin / cell_size)) - margin
+        last_col = int(np.ceil(xmax / cell_size)) + margin
+        first_row = int(np.floor(ymin / cell_size)) - margin
+        last_row = int(np.ceil(ymax / cell_size)) + margin
+        return cls(first_col * cell_size, last_row * cell_size, max(last_col - first_col, 1), max(last_row - first_row, 1), cell_size)
+
+    @property
+    def shape(self):
+        return self.nrows, self.ncols
+
+    @property
+    def extent(self):
+        return self.xmin, self.ymax - self.nrows * self.cell_size, self.xmin + self.ncols * self.cell_size, self.ymax
+
+    @property
+    def cell_area(self):
+        return self.cell_size ** 2
+
+    # The rows and columns (as slices) of the cells overlapping extent, clipped to the grid
+    def window(self, extent):
+        xmin, ymin, xmax, ymax = extent
+        first_col = max(int(np.floor((xmin - self.xmin) / self.cell_size)), 0)
+        last_col = min(int(np.ceil((xmax - self.xmin) / self.cell_size)), self.ncols)
+        first_row = max(int(np.floor((self.ymax - ymax) / self.cell_size)), 0)
+        last_row = min(int(np.ceil((self.ymax - ymin) / self.cell_size)), self.nrows)
+        return slice(first_row, max(last_row, first_row)), slice(first_col, max(last_col, first_col))
+
+    # The part of this grid covering extent, and the window it is in this grid
+    def subgrid(self, extent):
+        rows, cols = self.window(extent)
+        grid = Grid(self.xmin + cols.start * self.cell_size, self.ymax - rows.start * self.cell_size, cols.stop - cols.start, rows.stop - rows.start, self.cell_size)
+        return grid, (rows, cols)
+
+    # The row and column of the cells containing points, -1 for points outside the grid
+    def cells(self, x, y):
+        col = np.floor((np.asarray(x) - self.xmin) / self.cell_size).astype(np.intp)
+        row = np.floor((self.ymax - np.asarray(y)) / self.cell_size).astype(np.intp)
+        outside = (col < 0) | (col >= self.ncols) | (row < 0) | (row >= self.nrows)
+        col[outside] = -1
+        row[outside] = -1
+        return row, col
+
+
+# Burn polygons into an array of grid.shape: values (one per geometry) for zones, or True for a mask when values is None.
+# A cell is burned when its centre is inside a polygon, with all_touched also when the polygon's boundary passes through it.
+# Every polygon is filled at once with a scanline: the edges are crossed with the row centres, and the crossings of each polygon
+# and row are sorted and paired into spans (even-odd, so holes stay empty). Where polygons overlap the later one is burned.
+def rasterize_geometries(geometries, grid, values=None, all_touched=False):
+    import shapely
+    geometries = np.asarray(geometries, dtype=object)
+    out = np.zeros(grid.shape, dtype=bool if values is None else np.int32)
+    burn = np.ones(len(geometries), dtype=bool) if values is None else np.asarray(values)
+    if len(geometries) == 0:
+        return out
+
+    xmin, ymin, xmax, ymax = grid.extent
+    bounds = shapely.bounds(geometries)
+    overlapping = np.flatnonzero((bounds[:, 0] <= xmax) & (bounds[:, 2] >= xmin) & (bounds[:, 1] <= ymax) & (bounds[:, 3] >= ymin))
+    rings, ring_geometry = shapely.get_parts(shapely.boundary(geometries[overlapping]), return_index=True)
+    coordinates, ring_of = shapely.get_coordinates(rings, return_index=True)
+
+    # the edges of every ring, with the rows whose centres they cross (half open in y, so a vertex on a row centre is crossed once)
+    same_ring = np.flatnonzero(ring_of[1:] == ring_of[:-1])
+    x0, y0 = coordinates[same_ring, 0], coordinates[same_ring, 1]
+    x1, y1 = coordinates[same_ring + 1, 0], coordinates[same_ring + 1, 1]
+    first_row = np.maximum(np.floor((grid.ymax - np.maximum(y0, y1)) / grid.cell_size - 0.5).astype(np.intp) + 1, 0)
+    last_row = np.minimum(np.floor((grid.ymax - np.minimum(y0, y1)) / grid.cell_size - 0.5).astype(np.intp), grid.nrows - 1)
+    crossings = np.maximum(last_row - first_row + 1, 0)
+    edge = np.repeat(np.arange(len(same_ring)), crossings)
+    row = np.repeat(first_row, crossings) + np.arange(crossings.sum()) - np.repeat(np.cumsum(crossings) - crossings, crossings)
+    y = grid.ymax - (row + 0.5) * grid.cell_size
+    x = x0[edge] + (y - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+    geometry = overlapping[ring_geometry[ring_of[same_ring[edge]]]]
+
+    # pair the sorted crossings of each geometry and row into spans of cell centres [start, end)
+    order = np.lexsort((x, row, geometry))
+    starts, ends = order[0::2], order[1::2]
+    span_row, span_geometry = row[starts], geometry[starts]
+    span_start = np.clip(np.ceil((x[starts] - grid.xmin) / grid.cell_size - 0.5).astype(np.intp), 0, grid.ncols)
+    span_end = np.clip(np.ceil((x[ends] - grid.xmin) / grid.cell_size - 0.5).astype(np.intp), 0, grid.ncols)
+    lengths = np.maximum(span_end - span_start, 0)
+
+    # fill the spans in the order of the geometries, in blocks of at most BLOCK_CELLS cells
+    order = np.argsort(span_geometry, kind="mergesort")
+    block_ends = np.cumsum(lengths[order])
+    first = 0
+    while first < len(order):
+        last = max(int(np.searchsorted(block_ends, block_ends[first] - lengths[order[first]] + BLOCK_CELLS, side="right")), first + 1)
+        block = order[first:last]
+        block_lengths = lengths[block]
+        offsets = np.arange(block_lengths.sum()) - np.repeat(np.cumsum(block_lengths) - block_lengths, block_lengths)
+        out[np.repeat(span_row[block], block_lengths), np.repeat(span_start[block], block_lengths) + offsets] = np.repeat(burn[span_geometry[block]], block_lengths)
+        first = last
+
+    if all_touched:
+        boundaries = shapely.segmentize(shapely.boundary(geometries[overlapping]), grid.cell_size / 2)
+        coordinates, boundary_index = shapely.get_coordinates(boundaries, return_index=True)
+        row, col = grid.cells(coordinates[:, 0], coordinates[:, 1])
+        on_grid = row >= 0
+        out[row[on_grid], col[on_grid]] = burn[overlapping[boundary_index[on_grid]]]
+    return out
+
+
+# Grow a mask by distance meters (a round buffer of its cells). The disk is a run of columns for every row offset, so the mask is grown
+# along its rows by the half width of each run and shifted by the row offset. A row is grown by ORing it with itself shifted by doubling
+# steps, so each run takes a few passes whatever its width.
+def dilate(mask, distance, cell_size):
+    reach = distance / float(cell_size)
+    radius = int(np.floor(reach))
+    if radius < 1:
+        return mask
+    out = mask.copy()
+    grown = {}
+    for offset in range(radius + 1):
+        half = int(np.floor(np.sqrt(reach ** 2 - offset ** 2)))
+        if half not in grown:
+            grown[half] = grow_rows(mask, half)
+        if offset == 0:
+            out |= grown[half]
+        elif offset < len(mask):
+            out[offset:] |= grown[half][:-offset]
+            out[:-offset] |= grown[half][offset:]
+    return out
+
+
+# The mask with each row ORed over the half cells to either side of each cell
+def grow_rows(mask, half):
+    if half == 0 or mask.shape[1] == 0:
+        return mask
+    # run[:, i] covers columns i to i + width - 1, ending past the mask right edge
+    run = np.zeros((mask.shape[0], mask.shape[1] + 2 * half), dtype=bool)
+    run[:, half:half + mask.shape[1]] = mask
+    width, covered = 2 * half + 1, 1
+    while covered < width:
+        step = min(covered, width - covered)
+        run[:, :-step] |= run[:, step:]
+        covered += step
+    return run[:, :mask.shape[1]]
+
+
+# The footprint mask of grid, buffered by footprint_buffer meters. Footprint just outside the grid is rasterized too, so its buffer reaches in.
+def footprint_mask(backend, footprint, grid, footprint_buffer=0, all_touched=False):
+    margin = int(np.ceil(footprint_buffer / grid.cell_size)) if footprint_buffer else 0
+    if margin == 0:
+        return backend.rasterize(footprint, grid, all_touched=all_touched)
+    larger = Grid(grid.xmin - margin * grid.cell_size, grid.ymax + margin * grid.cell_size, grid.ncols + 2 * margin, grid.nrows + 2 * margin, grid.cell_size)
+    mask = dilate(backend.rasterize(footprint, larger, all_touched=all_touched), footprint_buffer, grid.cell_size)
+    return mask[margin:margin + grid.nrows, margin:margin + grid.ncols]
+
+
+# The position (1 to n) in parcel_IDs of the parcel each cell of a zone raster of OBJECTIDs belongs to, 0 for no parcel
+def zone_positions(zones, parcel_IDs):
+    lookup = np.zeros(max(int(zones.max()), int(np.max(parcel_IDs)) if len(parcel_IDs) else 0) + 1, dtype=np.int32)
+    lookup[np.asarray(parcel_IDs)] = np.arange(1, len(parcel_IDs) + 1)
+    lookup[0] = 0
+    return lookup[zones]
+
+
+# Intact area (square meters) and percent of each parcel, in the order of parcel_IDs. Parcels too small to contain a cell centre get 0.
+def intact_area(backend, parcels, parcel_IDs, footprint, cell_size=DEFAULT_CELL_SIZE, footprint_buffer=0):
+    grid = Grid.covering(backend.extent(parcels), cell_size)
+    positions = zone_positions(backend.rasterize(parcels, grid, "OBJECTID"), parcel_IDs).ravel()
+    intact = ~footprint_mask(backend, footprint, grid, footprint_buffer).ravel()
+
+    cells = np.bincount(positions, minlength=len(parcel_IDs) + 1)[1:]
+    intact_cells = np.bincount(positions, weights=intact, minlength=len(parcel_IDs) + 1)[1:]
+    percent = np.zeros(len(parcel_IDs))
+    np.divide(intact_cells * 100, cells, out=percent, where=cells > 0)
+    return intact_cells * grid.cell_area, percent
+
+
+# The fraction of the cells at the flat positions cells of grid covered by the footprint (buffered by footprint_buffer meters), from the
+# centres of subcells x subcells subcells of each. The subcells are rasterized in blocks of whole rows of cells, of at most
+# FRACTION_BLOCK_CELLS subcells, and only for the blocks holding some of the cells.
+def footprint_fraction(backend, footprint, grid, cells, footprint_buffer=0, subcells=SUBCELLS):
+    fraction = np.zeros(len(cells))
+    rows = cells // grid.ncols
+    block_rows = max(FRACTION_BLOCK_CELLS // (grid.ncols * subcells ** 2), 1)
+    for first in np.unique(rows // block_rows) * block_rows:
+        last = min(first + block_rows, grid.nrows)
+        in_block = (rows >= first) & (rows < last)
+        fine = Grid(grid.xmin, grid.ymax - first * grid.cell_size, grid.ncols * subcells, (last - first) * subcells, grid.cell_size / subcells)
+        mask = footprint_mask(backend, footprint, fine, footprint_buffer).reshape(-1)
+        # the first subcell of each cell, and the offsets of the others from it
+        corner = (rows[in_block] - first) * subcells * fine.ncols + cells[in_block] % grid.ncols * subcells
+        offsets = (np.arange(subcells)[:, np.newaxis] * fine.ncols + np.arange(subcells)).ravel()
+        fraction[in_block] = mask[corner[:, np.newaxis] + offsets].sum(axis=1) / float(subcells ** 2)
+    return fraction
+
+
+# Label the unlabelled cells at the flat positions edge with the patch of a cell beside them (through a cell edge), in EDGE_PASSES passes
+def give_edge_cells(labels, edge):
+    flat = labels.reshape(-1)
+    nrows, ncols = labels.shape
+    row, col = np.divmod(edge, ncols)
+    for _ in range(EDGE_PASSES):
+        for beside, inside in ((edge - ncols, row > 0), (edge + ncols, row < nrows - 1), (edge - 1, col > 0), (edge + 1, col < ncols - 1)):
+            given = inside & (flat[edge] == 0)
+            flat[edge[given]] = flat[beside[given]]
+    return labels
+
+
+# Area (square meters) of the largest intact patch within search_area that reaches into each parcel, in the order of parcel_IDs
+def largest_patch_area(backend, parcels, parcel_IDs, footprint, search_area, cell_size=DEFAULT_CELL_SIZE, footprint_buffer=0):
+    from scipy import ndimage
+    from grouped_reduction import grouped_max
+    grid = Grid.covering(backend.extent(search_area), cell_size)
+    search = backend.rasterize(search_area, grid)
+    touched = footprint_mask(backend, footprint, grid, footprint_buffer, all_touched=True)
+    labels, _ = ndimage.label(search & ~touched)
+    # the cells the footprint covers in part are given to a patch beside them, with the part of them it does not cover
+    edge = np.flatnonzero(search & touched)
+    del search, touched
+    covered = footprint_fraction(backend, footprint, grid, edge, footprint_buffer)
+    edge, covered = edge[covered < 1], covered[covered < 1]
+    give_edge_cells(labels, edge)
+    patch_cells = np.bincount(labels.ravel()).astype(float)
+    patch_cells -= np.bincount(labels.reshape(-1)[edge], weights=covered, minlength=len(patch_cells))
+    patch_cells[0] = 0
+
+    # only the window of the parcels is needed, the grids line up
+    parcel_grid, (rows, cols) = grid.subgrid(backend.extent(parcels))
+    positions = zone_positions(backend.rasterize(parcels, parcel_grid, "OBJECTID"), parcel_IDs)
+    parcel_labels = labels[rows, cols]
+    # a parcel is only in the patches of its cells the footprint does not touch: a cell on a road narrower than a cell can be given
+    # to the patch on the far side of the road, which the parcel does not reach
+    edge_row, edge_col = np.divmod(edge, grid.ncols)
+    inside = (edge_row >= rows.start) & (edge_row < rows.stop) & (edge_col >= cols.start) & (edge_col < cols.stop)
+    on_edge = np.zeros(parcel_labels.shape, dtype=bool)
+    on_edge[edge_row[inside] - rows.start, edge_col[inside] - cols.start] = True
+    in_patch = (positions > 0) & (parcel_labels > 0) & ~on_edge
+    largest = grouped_max(positions[in_patch], patch_cells[parcel_labels[in_patch]], np.arange(1, len(parcel_IDs) + 1))
+    return largest * grid.cell_area
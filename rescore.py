@@ -0,0 +1,159 @@
+#-------------------------------------------------------------------------------
+# Script Name: Conservation Priority Rescoring
+#-------------------------------------------------------------------------------
+
+# Scores parcels again from metrics that have already been computed, without any geoprocessing. Changing a threshold,
+# a weight or a classification method takes milliseconds instead of a full run of Conservation_Priority_Ranking.py.
+
+# The metrics are read from a metrics table (.npz, .arrow/.feather or .parquet, see metrics_table.py, written by the main
+# script with --metrics-out), or from a ParcelsFinal feature class that already has the metric fields, eg.
+#   python rescore.py C:/data/stettler.gdb/ParcelsFinal --weight Lotic=2 --thresholds Proximity=0,1000,3000
+#   python rescore.py metrics.parquet --classify Lotic=jenks --out scores.parquet
+# New scores are written back to the feature class, or to the --out table (OBJECTID, metrics and scores).
+# Metrics of extra factors (see factors.py) are read and scored when the same --factors file as for the run is given, and their weights
+# can be changed like those of the built in factors.
+
+# Sensitivity sweeps score every combination of a grid of parameters (see sensitivity.py):
+#   python rescore.py metrics.npz --sweep sweep.json --summary sweep.csv --out top_frequency.npz
+# where sweep.json lists the values to try for each factor, eg.
+#   {"weights": {"Lotic": [0.5, 1, 2], "Intactness": [1, 2]},
+#    "thresholds": {"Proximity": [[0, 2000, 4000], [0, 1000, 3000]]},
+#    "methods": {"Ranking": ["quartiles", "quantiles:5"]}}
+# or gives the scenarios themselves: {"scenarios": [{"weight:Lotic": 2}, {"method:Wetland": "jenks"}]}.
+# The summary has one row per scenario (its parameters, the number of parcels given each ranking, and the fraction of
+# parcels ranked the same as the default scoring). The output holds TOP_RANK_FREQUENCY, the fraction of scenarios that
+# ranked each parcel 1.
+
+import argparse
+import csv
+import json
+import os
+import time
+
+import numpy as np
+
+from backends import BACKENDS, get_backend
+from metrics_table import is_metrics_file, load_metrics, save_metrics
+from pipeline import metric_fields
+from scoring import CLASSIFIED_FACTORS, THRESHOLD_FACTORS, classifier_for, score_fields, score_parcels, thresholds_for
+from table_io import ColumnStore
+
+
+# Read the metric fields of a metrics table or a feature class into a ColumnStore keyed by OBJECTID.
+# Returns (columns, backend), backend is None for metrics tables.
+def read_metrics(source, backend_name):
+    if is_metrics_file(source):
+        return load_metrics(source), None
+    backend = get_backend(backend_name, os.path.dirname(source))
+    # null metrics (eg. no protected area within the search radius) are read as NaN, not 0
+    table = backend.read_table(source, metric_fields(), null_value=np.nan)
+    columns = ColumnStore(backend.read_table(source, "OBJECTID")["OBJECTID"])
+    for field in metric_fields():
+        columns[field] = table[field]
+    return columns, backend
+
+
+# Parse "Factor=value" options into a dictionary of factor -> parse(value)
+def parse_assignments(assignments, parse):
+    parsed = {}
+    for assignment in assignments or []:
+        factor, separator, value = assignment.partition("=")
+        if not separator:
+            raise ValueError("expected Factor=value, got %r" % assignment)
+        parsed[factor.strip()] = parse(value.strip())
+    return parsed
+
+
+def write_summary(path, summary):
+    fields = []
+    for row in summary:
+        fields.extend(field for field in row if field not in fields)
+    with open(path, "w") as summary_file:
+        writer = csv.writer(summary_file)
+        writer.writerow(fields)
+        for row in summary:
+            values = [row.get(field, "") for field in fields]
+            writer.writerow([" ".join("%g" % v for v in value) if isinstance(value, list) else value for value in values])
+
+
+# Write columns to the output table, or back to the feature class the metrics came from
+def write_columns(columns, source, backend, out):
+    if out:
+        save_metrics(out, columns)
+        print("written to " + out)
+    elif backend is not None:
+        backend.write_columns(source, columns, "OBJECTID")
+        print("written to " + source)
+    else:
+        print("no output written, use --out to save the result")
+
+
+def main(source, backend_name="arcpy", weights=None, thresholds=None, methods=None, out=None):
+    columns, backend = read_metrics(source, backend_name)
+
+    classifiers = dict((factor, thresholds_for(factor, values)) for factor, values in (thresholds or {}).items())
+    classifiers.update((factor, classifier_for(factor, method)) for factor, method in (methods or {}).items())
+
+    started = time.time()
+    scores = score_parcels(columns, classifiers, weights)
+    print("scored %d parcels in %.1f ms" % (len(columns.keys), (time.time() - started) * 1000))
+
+    result = ColumnStore(columns.keys)
+    if out:
+        for field in columns.fields():
+            result[field] = columns[field]
+    for score_field in score_fields():
+        result[score_field] = scores[score_field]
+    write_columns(result, source, backend, out)
+
+
+def main_sweep(source, sweep_file, backend_name="arcpy", summary_path=None, out=None):
+    from sensitivity import scenario_grid, sweep
+
+    columns, backend = read_metrics(source, backend_name)
+    with open(sweep_file) as spec_file:
+        spec = json.load(spec_file)
+    if "scenarios" in spec:
+        scenarios = spec["scenarios"]
+    else:
+        scenarios = scenario_grid(spec.get("weights"), spec.get("thresholds"), spec.get("methods"))
+
+    started = time.time()
+    summary, top_frequency, _ = sweep(columns, scenarios)
+    print("scored %d parcels under %d scenarios in %.2f s" % (len(columns.keys), len(scenarios), time.time() - started))
+
+    if summary_path:
+        write_summary(summary_path, summary)
+        print("summary written to " + summary_path)
+    result = ColumnStore(columns.keys)
+    result["TOP_RANK_FREQUENCY"] = top_frequency
+    write_columns(result, source, backend, out)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score parcels again from stored metrics, without geoprocessing")
+    parser.add_argument("metrics", help="metrics table (.npz, .arrow, .feather, .parquet) or feature class with the metric fields")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="arcpy", help="backend used to read and write a feature class (default: arcpy)")
+    parser.add_argument("--weight", action="append", help="Factor=weight of a factor score in PRIORITY_SCORE (default 1), can be repeated")
+    parser.add_argument("--thresholds", action="append", help="Factor=t1,t2,t3 for %s, can be repeated" % " or ".join(THRESHOLD_FACTORS))
+    parser.add_argument("--classify", action="append", help="Factor=method for %s (deciles, quartiles, quantiles:N, jenks, jenks:N), can be repeated" % ", ".join(CLASSIFIED_FACTORS))
+    parser.add_argument("--factors", help="JSON file of the extra factors the metrics were computed with (see factors.py)")
+    parser.add_argument("--sweep", help="JSON file of scenarios to score (see the notes at the top of this script)")
+    parser.add_argument("--summary", help="CSV file for the sweep summary")
+    parser.add_argument("--out", help="table to write the result to, instead of writing it back to the feature class")
+    args = parser.parse_args()
+
+    try:
+        if args.factors:
+            from factors import load_factors
+            load_factors(args.factors)
+        if args.sweep:
+            main_sweep(args.metrics, args.sweep, args.backend, args.summary, args.out)
+        else:
+            main(args.metrics, args.backend,
+                 weights=parse_assignments(args.weight, float),
+                 thresholds=parse_assignments(args.thresholds, lambda value: [float(v) for v in value.split(",")]),
+                 methods=parse_assignments(args.classify, str),
+                 out=args.out)
+    except ValueError as error:
+        parser.error(str(error))
@@ -0,0 +1,121 @@
+#-------------------------------------------------------------------------------
+# Parallel execution of the factor pipelines
+#-------------------------------------------------------------------------------
+
+# The factor chains in pipeline.py only share ParcelsFinal and the user inputs, apart from Lotic, which erases the wetlands
+# clipped by the Wetland chain. Each chain is a node of a small dependency graph (FACTOR_NODES), and the nodes are run in a pool
+# of worker processes as soon as the nodes they depend on have finished, so the wall-clock time comes down to roughly the
+# slowest chain (Wetland followed by Lotic, or the large-extent patch chain). The graph itself is defined in pipeline.py.
+
+# Every node runs in its own process with its own backend and its own scratch workspace (eg. scratch_lotic.gdb, created next
+# to the main workspace), so geoprocessing tools never write to the same workspace at once. Inputs are passed to the workers
+# as full paths, and a node that needs an upstream dataset gets its path in the upstream node's scratch workspace.
+# The workers only return their metric arrays, which are joined into one ColumnStore at the end.
+
+import os
+import time
+from collections import OrderedDict
+
+from backends import get_backend
+from factors import registered_factors
+from pipeline import FACTOR_DATASETS, FACTOR_NODES, UPSTREAM_DATASETS, Inputs, extra_metrics, factor_parameters, metric_fields
+from table_io import ColumnStore
+
+
+# The nodes in an order where every node comes after the nodes it depends on
+def topological_order(nodes=FACTOR_NODES):
+    order = []
+    remaining = list(nodes)
+    while remaining:
+        ready = [node for node in remaining if all(dependency in order for dependency in nodes[node][1])]
+        if not ready:
+            raise ValueError("the factor nodes have a dependency cycle: %s" % ", ".join(remaining))
+        order.extend(ready)
+        remaining = [node for node in remaining if node not in ready]
+    return order
+
+
+# Runs one node in a worker process, arguments are the node's upstream datasets and settings. Returns (node, metric columns, seconds).
+def run_node(backend_name, scratch, node, parcels, parcel_IDs, inputs, arguments):
+    started = time.time()
+    backend = get_backend(backend_name, scratch)
+    backend.start()
+    try:
+        function = FACTOR_NODES[node][0]
+        columns = function(backend, parcels, parcel_IDs, inputs, **arguments)
+    finally:
+        backend.finish()
+    return node, columns, time.time() - started
+
+
+# Run every factor node for the parcels dataset in a pool of worker processes, and return the metrics as a ColumnStore keyed
+# by OBJECTID (the same result as pipeline.compute_metrics). The time each node took is printed as it finishes.
+# With a cache (see cache.py), cached nodes are not run, and the results of the other nodes are stored by this process once they finish.
+# The extra factors (see factors.py, the registered ones by default) are measured by this process afterwards, in one overlay.
+def compute_metrics_parallel(backend, parcels, inputs, workers, cache=None, parameters=None, factors=None):
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    started = time.time()
+    parcels_path = backend.full_path(parcels)
+    inputs = Inputs(*[backend.full_path(dataset) for dataset in inputs])
+    parcel_IDs = backend.read_table(parcels, "OBJECTID")["OBJECTID"]
+    parameters = factor_parameters(parameters)
+    keys = cache.factor_keys(backend, parcels, inputs, parameters=parameters) if cache else {}
+
+    metrics = {}
+    timings = OrderedDict()
+    # where the datasets each node wrote are
+    locations = {}
+    for node in FACTOR_NODES:
+        cached = cache.load(keys[node], parcel_IDs) if cache else None
+        if cached:
+            columns, locations[node] = cached
+            metrics.update(columns)
+            timings[node] = None
+            print("%s read from the cache" % node)
+
+    # one scratch workspace per node, next to the main workspace
+    scratch_folder = os.path.dirname(os.path.abspath(backend.workspace))
+    pending = [node for node in topological_order() if node not in timings]
+    for node in pending:
+        locations[node] = backend.create_workspace(scratch_folder, "scratch_" + node)
+
+    def node_arguments(node):
+        arguments = dict((argument, backend.dataset_path(locations[upstream], dataset))
+                         for argument, (upstream, dataset) in UPSTREAM_DATASETS.get(node, {}).items())
+        arguments.update(parameters[node])
+        return arguments
+
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            # submit every node whose dependencies have finished
+            for node in [node for node in pending if all(dependency in timings for dependency in FACTOR_NODES[node][1])]:
+                pending.remove(node)
+                running[pool.submit(run_node, backend.name, locations[node], node, parcels_path, parcel_IDs, inputs, node_arguments(node))] = node
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                node, columns, seconds = future.result()
+                metrics.update(columns)
+                timings[node] = seconds
+                print("%s finished in %.1f s" % (node, seconds))
+                if cache:
+                    cache.store(keys[node], backend, [backend.dataset_path(locations[node], name) for name in FACTOR_DATASETS[node]], parcel_IDs, columns)
+
+    factors = registered_factors() if factors is None else factors
+    metrics.update(extra_metrics(backend, parcels, parcel_IDs, factors))
+
+    # Join: the workers' columns are all lined up with parcel_IDs
+    columns = ColumnStore(parcel_IDs)
+    for field in metric_fields(factors):
+        columns[field] = metrics[field]
+
+    print("factor timings (%d workers):" % workers)
+    for node in FACTOR_NODES:
+        if timings[node] is None:
+            print("  %-15s   cached" % node)
+        else:
+            print("  %-15s %8.1f s" % (node, timings[node]))
+    print("  %-15s %8.1f s" % ("wall clock", time.time() - started))
+    return columns
@@ -0,0 +1,157 @@
+#-------------------------------------------------------------------------------
+# Parcel scoring
+#-------------------------------------------------------------------------------
+
+# Turns the per-parcel metrics produced by the geoprocessing into the 5 factor scores, the summed PRIORITY_SCORE,
+# and the quartile PRIORITY_RANKING. Each factor uses a classifier from classification.py, and any of them can be
+# replaced by passing a dictionary of classifiers keyed by factor name. The factor scores are summed with equal
+# weights unless a dictionary of weights is given.
+
+# Extra factors (see factors.py) are scored after the 5 built in ones, with their own classifiers and weights. PRIORITY_SCORE
+# adds the weighted factor scores up one factor at a time, in the order of scored_factors, as sensitivity.sweep does, so a
+# sweep ranks every parcel as score_parcels does with the same weights (a matrix product would sum them in another order,
+# and rounding would then rank a few parcels differently).
+
+from collections import OrderedDict
+
+import numpy as np
+
+from classification import DECILES, QUARTILES, NaturalBreaks, Quantiles, Scaled, Thresholds
+from factors import registered_factors
+
+# factor name -> (metric field it is computed from, score field it is written to)
+# The order is the order the scores are summed in
+FACTORS = OrderedDict([
+    ("Lotic", ("Percent_Lotic", "SCORE_Lotic_Deciles")),
+    ("Wetland", ("Wetland_Edge", "SCORE_Wetland_Deciles")),
+    ("Intactness", ("Percent_Intact", "SCORE_Intactness")),
+    ("Patch_Size", ("Largest_Patch_Area", "SCORE_Patch_Size")),
+    ("Proximity", ("Dist_to_Protected", "SCORE_Proximity")),
+])
+
+# The score fields in the order they are added to the parcels
+SCORE_FIELDS = ["SCORE_Intactness", "SCORE_Lotic_Deciles", "SCORE_Wetland_Deciles", "SCORE_Patch_Size", "SCORE_Proximity", "PRIORITY_SCORE", "PRIORITY_RANKING"]
+
+DEFAULT_CLASSIFIERS = {
+    # percent of the parcel that is intact, as a proportion
+    "Intactness": Scaled(100.0),
+    # deciles of the non-zero lotic percentages and wetland edge lengths, parcels with none score 0
+    "Lotic": Quantiles(DECILES),
+    "Wetland": Quantiles(DECILES),
+    # largest intersecting intact patch in acres
+    "Patch_Size": Thresholds([160, 2500, 10000], [0, 0.5, 0.75, 1]),
+    # distance to the nearest park or protected area in meters, parcels inside one score 1
+    "Proximity": Thresholds([0, 2000, 4000], [1, 0.75, 0.5, 0]),
+    # quartiles of the summed score, the lowest quartile is left unranked (null)
+    "Ranking": Quantiles(QUARTILES, [np.nan, 3, 2, 1], zero_policy="include"),
+}
+
+
+# Each factor counts once towards PRIORITY_SCORE
+DEFAULT_WEIGHTS = dict((factor, 1.0) for factor in FACTORS)
+
+
+# Factors whose classes are computed from the data, and can use a different classification method
+CLASSIFIED_FACTORS = ["Lotic", "Wetland", "Ranking"]
+# Factors scored by fixed thresholds, which can be moved
+THRESHOLD_FACTORS = ["Patch_Size", "Proximity"]
+METHODS = ("deciles", "quartiles", "quantiles:N", "jenks", "jenks:N")
+
+
+# Build the classifier for a factor from a method name:
+#   "deciles", "quartiles", "quantiles:N" (N equal-count classes), "jenks" or "jenks:N" (N natural breaks classes)
+# Lotic and Wetland keep their zero handling and score classes from 1/N up to 1. The ranking keeps the lowest class
+# unranked (null), and ranks the rest from N-1 (lowest) down to 1 (highest).
+# "jenks" without N uses as many classes as the factor's default classification.
+def classifier_for(factor, method):
+    if factor not in CLASSIFIED_FACTORS:
+        raise ValueError("%s is not scored by a data driven classification" % factor)
+    return method_classifier(method, DEFAULT_CLASSIFIERS[factor], ranking=factor == "Ranking")
+
+
+# The classifier of a method name (as for classifier_for) with the zero handling and number of classes of default, deciles of
+# the non-zero values by default
+def method_classifier(method, default=None, ranking=False):
+    name, _, count = method.strip().lower().partition(":")
+    default = default or Quantiles(DECILES)
+    if name == "deciles":
+        n_classes = 10
+    elif name == "quartiles":
+        n_classes = 4
+    elif name in ("quantiles", "jenks") and count:
+        n_classes = int(count)
+    elif name == "jenks":
+        n_classes = len(default.scores)
+    else:
+        raise ValueError("unknown classification method %r, expected one of %s" % (method, ", ".join(METHODS)))
+    if n_classes < 2:
+        raise ValueError("a classification needs at least 2 classes, got %d" % n_classes)
+
+    if ranking:
+        scores = np.concatenate([[np.nan], np.arange(n_classes - 1, 0, -1)])
+    else:
+        scores = np.arange(1, n_classes + 1) / float(n_classes)
+    if name == "jenks":
+        return NaturalBreaks(n_classes, scores, zero_policy=default.zero_policy, zero_score=default.zero_score)
+    return Quantiles(np.arange(n_classes) * (100.0 / n_classes), scores, zero_policy=default.zero_policy, zero_score=default.zero_score)
+
+
+# The classifier for a threshold factor with its thresholds moved. The factor keeps its default scores, so the number of thresholds can not change.
+def thresholds_for(factor, thresholds):
+    if factor not in THRESHOLD_FACTORS:
+        raise ValueError("%s is not scored by thresholds" % factor)
+    default = DEFAULT_CLASSIFIERS[factor]
+    if len(thresholds) != len(default.thresholds):
+        raise ValueError("%s needs %d thresholds, got %d" % (factor, len(default.thresholds), len(thresholds)))
+    return Thresholds(thresholds, default.scores)
+
+
+# The factors scored, factor -> (metric field, score field): the 5 built in FACTORS, then the extra factors (the registered ones by default)
+def scored_factors(factors=None):
+    named = OrderedDict(FACTORS)
+    for factor in registered_factors() if factors is None else factors:
+        named[factor.name] = (factor.metric_field, factor.score_field)
+    return named
+
+
+# The default classifiers and weights of the built in and extra factors
+def default_scoring(factors=None):
+    classifiers = dict(DEFAULT_CLASSIFIERS)
+    weights = dict(DEFAULT_WEIGHTS)
+    for factor in registered_factors() if factors is None else factors:
+        classifiers[factor.name] = factor.classifier
+        weights[factor.name] = factor.weight
+    return classifiers, weights
+
+
+# The score fields in the order they are added to the parcels, with those of the extra factors before PRIORITY_SCORE
+def score_fields(factors=None):
+    extra = [score_field for name, (_, score_field) in scored_factors(factors).items() if name not in FACTORS]
+    return SCORE_FIELDS[:-2] + extra + SCORE_FIELDS[-2:]
+
+
+# metrics: a mapping (dict or numpy structured array) with one array per metric field, all in the same parcel order
+# weights: an optional dictionary of factor -> weight of its score in PRIORITY_SCORE (1 for factors that are not given)
+# factors: the extra factors to score (see factors.py), the registered ones by default
+# returns an ordered dictionary of score field -> array, including PRIORITY_SCORE and PRIORITY_RANKING
+def score_parcels(metrics, classifiers=None, weights=None, factors=None):
+    named = scored_factors(factors)
+    chosen, chosen_weights = default_scoring(factors)
+    if classifiers:
+        chosen.update(classifiers)
+    if weights:
+        unknown = [factor for factor in weights if factor not in named]
+        if unknown:
+            raise ValueError("unknown factors %s, expected %s" % (", ".join(unknown), ", ".join(named)))
+        chosen_weights.update(weights)
+
+    scores = OrderedDict()
+    for factor, (metric_field, score_field) in named.items():
+        scores[score_field] = chosen[factor](metrics[metric_field])
+
+    priority_score = 0
+    for factor, (_, score_field) in named.items():
+        priority_score = priority_score + chosen_weights[factor] * scores[score_field]
+    scores["PRIORITY_SCORE"] = priority_score
+    scores["PRIORITY_RANKING"] = chosen["Ranking"](priority_score)
+    return scores
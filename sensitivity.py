@@ -0,0 +1,124 @@
+#-------------------------------------------------------------------------------
+# Sensitivity sweeps over the scoring parameters
+#-------------------------------------------------------------------------------
+
+# A scenario is one combination of scoring parameters: factor weights, moved thresholds (Patch_Size, Proximity) and
+# classification methods (Lotic, Wetland, Ranking). A sweep scores the same metrics under every scenario of a grid and
+# reports how the rankings move.
+
+# The sweep does not call score_parcels once per scenario. Each distinct classifier of a factor is applied to the metrics
+# only once, giving a table of factor scores with one row per variant. The priority scores of a chunk of scenarios are
+# then a weighted sum of gathered rows, and the ranking quantiles of all of them are computed together
+# (Classifier.columns). Thousands of scenarios over a county of parcels take seconds.
+
+# Scenario parameters are named "weight:<factor>", "thresholds:<factor>" and "method:<factor>", eg.
+#   {"weight:Lotic": 2.0, "thresholds:Proximity": [0, 1000, 3000], "method:Ranking": "quantiles:5"}
+# Anything a scenario does not set keeps its default (see scoring.py). Registered extra factors (see factors.py) are scored in every
+# scenario, and their weights can be swept too.
+
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+
+from scoring import classifier_for, default_scoring, score_parcels, scored_factors, thresholds_for
+
+PARAMETER_KINDS = ("weight", "thresholds", "method")
+
+
+# Every combination of the given parameter values. Each argument is a dictionary of factor -> list of values to try.
+def scenario_grid(weights=None, thresholds=None, methods=None):
+    axes = []
+    for kind, values in (("weight", weights), ("thresholds", thresholds), ("method", methods)):
+        for factor, options in sorted((values or {}).items()):
+            axes.append([("%s:%s" % (kind, factor), option) for option in options])
+    return [OrderedDict(combination) for combination in itertools.product(*axes)]
+
+
+# The classifier a scenario uses for a factor, and a key that is the same for scenarios using the same classifier
+def scenario_classifier(scenario, factor):
+    if "thresholds:" + factor in scenario:
+        thresholds = [float(value) for value in scenario["thresholds:" + factor]]
+        return thresholds_for(factor, thresholds), ("thresholds", tuple(thresholds))
+    if "method:" + factor in scenario:
+        method = scenario["method:" + factor]
+        return classifier_for(factor, method), ("method", method)
+    return default_scoring()[0][factor], ("default",)
+
+
+# The classifiers and weights of a scenario, as taken by score_parcels
+def scenario_parameters(scenario):
+    factors = scored_factors()
+    default_weights = default_scoring()[1]
+    for parameter in scenario:
+        kind, _, factor = parameter.partition(":")
+        if kind not in PARAMETER_KINDS or (factor not in factors and factor != "Ranking"):
+            raise ValueError("unknown scenario parameter %r" % parameter)
+    classifiers = dict((factor, scenario_classifier(scenario, factor)[0]) for factor in list(factors) + ["Ranking"])
+    weights = dict((factor, float(scenario.get("weight:" + factor, default_weights[factor]))) for factor in factors)
+    return classifiers, weights
+
+
+# Score the metrics under every scenario.
+# Returns (summary, top_frequency, rankings):
+#   summary: one ordered dictionary per scenario with its parameters, the number of parcels given each ranking, and
+#            "Agreement", the fraction of parcels ranked the same as with the default scoring
+#   top_frequency: per parcel, the fraction of scenarios that gave it the top ranking (1)
+#   rankings: the PRIORITY_RANKING of every parcel (rows) in every scenario (columns), only with keep_rankings
+def sweep(metrics, scenarios, chunk_size=256, keep_rankings=False):
+    for scenario in scenarios:
+        scenario_parameters(scenario)
+    baseline = score_parcels(metrics)["PRIORITY_RANKING"]
+    n_parcels = len(baseline)
+    factors = scored_factors()
+    default_weights = default_scoring()[1]
+
+    # every distinct classifier of each factor is applied once: factor -> (variant key -> column, list of score columns)
+    variants = OrderedDict((factor, (OrderedDict(), [])) for factor in factors)
+    variant_index = np.zeros((len(scenarios), len(factors)), dtype=np.intp)
+    weight_matrix = np.zeros((len(scenarios), len(factors)))
+    ranking_groups = OrderedDict()
+    for number, scenario in enumerate(scenarios):
+        for position, (factor, (metric_field, score_field)) in enumerate(factors.items()):
+            classifier, key = scenario_classifier(scenario, factor)
+            keys, columns = variants[factor]
+            if key not in keys:
+                keys[key] = len(columns)
+                columns.append(classifier(metrics[metric_field]))
+            variant_index[number, position] = keys[key]
+            weight_matrix[number, position] = float(scenario.get("weight:" + factor, default_weights[factor]))
+        classifier, key = scenario_classifier(scenario, "Ranking")
+        ranking_groups.setdefault(key, (classifier, []))[1].append(number)
+    # one row per variant, so a chunk of scenarios gathers whole rows
+    tables = [np.vstack(variants[factor][1]) for factor in factors]
+
+    summary = [None] * len(scenarios)
+    top_count = np.zeros(n_parcels)
+    rankings = np.empty((n_parcels, len(scenarios))) if keep_rankings else None
+    for classifier, members in ranking_groups.values():
+        ranking_values = classifier.scores[~np.isnan(classifier.scores)]
+        top = ranking_values.min() if ranking_values.size else np.nan
+        for start in range(0, len(members), chunk_size):
+            chunk = np.asarray(members[start:start + chunk_size])
+            # priority scores with one row per scenario, classified as the columns of its transpose
+            priority = np.zeros((len(chunk), n_parcels))
+            for position, table in enumerate(tables):
+                priority += table[variant_index[chunk, position]] * weight_matrix[chunk, position][:, None]
+            ranked = classifier.columns(priority.T).T
+
+            top_count += (ranked == top).sum(axis=0)
+            same = (ranked == baseline) | (np.isnan(ranked) & np.isnan(baseline))
+            agreement = same.mean(axis=1) if n_parcels else np.ones(len(chunk))
+            counts = OrderedDict(("Ranked_%g" % value, (ranked == value).sum(axis=1)) for value in np.unique(ranking_values))
+            counts["Unranked"] = np.isnan(ranked).sum(axis=1)
+            for row_number, number in enumerate(chunk):
+                row = OrderedDict(scenarios[number])
+                for field, count in counts.items():
+                    row[field] = int(count[row_number])
+                row["Agreement"] = float(agreement[row_number])
+                summary[number] = row
+            if keep_rankings:
+                rankings[:, chunk] = ranked.T
+
+    top_frequency = top_count / len(scenarios) if scenarios else top_count
+    return summary, top_frequency, rankings
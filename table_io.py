@@ -0,0 +1,94 @@
+#-------------------------------------------------------------------------------
+# Bulk attribute table reading and keyed writing (arcpy)
+#-------------------------------------------------------------------------------
+
+# Reading a table row by row through a SearchCursor and matching rows by position is slow and fragile.
+# These helpers read whole columns into numpy arrays in one call, and write values back in a single cursor pass
+# where every row is matched on its key field (eg. OBJECTID), not on its position in a list.
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Read the requested fields of a table or feature class into a numpy structured array.
+# Null values are replaced by null_value so numeric fields stay numeric.
+def read_table(table, fields, null_value=0):
+    import arcpy
+    if isinstance(fields, str):
+        fields = [fields]
+    nulls = dict((field, null_value) for field in fields)
+    return arcpy.da.TableToNumPyArray(table, fields, skip_nulls=False, null_value=nulls)
+
+
+# Convert an array to a list of python values, NaN becomes None so it is written as a null
+def to_field_values(values):
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        return [None if value != value else value for value in values.tolist()]
+    return values.tolist()
+
+
+# Write one field back to a table in a single UpdateCursor pass. Each row looks up its own value by key,
+# rows whose key is not in keys are left untouched. NaN values are written as null.
+def write_by_key(table, key_field, keys, field, values):
+    import arcpy
+    lookup = dict(zip(np.asarray(keys).tolist(), to_field_values(values)))
+    with arcpy.da.UpdateCursor(table, [key_field, field]) as cursor:
+        for row in cursor:
+            if row[0] in lookup:
+                row[1] = lookup[row[0]]
+                cursor.updateRow(row)
+
+
+# Add several fields to a table in one schema change. AddFields is only available in ArcGIS Pro (2.5 and later),
+# ArcMap falls back to adding them one at a time.
+def add_fields(table, fields, field_type="DOUBLE"):
+    import arcpy
+    existing = set(field.name.lower() for field in arcpy.ListFields(table))
+    new_fields = [field for field in fields if field.lower() not in existing]
+    if not new_fields:
+        return
+    if hasattr(arcpy.management, "AddFields"):
+        arcpy.management.AddFields(table, [[field, field_type] for field in new_fields])
+    else:
+        for field in new_fields:
+            arcpy.AddField_management(table, field, field_type, field_length = 50)
+
+
+# Derived attribute columns kept in memory as numpy arrays, all lined up with one array of keys (eg. the parcel OBJECTIDs).
+# Columns are added as they are computed, then written to the table together: one schema change for the new fields,
+# and one UpdateCursor pass where each row finds its values by key.
+class ColumnStore(object):
+
+    def __init__(self, keys):
+        self.keys = np.asarray(keys)
+        self.columns = OrderedDict()
+
+    def __setitem__(self, field, values):
+        values = np.asarray(values)
+        if values.shape != self.keys.shape:
+            raise ValueError("column %s has %d values, expected one per key (%d)" % (field, values.size, self.keys.size))
+        self.columns[field] = values
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def __contains__(self, field):
+        return field in self.columns
+
+    def fields(self):
+        return list(self.columns.keys())
+
+    # Write every column (or just the given fields) to the table. Rows whose key is not in the store are left untouched,
+    # and NaN values are written as null.
+    def write(self, table, key_field="OBJECTID", fields=None):
+        import arcpy
+        fields = list(fields or self.columns.keys())
+        add_fields(table, fields)
+        lookup = dict(zip(self.keys.tolist(), zip(*[to_field_values(self.columns[field]) for field in fields])))
+        with arcpy.da.UpdateCursor(table, [key_field] + fields) as cursor:
+            for row in cursor:
+                values = lookup.get(row[0])
+                if values is not None:
+                    cursor.updateRow([row[0]] + list(values))
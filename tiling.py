@@ -0,0 +1,110 @@
+#-------------------------------------------------------------------------------
+# Tiled processing of large areas of interest
+#-------------------------------------------------------------------------------
+
+# Clipping, erasing and tabulating a whole county at once can run out of memory (the ArcGIS Topoengine error noted in the
+# script header). In tiled mode the parcels are split along township boundaries into tiles of at most max_parcels parcels,
+# and the factors are computed for one tile at a time. The tile's intermediate datasets are deleted before the next tile
+# starts, so the clips, erases and tabulations of the factors depend on the tile size and not on the size of the area of interest.
+
+# Only the per-parcel metrics are computed in tiles. They are merged into one table for all the parcels before scoring,
+# so decile and quartile breaks are still computed over the whole area of interest and the rankings match a single pass.
+
+# The intact patches are the exception: they are searched for within PATCH_SEARCH_DISTANCE (50 km) of the area of interest,
+# thousands of square kilometers of footprint whatever the size of a tile, and searching again around every tile would repeat
+# that for each one. Instead the patches of the whole search area are built once, before the tiles, as a patch index (see
+# patch_index.py) covering the area of interest buffered by the search distance. It is built in squares of 20 km, so only the
+# footprint of one square is read and erased at a time (the intact patches of the search area are held until they are written),
+# and every tile then only looks up the patches around its parcels. The patches are the same as in a single pass, so the patch
+# sizes are too. The index is kept in patch_folder (tile_patches next to the workspace by default) for the next run of the same
+# area of interest and footprint. Runs given a patch index use it as it is, and runs with the raster engine or a buffered
+# footprint still search the patches around every tile, whose work then grows with the search distance and not the tile size.
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from factors import registered_factors
+from pipeline import PATCH_SEARCH_DISTANCE, compute_metrics, factor_parameters, intermediate_names, metric_fields
+from table_io import ColumnStore
+
+
+# Group parcels into tiles of whole townships. Townships are taken in (MER, RGE, TWP) order, so each tile is a run of
+# neighbouring townships up a range, and a new tile is started whenever the next township would take it over max_parcels.
+# A single township larger than max_parcels (at most 144 quarter sections) becomes a tile of its own.
+# Returns a list of tiles, each a list of (MER, RGE, TWP) tuples.
+def plan_tiles(mer, rge, twp, max_parcels):
+    townships = np.rec.fromarrays([np.asarray(mer), np.asarray(rge), np.asarray(twp)], names="MER,RGE,TWP")
+    unique, counts = np.unique(townships, return_counts=True)
+    tiles = []
+    current = []
+    current_count = 0
+    for township, count in zip(unique.tolist(), counts.tolist()):
+        if current and current_count + count > max_parcels:
+            tiles.append(current)
+            current = []
+            current_count = 0
+        current.append(tuple(township))
+        current_count += count
+    if current:
+        tiles.append(current)
+    return tiles
+
+
+# The patch index of the area of interest buffered by the search distance, built when there is none for this area of interest
+# and footprint in folder yet
+def search_area_patches(backend, inputs, folder):
+    from cache import dataset_identity
+    from patch_index import INDEX_VERSION, build_patch_index, read_description
+    footprint = backend.full_path(inputs.humanFootprint)
+    key = hashlib.sha1(json.dumps([INDEX_VERSION, dataset_identity(footprint), backend.fingerprint(inputs.areaOfInterest), PATCH_SEARCH_DISTANCE],
+                                  sort_keys=True).encode("utf-8")).hexdigest()
+    out = os.path.join(folder, "patches_%s.gpkg" % key)
+    description = read_description(out)
+    if description is None or description.get("version") != INDEX_VERSION:
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        search_area = "Area_Of_Interest_Buffered_Tiles"
+        with backend.stage("patches of the search area"):
+            backend.buffer(inputs.areaOfInterest, search_area, PATCH_SEARCH_DISTANCE, dissolve=True)
+            build_patch_index(footprint, backend.full_path(search_area), out)
+            backend.delete([search_area])
+    return out
+
+
+# compute_metrics for every tile of the parcels dataset, merged back into one ColumnStore keyed by OBJECTID
+# patch_folder is where the patches of the search area are kept (see search_area_patches)
+def compute_metrics_tiled(backend, parcels, inputs, max_parcels, cache=None, parameters=None, factors=None, patch_folder=None):
+    factors = registered_factors() if factors is None else factors
+    parameters = factor_parameters(parameters)
+    patch_settings = parameters["largest_patch"]
+    if not patch_settings["patch_index"] and patch_settings["engine"] == "vector" and not patch_settings["footprint_buffer"]:
+        if patch_folder is None:
+            patch_folder = os.path.join(os.path.dirname(os.path.abspath(backend.workspace)), "tile_patches")
+        patch_settings["patch_index"] = search_area_patches(backend, inputs, patch_folder)
+    table = backend.read_table(parcels, ["OBJECTID", "MER", "RGE", "TWP"])
+    parcel_IDs = np.asarray(table["OBJECTID"])
+    tiles = plan_tiles(table["MER"], table["RGE"], table["TWP"], max_parcels)
+
+    merged = ColumnStore(parcel_IDs)
+    for field in metric_fields(factors):
+        merged[field] = np.zeros(len(parcel_IDs))
+    order = np.argsort(parcel_IDs)
+
+    for number, townships in enumerate(tiles):
+        suffix = "_Tile%d" % number
+        tile = "Parcels" + suffix
+        print("processing tile %d of %d (%d townships)..." % (number + 1, len(tiles), len(townships)))
+        with backend.stage("tile %d" % number, townships=len(townships)):
+            backend.select_townships(parcels, townships, tile)
+            columns = compute_metrics(backend, tile, inputs, suffix, patch_extent=tile, cache=cache, parameters=parameters, factors=factors)
+
+        # tiles do not overlap, so each tile's values go straight into the rows of its own parcels
+        rows = order[np.searchsorted(parcel_IDs, columns.keys, sorter=order)]
+        for field in metric_fields(factors):
+            merged[field][rows] = columns[field]
+
+        backend.delete([tile] + intermediate_names(suffix, factors))
+    return merged